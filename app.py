@@ -1,13 +1,30 @@
 from dash import Dash, dcc, html, page_container
-import dash
-import warnings
 
-# Initialize the app
+# Initialize the app (use_pages imports every module in pages/; none of
+# them loads data at import)
 app = Dash(__name__, use_pages=True, suppress_callback_exceptions=True)
 app.title = "DEXA Dashboard"
 
-# Import pages here
-from pages import overview, body_part_trend
+# Load the data off the import path so the server binds at once; /ready
+# reports when it is loaded (DEXA_WARMUP=lazy|eager changes when)
+from dexa.warmup import register_readiness, start_warmup
+register_readiness(app.server)
+start_warmup()
+
+# Per-callback latency, payload size, errors and cache hits on /metrics
+# (Prometheus text format, local requests only)
+from dexa.metrics import instrument
+instrument(app)
+
+# Opt-in cProfile of selected callback requests (DEXA_PROFILE=<callback>,
+# or an X-Dexa-Profile header matching DEXA_PROFILE_TOKEN); see /profiles
+from dexa.profiling import enable_profiling
+enable_profiling(app)
+
+# Pick up new files in Data/ without restarting workers (one watcher per
+# worker process; DEXA_RELOAD_INTERVAL=0 turns it off)
+from dexa.reload import start_watcher
+start_watcher()
 
 # App Layout
 app.layout = html.Div([
@@ -25,7 +42,8 @@ app.layout = html.Div([
         dcc.Link("Overview", href="/", className='nav-link'),
         dcc.Link("Body Part Trends", href="/body-part-trend", className='nav-link'),
         dcc.Link("Benchmarks", href="/dexa-dashboard", className='nav-link'),
-        dcc.Link("Symmetry", href="/symmetry", className='nav-link')
+        dcc.Link("Symmetry", href="/symmetry", className='nav-link'),
+        dcc.Link("Similar Patients", href="/similar-patients", className='nav-link')
     ], style={
         'textAlign': 'center',
         'padding': '1rem',
@@ -0,0 +1,166 @@
+/*
+ * Clientside callbacks for the Body Part Trends page (pages/body_part_trend.py).
+ *
+ * The server pushes one patient's per-part fat/lean series into the
+ * `body-part-series` store; selecting body parts, restyling the buttons and
+ * rebuilding the traces and stats card all happen here in the browser.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    bodyPartTrend: (function () {
+        var COLORS = ['#3498db', '#e74c3c', '#2ecc71', '#f39c12', '#9b59b6',
+                      '#1abc9c', '#e67e22', '#34495e', '#16a085', '#c0392b'];
+        var SELECTED_STYLE = {
+            border: '2px solid #3498db', backgroundColor: '#3498db', fontWeight: '600', color: 'white'
+        };
+        var UNSELECTED_STYLE = {
+            border: '2px solid #ddd', backgroundColor: 'white', fontWeight: '500', color: '#2c3e50'
+        };
+
+        function component(type, props) {
+            return {namespace: 'dash_html_components', type: type, props: props};
+        }
+
+        function formatRatio(fat, lean) {
+            var ratio = fat / lean;
+            var denominator = ratio < 1 ? Math.round(1 / ratio) : 1;
+            var numerator = Math.round(ratio * denominator * 10) / 10;
+            return numerator.toFixed(1) + ':' + denominator;
+        }
+
+        function formatGrams(value) {
+            return Math.round(value).toLocaleString('en-US') + 'g';
+        }
+
+        function lastValue(values) {
+            return values.length ? values[values.length - 1] : null;
+        }
+
+        return {
+            // Button click -> new selection + button styles
+            toggleParts: function (nClicks, selected, styles) {
+                var ctx = window.dash_clientside.callback_context;
+                var parts = ctx.inputs_list[0].map(function (input) { return input.id.index; });
+                var next = (selected || ['Total']).slice();
+
+                var trigger = ctx.triggered && ctx.triggered[0];
+                if (trigger && trigger.prop_id !== '.' && trigger.value) {
+                    var clicked = JSON.parse(trigger.prop_id.slice(0, trigger.prop_id.lastIndexOf('.'))).index;
+                    if (next.indexOf(clicked) >= 0) {
+                        next.splice(next.indexOf(clicked), 1);
+                    } else if (clicked === 'Total') {
+                        // Total is exclusive
+                        next = ['Total'];
+                    } else {
+                        next = next.filter(function (part) { return part !== 'Total'; });
+                        next.push(clicked);
+                    }
+                    if (!next.length) {
+                        next = ['Total'];
+                    }
+                }
+
+                var newStyles = parts.map(function (part, i) {
+                    var override = next.indexOf(part) >= 0 ? SELECTED_STYLE : UNSELECTED_STYLE;
+                    return Object.assign({}, styles[i], override);
+                });
+                return [next, newStyles];
+            },
+
+            // Series or selection changed -> both figures + stats card
+            renderCharts: function (series, selected, skeletons) {
+                selected = selected || ['Total'];
+                var parts = (series && series.parts) || {};
+                var hasData = series && series.dates.length && selected.some(function (part) {
+                    return parts[part];
+                });
+                if (!hasData) {
+                    var emptyFig = {
+                        data: [],
+                        layout: {
+                            title: {text: 'No data available'},
+                            template: skeletons.mass.layout.template,
+                            xaxis: {visible: false},
+                            yaxis: {visible: false}
+                        }
+                    };
+                    return [emptyFig, emptyFig, [
+                        component('P', {children: 'Select a patient and body part', style: {color: '#7f8c8d'}})
+                    ]];
+                }
+
+                var massTraces = [];
+                var ratioTraces = [];
+                selected.forEach(function (part, i) {
+                    var color = COLORS[i % COLORS.length];
+                    var values = parts[part] || {fat: [], lean: []};
+                    var dates = parts[part] ? series.dates : [];
+                    massTraces.push({
+                        type: 'scatter', x: dates, y: values.fat, name: part + ' - Fat',
+                        line: {color: color, width: 3, dash: 'dot'}, mode: 'lines+markers',
+                        marker: {size: 6}, xaxis: 'x', yaxis: 'y'
+                    });
+                    massTraces.push({
+                        type: 'scatter', x: dates, y: values.lean, name: part + ' - Lean',
+                        line: {color: color, width: 3}, mode: 'lines+markers',
+                        marker: {size: 6}, xaxis: 'x', yaxis: 'y2'
+                    });
+                    ratioTraces.push({
+                        type: 'scatter', x: dates, name: part,
+                        y: values.fat.map(function (fat, j) {
+                            return fat === null || values.lean[j] === null ? null : fat / values.lean[j];
+                        }),
+                        line: {color: color, width: 3}, mode: 'lines+markers', marker: {size: 7}
+                    });
+                });
+
+                var stats = [
+                    component('H4', {children: 'Latest Measurements', style: {
+                        marginBottom: '20px', color: '#2c3e50', fontSize: '18px',
+                        borderBottom: '2px solid #ecf0f1', paddingBottom: '10px'
+                    }}),
+                    component('Div', {children: series.latest_date, style: {
+                        marginBottom: '20px', color: '#7f8c8d', fontSize: '14px', fontStyle: 'italic'
+                    }})
+                ];
+                selected.forEach(function (part, i) {
+                    var fat = parts[part] ? lastValue(parts[part].fat) : null;
+                    var lean = parts[part] ? lastValue(parts[part].lean) : null;
+                    if (fat === null || lean === null) {
+                        return;
+                    }
+                    var row = function (label, value, marginBottom) {
+                        return component('Div', {
+                            children: [
+                                component('Span', {children: label, style: {color: '#7f8c8d', fontSize: '13px'}}),
+                                component('Span', {children: value, style: {fontWeight: 'bold', color: '#2c3e50'}})
+                            ],
+                            style: marginBottom ? {marginBottom: marginBottom} : {}
+                        });
+                    };
+                    stats.push(component('Div', {
+                        children: [
+                            component('Div', {children: part, style: {
+                                fontWeight: '600', color: COLORS[i % COLORS.length],
+                                fontSize: '15px', marginBottom: '8px'
+                            }}),
+                            row('Fat: ', formatGrams(fat), '5px'),
+                            row('Lean: ', formatGrams(lean), '5px'),
+                            row('Ratio: ', formatRatio(fat, lean))
+                        ],
+                        style: {
+                            marginBottom: '20px', paddingBottom: '15px',
+                            borderBottom: i < selected.length - 1 ? '1px solid #ecf0f1' : 'none'
+                        }
+                    }));
+                });
+
+                // Plotly writes into the layout it renders, so hand it a copy
+                return [
+                    {data: massTraces, layout: JSON.parse(JSON.stringify(skeletons.mass.layout))},
+                    {data: ratioTraces, layout: JSON.parse(JSON.stringify(skeletons.ratio.layout))},
+                    stats
+                ];
+            }
+        };
+    })()
+});
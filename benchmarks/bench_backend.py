@@ -0,0 +1,113 @@
+"""
+In-memory DataStore vs. the SQLite backend (dexa.sqlite_store).
+
+Tiles the bundled master data up to each target scan count, writes the
+SQLite database for it, then for --calls random patients times the data
+access each page callback does:
+  overview    patient_master + patient_composition
+  trend       patient_cube
+  benchmarks  patient_benchmark
+  symmetry    patient_symmetry
+  search      search_patients on a 3-character prefix
+and reports the median / p95 per backend. A fresh subprocess per backend
+also reports the resident memory after opening the store and serving one
+patient.
+
+Usage: python benchmarks/bench_backend.py [--scans 565 10000 100000] [--calls 200]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import scaled_master  # noqa: E402
+from dexa.sqlite_store import SqliteStore, write_database  # noqa: E402
+from dexa.store import DataStore, get_store  # noqa: E402
+
+CALLBACKS = {
+    "overview": lambda store, name: (store.patient_master(name), store.patient_composition(name)),
+    "trend": lambda store, name: store.patient_cube(name),
+    "benchmarks": lambda store, name: store.patient_benchmark(name),
+    "symmetry": lambda store, name: store.patient_symmetry(name),
+    "search": lambda store, name: store.search_patients(name[:3].lower()),
+}
+
+
+def latencies(store, patients):
+    """callback -> array of per-call seconds."""
+    result = {}
+    for callback, fn in CALLBACKS.items():
+        times = []
+        for name in patients:
+            start = time.perf_counter()
+            fn(store, name)
+            times.append(time.perf_counter() - start)
+        result[callback] = np.array(times)
+    return result
+
+
+def rss_mib():
+    """Current resident set size (Linux), else the peak."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_rss(backend, n_scans, db_path):
+    """RSS of a fresh process that opens `backend` and serves one patient."""
+    out = subprocess.run([sys.executable, __file__, "--rss", backend, str(n_scans), db_path],
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.split()[-1])
+
+
+def report_rss(backend, n_scans, db_path):
+    import gc
+    if backend == "sqlite":
+        store = SqliteStore(db_path)
+    else:
+        store = DataStore(scaled_master(get_store().master, n_scans), None, None)
+        import dexa.store
+        dexa.store._store = None  # only the scaled store stays referenced
+    CALLBACKS["overview"](store, store.first_patient())
+    gc.collect()
+    print(f"{rss_mib():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, nargs="+", default=[565, 10_000, 100_000])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--rss", nargs=3, metavar=("BACKEND", "SCANS", "DB"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.rss:
+        return report_rss(args.rss[0], int(args.rss[1]), args.rss[2])
+
+    master = get_store().master
+    rng = np.random.default_rng(0)
+    print(f"{'scans':>8} {'callback':<11} {'memory p50/p95 (ms)':>20} {'sqlite p50/p95 (ms)':>20}")
+    for n_scans in args.scans:
+        memory = DataStore(scaled_master(master, n_scans), None, None, version="bench")
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = write_database(memory, os.path.join(tmp, "dexa.sqlite"))
+            sqlite = SqliteStore(db_path)
+            patients = rng.choice(memory.patient_names(), args.calls).tolist()
+            results = {"memory": latencies(memory, patients), "sqlite": latencies(sqlite, patients)}
+            for callback in CALLBACKS:
+                cells = [f"{np.percentile(results[b][callback], 50) * 1e3:.2f} / "
+                         f"{np.percentile(results[b][callback], 95) * 1e3:.2f}" for b in results]
+                print(f"{len(memory.cube.scans):>8,} {callback:<11} {cells[0]:>20} {cells[1]:>20}")
+            print(f"{'':>8} {'worker RSS':<11} {worker_rss('memory', n_scans, db_path):>16.0f} MiB "
+                  f"{worker_rss('sqlite', n_scans, db_path):>16.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Latency, allocation and payload size of every page callback.
+
+Calls the server callbacks directly (no HTTP) for --calls sampled patients:
+  overview    pages.overview.update_page_content
+  trend       pages.body_part_trend.update_series - body part selection is
+              clientside (assets/body_part_trend.js), so the server only
+              ever sees the patient
+  symmetry    pages.Symmetry.update_symmetry_graphs
+  benchmarks  pages.dexa_dashboard_saved.update_benchmark_chart
+and reports p50 / p95 / p99 latency, the peak allocation of one call
+(tracemalloc, measured in a separate pass so tracing doesn't skew the
+timings) and the mean serialized output size. The figure cache is disabled
+so every call computes.
+
+--output writes the results as JSON. --baseline compares them with an
+earlier run: any callback whose p95 latency or peak allocation grew by more
+than --tolerance (relative) is flagged and the exit status is 1.
+
+Runs offline, on the bundled Data/ by default or on generated data
+(dexa.synthetic, written to a temporary folder) with --synthetic.
+
+Usage: python benchmarks/bench_callbacks.py [--calls 200] [--synthetic PATIENTS [--scans 6]]
+                                            [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+os.environ["DEXA_FIGURE_CACHE"] = "0"
+os.environ.setdefault("DEXA_RELOAD_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CALLBACKS = {
+    "overview": ("pages.overview", "update_page_content"),
+    "trend": ("pages.body_part_trend", "update_series"),
+    "symmetry": ("pages.Symmetry", "update_symmetry_graphs"),
+    "benchmarks": ("pages.dexa_dashboard_saved", "update_benchmark_chart"),
+}
+# Metrics compared against the baseline, and the smallest absolute growth
+# that counts (so sub-millisecond noise on fast callbacks isn't flagged)
+COMPARED = {"p95_ms": 1.0, "peak_alloc_kib": 64}
+# Calls traced for the allocation pass
+ALLOC_CALLS = 20
+
+
+def load_callbacks():
+    """name -> callback function, importing the app the way gunicorn does."""
+    import importlib
+    import app  # noqa: F401  (registers the pages)
+    return {name: getattr(importlib.import_module(module), fn)
+            for name, (module, fn) in CALLBACKS.items()}
+
+
+def output_bytes(outputs):
+    import plotly
+    return len(json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def measure(fn, patients):
+    """Latency percentiles, peak allocation and output size of `fn` over `patients`."""
+    fn(patients[0])  # warm-up: first-call imports and lazy setup
+    times, sizes = [], []
+    for name in patients:
+        start = time.perf_counter()
+        outputs = fn(name)
+        times.append(time.perf_counter() - start)
+        sizes.append(output_bytes(outputs))
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for name in patients[:ALLOC_CALLS]:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            fn(name)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    times = np.array(times) * 1e3
+    return {
+        "calls": len(times),
+        "mean_ms": float(times.mean()),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "peak_alloc_kib": float(np.max(peaks) / 1024),
+        "output_bytes": float(np.mean(sizes)),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """(callback, metric, baseline value, new value) for every metric that grew too much."""
+    flagged = []
+    for name, metrics in results["callbacks"].items():
+        before = baseline.get("callbacks", {}).get(name)
+        if before is None:
+            continue
+        for metric, floor in COMPARED.items():
+            old, new = before.get(metric), metrics[metric]
+            if old is not None and new > old * (1 + tolerance) and new - old > floor:
+                flagged.append((name, metric, old, new))
+    return flagged
+
+
+def run(args):
+    from dexa.store import get_store
+
+    callbacks = load_callbacks()
+    store = get_store()
+    rng = np.random.default_rng(args.seed)
+    patients = rng.choice(store.patient_names(), args.calls).tolist()
+    results = {
+        "data": {"source": f"synthetic ({args.synthetic} x {args.scans}, seed {args.seed})"
+                           if args.synthetic else "bundled",
+                 "patients": len(store.patient_names()), "version": store.version},
+        "calls": args.calls,
+        "python": platform.python_version(),
+        "callbacks": {name: measure(fn, patients) for name, fn in callbacks.items()},
+    }
+
+    print(f"{results['data']['source']}: {results['data']['patients']:,} patients, {args.calls} calls")
+    print(f"{'callback':<11} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'peak (KiB)':>11} {'output (B)':>11}")
+    for name, m in results["callbacks"].items():
+        print(f"{name:<11} {m['p50_ms']:>9.2f} {m['p95_ms']:>9.2f} {m['p99_ms']:>9.2f} "
+              f"{m['peak_alloc_kib']:>11,.0f} {m['output_bytes']:>11,.0f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0, help="patient sample (and synthetic data) seed")
+    parser.add_argument("--synthetic", type=int, metavar="PATIENTS",
+                        help="benchmark on this many generated patients instead of Data/")
+    parser.add_argument("--scans", type=int, default=6, help="scans per synthetic patient")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative growth of p95 / peak allocation flagged as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            from dexa import synthetic
+            synthetic.write(*synthetic.generate(args.synthetic, args.scans, args.seed), tmp)
+            # Read when dexa.store is first imported (by load_callbacks)
+            os.environ["DEXA_DATA_DIR"] = tmp
+        results = run(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("data", {}).get("source") != results["data"]["source"]:
+            print(f"Note: baseline ran on {baseline.get('data', {}).get('source')} data")
+        flagged = regressions(results, baseline, args.tolerance)
+        for name, metric, old, new in flagged:
+            print(f"REGRESSION {name} {metric}: {old:,.2f} -> {new:,.2f} ({new / old - 1:+.0%})")
+        if flagged:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
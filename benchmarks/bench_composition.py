@@ -0,0 +1,47 @@
+"""
+Composition indices engine: full derivation and incremental updates.
+
+Tiles the bundled master data up to each target scan count and times:
+  full        - dexa.composition.compute_indices() over every scan
+  incremental - update_indices() when --new-share of the scans are new
+                (the rest already computed), e.g. after a day's ingest
+
+Usage: python benchmarks/bench_composition.py [--scans 565 10000 100000] [--new-share 0.01]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import scaled_master, timed  # noqa: E402
+from dexa.composition import compute_indices, update_indices  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.store import get_store  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, nargs="+", default=[565, 10_000, 100_000])
+    parser.add_argument("--new-share", type=float, default=0.01)
+    args = parser.parse_args()
+
+    master = get_store().master
+    print(f"{'scans':>8} {'full (ms)':>10} {'new scans':>10} {'incremental (ms)':>17}")
+    for n_scans in args.scans:
+        cube = RegionalCube.from_master(scaled_master(master, n_scans))
+        full_s, full = timed(lambda: compute_indices(cube))
+        # Pretend a random share of the scans arrived after the last update
+        rng = np.random.default_rng(0)
+        is_new = rng.random(len(cube.scans)) < args.new_share
+        previous = compute_indices(cube, rows=np.flatnonzero(~is_new))
+        update_s, updated = timed(lambda: update_indices(previous, cube))
+        pd.testing.assert_frame_equal(updated, full)
+        print(f"{len(cube.scans):>8,} {full_s * 1e3:>10.1f} {is_new.sum():>10,} {update_s * 1e3:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Incremental ingest vs. a full rebuild of the store.
+
+Tiles the bundled master data up to each target scan count, then times
+adding --new-scans scans (copies of one patient's latest scan, with new IDs
+and dates) three ways:
+  reload  - parse the appended CSV and build a DataStore from it, i.e. what
+            the hot reload (dexa.reload) does when the CSV was rewritten
+            rather than appended to
+  rebuild - only the DataStore(...) part of that, from already parsed rows
+  ingest  - dexa.ingest.apply_scans() on the existing store (in memory, no
+            CSV append), i.e. what every worker does for appended rows
+and checks ingest and rebuild give the same derived tables. Then times
+--repeat further ingests in a row, each on the previous one's store: the
+median shows the cost staying flat as ingested history piles up, the max
+includes the occasional merge of the delta (dexa.tables.MERGE_SHARE).
+
+Usage: python benchmarks/bench_ingest.py [--scans 565 10000 100000] [--new-scans 1] [--repeat 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import scaled_master, timed  # noqa: E402
+from dexa.ingest import apply_scans, validate_scan_rows  # noqa: E402
+from dexa.store import (DATE_FORMAT, MASTER_SORT, MASTER_TEXT_COLUMNS, DataStore,  # noqa: E402
+                        _parse_csv, get_store)
+
+
+def new_scan_rows(master, n_scans):
+    """`n_scans` new scans for the last patient, as text like a CSV upload."""
+    last = master[master["Unique ID"] == master["Unique ID"].iloc[-1]]
+    rows = []
+    for i in range(n_scans):
+        scan = last.astype(object).copy()
+        scan["Unique ID"] = f"{scan['Unique ID'].iloc[0]}_new{i}"
+        scan["Scan Date"] = (last["Scan Date"] + pd.Timedelta(days=30 * (i + 1))).dt.strftime("%m-%d-%Y")
+        rows.append(scan)
+    return pd.concat(rows, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, nargs="+", default=[565, 10_000, 100_000])
+    parser.add_argument("--new-scans", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    master = get_store().master
+    print(f"{'scans':>8} {'new scans':>10} {'reload (ms)':>12} {'rebuild (ms)':>13} {'ingest (ms)':>12} "
+          f"{'repeat median':>14} {'repeat max':>11}")
+    for n_scans in args.scans:
+        df = scaled_master(master, n_scans)
+        store = DataStore(df, None, None, version="bench")
+        rows = new_scan_rows(df, args.new_scans * (1 + args.repeat))
+        batches = np.array_split(rows["Unique ID"].unique(), 1 + args.repeat)
+        rows, later = (rows[rows["Unique ID"].isin(batches[0])],
+                       [rows[rows["Unique ID"].isin(batch)] for batch in batches[1:]])
+        typed = validate_scan_rows(rows, store)
+
+        combined = pd.concat([df.astype({c: object for c in ("Unique ID", "Patient Name", "Body Part")}),
+                              typed], ignore_index=True)
+        combined = combined.astype({"Patient Name": "category", "Unique ID": "category", "Body Part": "category"})
+        combined = combined.sort_values(MASTER_SORT, kind="stable").reset_index(drop=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "master_dexa_data.csv")
+            combined.to_csv(csv_path, index=False, date_format=DATE_FORMAT)
+            reload_s, _ = timed(lambda: DataStore(_parse_csv(csv_path, MASTER_TEXT_COLUMNS, MASTER_SORT),
+                                                  None, None, version="bench"))
+        rebuild_s, rebuilt = timed(lambda: DataStore(combined, None, None, version="bench"))
+        ingest_s, ingested = timed(lambda: apply_scans(store, typed.copy()))
+
+        np.testing.assert_array_equal(ingested.cube.values, rebuilt.cube.values)
+        for name in ("symmetry", "composition"):
+            left, right = getattr(ingested, name), getattr(rebuilt, name)
+            values = [c for c in left.columns if pd.api.types.is_float_dtype(left[c])]
+            np.testing.assert_allclose(left[values].to_numpy(), right[values].to_numpy(), equal_nan=True)
+        repeats = []
+        for batch in later:
+            typed = validate_scan_rows(batch, ingested)
+            seconds, ingested = timed(lambda: apply_scans(ingested, typed.copy()))
+            repeats.append(seconds)
+        repeats = np.array(repeats or [np.nan]) * 1e3
+        print(f"{len(store.cube.scans):>8,} {args.new_scans:>10,} {reload_s * 1e3:>12.1f} "
+              f"{rebuild_s * 1e3:>13.1f} {ingest_s * 1e3:>12.1f} {np.median(repeats):>14.1f} {repeats.max():>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
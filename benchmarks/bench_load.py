@@ -0,0 +1,79 @@
+"""
+Cold vs warm load time of the master CSV through the snapshot cache.
+
+Builds 1x, 10x and 100x copies of Data/master_dexa_data.csv (patients and
+scan IDs renamed per copy) in a temp folder and times:
+  cold  - parse the CSV as text and write the .npz snapshot
+  warm  - read the snapshot (size/mtime match)
+  touch - CSV mtime changed but content identical (hash check + reuse)
+
+Usage: python benchmarks/bench_load.py [--scales 1 10 100] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dexa.snapshot import snapshot_path  # noqa: E402
+from dexa.store import MASTER_CSV, MASTER_SORT, MASTER_TEXT_COLUMNS, _read_csv  # noqa: E402
+
+
+def make_scaled_csv(scale, folder):
+    base = pd.read_csv(MASTER_CSV, dtype=str)
+    copies = []
+    for i in range(scale):
+        copy = base.copy()
+        copy["Patient Name"] = copy["Patient Name"] + f"_{i}"
+        copy["Unique ID"] = copy["Unique ID"] + f"_{i}"
+        copies.append(copy)
+    path = os.path.join(folder, f"master_x{scale}.csv")
+    pd.concat(copies, ignore_index=True).to_csv(path, index=False)
+    return path
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'scale':>6} {'rows':>9} {'cold (s)':>10} {'warm (s)':>10} {'touch (s)':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in args.scales:
+            path = make_scaled_csv(scale, folder)
+
+            def load():
+                return _read_csv(path, MASTER_TEXT_COLUMNS, MASTER_SORT)
+
+            def cold():
+                if os.path.exists(snapshot_path(path)):
+                    os.unlink(snapshot_path(path))
+                return load()
+
+            def touch():
+                os.utime(path)
+                return load()
+
+            cold_s = timed(cold, args.repeat)
+            warm_s = timed(load, args.repeat)
+            touch_s = timed(touch, args.repeat)
+            rows = len(load()[0])
+            print(f"{scale:>5}x {rows:>9,} {cold_s:>10.3f} {warm_s:>10.3f} {touch_s:>10.3f} {cold_s / warm_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
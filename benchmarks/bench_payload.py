@@ -0,0 +1,76 @@
+"""
+Callback response size and server time per page.
+
+Posts a patient change for every bundled patient to /_dash-update-component
+through the Flask test client (the same JSON the browser receives) and
+reports the mean response bytes, the share taken by figure outputs, and the
+mean server time. The figure cache is disabled so every call recomputes.
+
+Usage: python benchmarks/bench_payload.py [--patients 100]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("DEXA_FIGURE_CACHE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from dexa.store import get_store  # noqa: E402
+
+# page -> (dropdown id, [(output id, property), ...])
+PAGES = {
+    "overview": ("patient-selector", [
+        ("key-metrics-banner", "children"), ("current-status-card", "children"),
+        ("progress-records-card", "children"), ("ratios-card", "children"),
+        ("body-composition-timeline", "figure"), ("weight-lean-trends", "figure"),
+        ("visceral-fat-graph", "figure")]),
+    "symmetry": ("symmetry-patient-dropdown", [
+        ("arm-symmetry-graph", "figure"), ("ribs-symmetry-graph", "figure"),
+        ("leg-symmetry-graph", "figure"), ("symmetry-table", "data")]),
+    "benchmarks": ("patient-selector-benchmark", [
+        ("current-status-card-benchmark", "children"), ("progress-card-benchmark", "children"),
+        ("fat-mass-benchmark-graph", "figure"), ("interpretation-banner-benchmark", "children")]),
+}
+
+
+def request_body(dropdown, outputs, patient):
+    outputs = [{"id": id_, "property": prop} for id_, prop in outputs]
+    return {
+        "output": ".." + "...".join(f"{o['id']}.{o['property']}" for o in outputs) + "..",
+        "outputs": outputs,
+        "inputs": [{"id": dropdown, "property": "value", "value": patient}],
+        "changedPropIds": [f"{dropdown}.value"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patients", type=int, default=100)
+    args = parser.parse_args()
+
+    client = app.app.server.test_client()
+    patients = get_store().patient_names()[:args.patients]
+
+    print(f"{'page':<12}{'response':>12}{'figures':>12}{'server':>12}")
+    for page, (dropdown, outputs) in PAGES.items():
+        sizes, figure_sizes, times = [], [], []
+        for patient in patients:
+            start = time.perf_counter()
+            response = client.post("/_dash-update-component",
+                                   json=request_body(dropdown, outputs, patient))
+            times.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data[:200]
+            payload = json.loads(response.data)["response"]
+            sizes.append(len(response.data))
+            figure_sizes.append(sum(len(json.dumps(props["figure"]))
+                                    for props in payload.values() if "figure" in props))
+        print(f"{page:<12}{statistics.mean(sizes):>10,.0f} B{statistics.mean(figure_sizes):>10,.0f} B"
+              f"{statistics.mean(times) * 1e3:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Cohort percentiles: sorted reference arrays vs scanning the population.
+
+Generates synthetic patients (dexa.synthetic) for each target count and
+times:
+  build   - CohortPercentiles.from_scans() (paid per load)
+  update  - with_patients() for --changed of the patients with new values
+            (an ingest), checked against a build from the changed table
+  scan    - one percentile the direct way: filter the latest scans to the
+            cohort, drop repeats, compare (what a page would do per request)
+  lookup  - CohortPercentiles.percentile(), two binary searches
+  bands   - bands_for() for a patient's scans
+
+Per-call times are averaged over --lookups random (scan, metric) queries.
+
+Usage: python benchmarks/bench_percentiles.py [--patients 100 10000 100000] [--scans 6] [--lookups 200] [--changed 0.001]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import timed  # noqa: E402
+from dexa import synthetic  # noqa: E402
+from dexa.benchmarking import scan_demographics  # noqa: E402
+from dexa.composition import compute_indices, scan_reported  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.percentiles import PERCENTILE_METRICS, CohortPercentiles  # noqa: E402
+
+
+def scan_percentile(composition, demographics, metric, value, sex, age_group):
+    """The same percentile from the full per-scan tables."""
+    in_cohort = (demographics["Sex"] == sex) & (demographics["Age Group"] == age_group)
+    keys = composition["Patient Name"].astype(str) + "|" + demographics["Sex"].astype(str) \
+        + "|" + demographics["Age Group"].astype(str)
+    reference = composition.loc[in_cohort & ~keys.duplicated(keep="last"), metric].dropna().to_numpy()
+    return 100 * ((reference < value).sum() + (reference == value).sum() / 2) / len(reference)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--scans", type=int, default=6, help="scans per patient")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--changed", type=float, default=0.001, help="share of patients updated")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'patients':>9} {'scans':>9} {'build (ms)':>11} {'update (ms)':>12} {'scan (ms)':>10} "
+          f"{'lookup (us)':>12} {'bands (us)':>11}")
+    for n_patients in args.patients:
+        master, composition, benchmark = synthetic.generate(n_patients, args.scans, args.seed)
+        cube = RegionalCube.from_master(master)
+        indices = compute_indices(cube, scan_reported(master, composition))
+        demographics = scan_demographics(master, benchmark)
+        build_s, percentiles = timed(lambda: CohortPercentiles.from_scans(indices, demographics))
+
+        rng = np.random.default_rng(args.seed)
+        # An ingest's worth of patients whose scans changed
+        names = indices["Patient Name"].astype(str)
+        unique_names = names.unique()
+        touched = names.isin(rng.choice(unique_names, max(int(len(unique_names) * args.changed), 1),
+                                        replace=False)).to_numpy()
+        changed = indices.copy()
+        for metric in PERCENTILE_METRICS:
+            changed.loc[touched, metric] *= rng.normal(1, 0.05, touched.sum())
+        old, new = (indices[touched], demographics[touched]), (changed[touched], demographics[touched])
+        update_s, updated = timed(lambda: percentiles.with_patients(old, new))
+        rebuilt = CohortPercentiles.from_scans(changed, demographics)
+        for metric in rebuilt.values:
+            assert np.array_equal(rebuilt.values[metric], updated.values[metric]), metric
+            assert np.allclose(rebuilt.bands[metric], updated.bands[metric], equal_nan=True), metric
+
+        rows = rng.integers(0, len(indices), args.lookups)
+        metrics = rng.choice(PERCENTILE_METRICS, args.lookups)
+        queries = [(metric, indices[metric].iloc[row], demographics["Sex"].iloc[row],
+                    demographics["Age Group"].iloc[row]) for row, metric in zip(rows, metrics)]
+        scan_queries = queries[:max(args.lookups // 10, 1)]  # the slow path gets fewer calls
+        scan_s, expected = timed(lambda: [scan_percentile(indices, demographics, *q) for q in scan_queries])
+        lookup_s, found = timed(lambda: [percentiles.percentile(*q) for q in queries])
+        for want, got in zip(expected, found):
+            assert np.isnan(got) or np.isclose(want, got), (want, got)
+        sexes, ages = demographics["Sex"].iloc[:args.scans], demographics["Age Group"].iloc[:args.scans]
+        bands_s, _ = timed(lambda: [percentiles.bands_for(metric, sexes, ages) for metric in metrics])
+        print(f"{n_patients:>9,} {len(indices):>9,} {build_s * 1e3:>11.1f} {update_s * 1e3:>12.1f} "
+              f"{scan_s / len(scan_queries) * 1e3:>10.2f} {lookup_s / len(queries) * 1e6:>12.1f} "
+              f"{bands_s / len(metrics) * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
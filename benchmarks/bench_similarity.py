@@ -0,0 +1,91 @@
+"""
+Similar-patient search: the KD-tree index vs a brute-force scan.
+
+Generates synthetic patients (dexa.synthetic) for each target count and
+times:
+  build    - SimilarityIndex over every patient's latest scan (once per
+             data version)
+  brute    - the k nearest by computing the distance to every patient
+             (numpy, one pass over the normalized vectors)
+  search   - the same k through the index (nearest_rows)
+  nearest  - SimilarityIndex.nearest(), the search plus the result table
+             the page shows
+  update   - with_patients() for --changed of the patients (an ingest),
+             instead of a rebuild
+Per-query times are averaged over --queries random patients, half of
+them after the update; every index answer is checked against the brute
+force one.
+
+Usage: python benchmarks/bench_similarity.py [--patients 1000 10000 100000] [--scans 6] [--k 10]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import timed  # noqa: E402
+from dexa import synthetic  # noqa: E402
+from dexa.composition import compute_indices, scan_reported  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.similarity import SimilarityIndex, patient_features  # noqa: E402
+
+
+def brute_force(vectors, row, k):
+    """Distances of the k rows nearest vectors[row] (not itself), nearest first."""
+    distances = np.sqrt(((vectors - vectors[row]) ** 2).sum(axis=1))
+    distances[row] = np.inf
+    nearest = np.argpartition(distances, k)[:k]
+    return np.sort(distances[nearest])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--scans", type=int, default=6, help="scans per patient")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--changed", type=float, default=0.01, help="share of patients updated")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'patients':>9} {'build (ms)':>11} {'brute (ms)':>11} {'search (ms)':>12} {'speedup':>8} "
+          f"{'nearest (ms)':>13} {'update (ms)':>12}")
+    for n_patients in args.patients:
+        master, composition, _ = synthetic.generate(n_patients, args.scans, args.seed)
+        cube = RegionalCube.from_master(master)
+        names, dates, features, feature_names = patient_features(
+            cube, compute_indices(cube, scan_reported(master, composition)))
+        build_s, index = timed(lambda: SimilarityIndex(names, dates, features, feature_names))
+
+        # An ingest's worth of patients with a new latest scan
+        rng = np.random.default_rng(args.seed)
+        changed = rng.choice(len(names), max(int(len(names) * args.changed), 1), replace=False)
+        new_features = features.copy()
+        new_features[changed] *= rng.normal(1, 0.02, (len(changed), features.shape[1]))
+        update_s, updated = timed(lambda: index.with_patients(names[changed], dates[changed],
+                                                              new_features[changed]))
+
+        rows = rng.integers(0, len(names), args.queries)
+        before, after = rows[:len(rows) // 2], rows[len(rows) // 2:]
+        vectors = [index.normalize(features), updated.normalize(new_features)]
+        brute_s, expected = timed(lambda: [brute_force(vectors[0], row, args.k) for row in before]
+                                  + [brute_force(vectors[1], row, args.k) for row in after])
+        # k + 1: the nearest row is the patient itself
+        search_s, _ = timed(lambda: [index.nearest_rows(index.points[index.rows[names[row]]], args.k + 1)
+                                     for row in before]
+                            + [updated.nearest_rows(updated.points[updated.rows[names[row]]], args.k + 1)
+                               for row in after])
+        nearest_s, found = timed(lambda: [index.nearest(names[row], args.k) for row in before]
+                                 + [updated.nearest(names[row], args.k) for row in after])
+        for want, got in zip(expected, found):
+            assert np.allclose(want, got["Distance"].to_numpy()), (want, got)
+        print(f"{n_patients:>9,} {build_s * 1e3:>11.1f} {brute_s / len(rows) * 1e3:>11.2f} "
+              f"{search_s / len(rows) * 1e3:>12.2f} {brute_s / search_s:>7.1f}x "
+              f"{nearest_s / len(rows) * 1e3:>13.2f} {update_s * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
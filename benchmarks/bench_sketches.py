@@ -0,0 +1,90 @@
+"""
+Cohort quantile sketches: build, streaming updates, merging and accuracy.
+
+Generates synthetic patients (dexa.synthetic) for each target count,
+holds back --new-share of the scans as "arriving later", and times:
+  rebuild   - sorting the reference population again (CohortPercentiles,
+              what a data change costs without sketches)
+  build     - CohortSketches over the first scans (once, then persisted)
+  stream    - feeding the held-back scans one at a time (per-scan cost)
+  merge     - merging two half-population shard sketches
+and checks every cohort and metric's p10/p50/p90 from the sketches
+against the exact ranks: the worst rank error must stay within the
+stated bound (dexa.sketches.RANK_ERROR).
+
+Usage: python benchmarks/bench_sketches.py [--patients 1000 10000 100000] [--scans 6] [--new-share 0.01]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import timed  # noqa: E402
+from dexa import synthetic  # noqa: E402
+from dexa.benchmarking import compute_benchmarks, scan_demographics  # noqa: E402
+from dexa.composition import compute_indices, scan_reported  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.percentiles import CohortPercentiles  # noqa: E402
+from dexa.sketches import COHORT_COLUMNS, RANK_ERROR, SKETCH_METRICS, CohortSketches  # noqa: E402
+
+QUANTILES = np.array([0.1, 0.5, 0.9])
+
+
+def worst_rank_error(sketches, scans):
+    """Largest |true rank - q| over every cohort, metric and QUANTILES."""
+    worst = 0.0
+    for (sex, age_group), rows in scans.groupby(COHORT_COLUMNS, observed=True):
+        for metric in SKETCH_METRICS:
+            exact = np.sort(rows[metric].dropna().to_numpy())
+            if len(exact) < 2:
+                continue
+            estimates = sketches.quantile(metric, sex, age_group, QUANTILES)
+            below = np.searchsorted(exact, estimates, side="left") / len(exact)
+            at_most = np.searchsorted(exact, estimates, side="right") / len(exact)
+            # Any rank in [below, at_most] is the estimate's rank (ties)
+            error = np.maximum(np.maximum(below - QUANTILES, QUANTILES - at_most), 0)
+            worst = max(worst, error.max())
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--scans", type=int, default=6, help="scans per patient")
+    parser.add_argument("--new-share", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'patients':>9} {'scans':>9} {'rebuild (ms)':>13} {'build (ms)':>11} {'stream (us/scan)':>17} "
+          f"{'merge (ms)':>11} {'rank error':>11}")
+    for n_patients in args.patients:
+        master, composition, benchmark = synthetic.generate(n_patients, args.scans, args.seed)
+        cube = RegionalCube.from_master(master)
+        indices = compute_indices(cube, scan_reported(master, composition))
+        demographics = scan_demographics(master, benchmark)
+        fat_mass = compute_benchmarks(cube, demographics)["TotalBodyFat_g"]
+        scans = indices.assign(**{"Sex": demographics["Sex"], "Age Group": demographics["Age Group"],
+                                  "TotalBodyFat_g": fat_mass})
+
+        rebuild_s, _ = timed(lambda: CohortPercentiles.from_scans(indices, demographics))
+        rng = np.random.default_rng(args.seed)
+        is_new = rng.random(len(scans)) < args.new_share
+        build_s, sketches = timed(lambda: CohortSketches.from_scans(scans[~is_new]))
+        stream_s, _ = timed(lambda: sketches.add_scans(scans[is_new]))
+        half = rng.random(len(scans)) < 0.5
+        shards = [CohortSketches.from_scans(scans[half]), CohortSketches.from_scans(scans[~half])]
+        merge_s, merged = timed(lambda: shards[0].merge(shards[1]))
+
+        error = max(worst_rank_error(sketches, scans), worst_rank_error(merged, scans))
+        assert error <= RANK_ERROR, (error, RANK_ERROR)
+        print(f"{n_patients:>9,} {len(scans):>9,} {rebuild_s * 1e3:>13.1f} {build_s * 1e3:>11.1f} "
+              f"{stream_s / max(is_new.sum(), 1) * 1e6:>17.1f} {merge_s * 1e3:>11.1f} "
+              f"{error:>10.2%}")
+    print(f"Stated bound: {RANK_ERROR:.2%} of n in rank")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-patient summary table vs the per-request card computation it replaced.
+
+Tiles the bundled master data up to each target scan count and times:
+  table      - dexa.summary.compute_summary() over every patient (paid once
+               per load; an ingest only recomputes the touched patients)
+  per request, averaged over --patients sampled patients:
+    legacy   - the old overview code: filter the Total rows, sort, latest /
+               previous rows, idxmax / idxmin, weight range
+    lookup   - the summary row for the patient
+
+Usage: python benchmarks/bench_summary.py [--scans 565 10000 100000] [--patients 200]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import scaled_master, timed  # noqa: E402
+from dexa.composition import compute_indices  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.index import PatientIndex  # noqa: E402
+from dexa.store import get_store  # noqa: E402
+from dexa.summary import compute_summary  # noqa: E402
+
+
+def legacy_cards(patient_master_df, patient_composition_df):
+    """The values the overview cards used to derive on every request."""
+    total_df = patient_master_df[patient_master_df['Body Part'] == 'Total'].sort_values('Scan Date')
+    latest_date = total_df['Scan Date'].max()
+    latest_row = total_df[total_df['Scan Date'] == latest_date].iloc[0]
+    prev_row = total_df.iloc[-2] if len(total_df) > 1 else latest_row
+    latest_comp = patient_composition_df.iloc[-1]
+    prev_comp = patient_composition_df.iloc[-2] if len(patient_composition_df) > 1 else latest_comp
+    return (latest_row, prev_row, latest_comp, prev_comp,
+            total_df['Lean (g)'].max(), total_df.loc[total_df['Lean (g)'].idxmax(), 'Scan Date'],
+            patient_composition_df['Total Body Fat (%)'].min(),
+            patient_composition_df.loc[patient_composition_df['Total Body Fat (%)'].idxmin(), 'Scan Date'],
+            total_df['Total Mass (kg)'].min(), total_df['Total Mass (kg)'].max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, nargs="+", default=[565, 10_000, 100_000])
+    parser.add_argument("--patients", type=int, default=200)
+    args = parser.parse_args()
+
+    master = get_store().master
+    print(f"{'scans':>8} {'patients':>9} {'table (ms)':>11} {'legacy (ms/req)':>16} {'lookup (ms/req)':>16}")
+    for n_scans in args.scans:
+        df = scaled_master(master, n_scans)
+        cube = RegionalCube.from_master(df)
+        composition = compute_indices(cube)
+        table_s, summary = timed(lambda: compute_summary(cube, composition))
+        master_index, composition_index = PatientIndex(df), PatientIndex(composition)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(summary.index.to_numpy(), size=min(args.patients, len(summary)), replace=False)
+
+        def legacy():
+            for name in sample:
+                cards = legacy_cards(master_index.rows(df, name), composition_index.rows(composition, name))
+            return cards
+
+        def lookup():
+            for name in sample:
+                row = summary.loc[name]
+            return row
+
+        legacy_s, cards = timed(legacy)
+        lookup_s, row = timed(lookup)
+        # Spot-check the last sampled patient against the legacy values
+        assert np.isclose(row["records"]["Best Lean (g)"], cards[4])
+        assert row["records"]["Lowest Body Fat Date"] == pd.Timestamp(cards[7])
+        print(f"{len(cube.scans):>8,} {len(summary):>9,} {table_s * 1e3:>11.1f} "
+              f"{legacy_s / len(sample) * 1e3:>16.2f} {lookup_s / len(sample) * 1e3:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
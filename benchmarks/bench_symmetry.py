@@ -0,0 +1,89 @@
+"""
+Symmetry engine vs the per-scan groupby loop it replaced.
+
+Tiles the bundled master data (patients and scan IDs renamed per copy) up
+to each target scan count and times:
+  loop       - the old calculate_symmetry(): groupby("Unique ID") with a
+               set_index and .loc lookups per scan (skipped above --loop-max)
+  vectorized - dexa.symmetry.compute_symmetry() over the regional cube
+  cube       - building the cube itself (paid once per load, shared by pages)
+
+Usage: python benchmarks/bench_symmetry.py [--scans 565 10000 100000] [--loop-max 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.store import get_store  # noqa: E402
+from dexa.symmetry import compute_symmetry  # noqa: E402
+
+
+def legacy_symmetry(df):
+    """The pre-engine implementation from pages/Symmetry.py (lean only)."""
+    symmetry_data = []
+    for unique_id, group in df.groupby("Unique ID", observed=True):
+        row = {"Unique ID": unique_id,
+               "Scan Date": group["Scan Date"].iloc[0],
+               "Patient Name": group["Patient Name"].iloc[0]}
+        body_parts = group.set_index("Body Part")
+        for region in ("Arm", "Ribs", "Leg"):
+            if f"Left {region}" in body_parts.index and f"Right {region}" in body_parts.index:
+                left = body_parts.loc[f"Left {region}", "Lean (g)"]
+                right = body_parts.loc[f"Right {region}", "Lean (g)"]
+                row[f"{region} Symmetry"] = (right - left) / ((left + right) / 2)
+        symmetry_data.append(row)
+    return pd.DataFrame(symmetry_data)
+
+
+def scaled_master(master, n_scans):
+    scans_per_copy = master["Unique ID"].nunique()
+    copies = []
+    for i in range(-(-n_scans // scans_per_copy)):
+        suffix = f"_{i:05d}"
+        copies.append(master.assign(**{
+            "Patient Name": master["Patient Name"].astype(str) + suffix,
+            "Unique ID": master["Unique ID"].astype(str) + suffix,
+        }))
+    df = pd.concat(copies, ignore_index=True)
+    df = df.astype({"Patient Name": "category", "Unique ID": "category", "Body Part": "category"})
+    df = df.sort_values(["Patient Name", "Scan Date", "Body Part"], kind="stable").reset_index(drop=True)
+    return df
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scans", type=int, nargs="+", default=[565, 10_000, 100_000])
+    parser.add_argument("--loop-max", type=int, default=20_000)
+    args = parser.parse_args()
+
+    master = get_store().master
+    print(f"{'scans':>8} {'loop (s)':>10} {'cube (ms)':>10} {'vectorized (ms)':>16}")
+    for n_scans in args.scans:
+        df = scaled_master(master, n_scans)
+        cube_s, cube = timed(lambda: RegionalCube.from_master(df))
+        vec_s, vectorized = timed(lambda: compute_symmetry(cube))
+        loop = "skipped"
+        if len(cube.scans) <= args.loop_max:
+            loop_s, legacy = timed(lambda: legacy_symmetry(df))
+            loop = f"{loop_s:.2f}"
+            merged = legacy.merge(vectorized, on="Unique ID", suffixes=("", "_new"))
+            for col in ("Arm Symmetry", "Leg Symmetry"):
+                assert np.allclose(merged[col], merged[col + "_new"], rtol=0, atol=1e-6), col
+        print(f"{len(cube.scans):>8,} {loop:>10} {cube_s * 1e3:>10.1f} {vec_s * 1e3:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Batch trend fits vs a per-patient loop, and cohort queries on the result.
+
+Generates synthetic patients (dexa.synthetic) for each target count and
+times, over all four trend metrics:
+  loop        - np.polyfit per patient and metric (skipped above --loop-max)
+  ols         - dexa.trends.compute_trends(), least squares
+  theil-sen   - the same with median pairwise slopes
+  improvers   - fastest_improvers() for body fat over the ols table
+  update      - what dexa.trends.advance() does per method after an ingest:
+                re-fit --changed patients (ols) and swap their rows into the
+                table; checked against the full fit
+
+Usage: python benchmarks/bench_trends.py [--patients 100 10000 100000] [--scans 6] [--loop-max 2000] [--changed 1]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_symmetry import timed  # noqa: E402
+from dexa import synthetic  # noqa: E402
+from dexa.composition import compute_indices, scan_reported  # noqa: E402
+from dexa.cube import RegionalCube  # noqa: E402
+from dexa.trends import MONTH_DAYS, TREND_METRICS, _with_rows, compute_trends, fastest_improvers  # noqa: E402
+
+
+def loop_trends(cube, composition):
+    """Slope per patient and metric, one np.polyfit at a time."""
+    total = cube.values[:, cube.part_index["Total"], :]
+    slopes = {}
+    for name in cube.scans["Patient Name"].unique():
+        rows = cube.patient_slice(name)
+        dates = cube.scans["Scan Date"].iloc[rows]
+        months = ((dates - dates.iloc[0]).dt.days / MONTH_DAYS).to_numpy()
+        for metric, source in TREND_METRICS.items():
+            values = (composition[metric].to_numpy()[rows] if source == "composition"
+                      else total[rows, cube.metric_index[metric]].astype(np.float64))
+            ok = ~np.isnan(values)
+            slopes[(name, metric)] = np.polyfit(months[ok], values[ok], 1)[0] if ok.sum() > 1 else np.nan
+    return slopes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--scans", type=int, default=6, help="scans per patient")
+    parser.add_argument("--loop-max", type=int, default=2_000)
+    parser.add_argument("--changed", type=int, default=1, help="patients re-fitted by the update")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'patients':>9} {'scans':>9} {'loop (ms)':>10} {'ols (ms)':>9} {'theil-sen (ms)':>15} "
+          f"{'improvers (ms)':>15} {'update (ms)':>12}")
+    for n_patients in args.patients:
+        master, composition, _ = synthetic.generate(n_patients, args.scans, args.seed)
+        cube = RegionalCube.from_master(master)
+        indices = compute_indices(cube, scan_reported(master, composition))
+        ols_s, ols = timed(lambda: compute_trends(cube, indices))
+        robust_s, _ = timed(lambda: compute_trends(cube, indices, "theil-sen"))
+        query_s, _ = timed(lambda: fastest_improvers(ols, "Total Body Fat (%)", 20))
+        rng = np.random.default_rng(args.seed)
+        changed = rng.choice(ols.index.to_numpy(), min(args.changed, len(ols)), replace=False)
+        positions = np.concatenate([np.arange(cube.patient_slice(name).start, cube.patient_slice(name).stop)
+                                    for name in sorted(changed)])
+        update_s, updated = timed(lambda: _with_rows(ols, compute_trends(
+            cube.subset(positions), indices.iloc[positions].reset_index(drop=True))))
+        assert updated.equals(ols)
+        loop = "skipped"
+        if n_patients <= args.loop_max:
+            loop_s, slopes = timed(lambda: loop_trends(cube, indices))
+            loop = f"{loop_s * 1e3:.0f}"
+            for (name, metric), slope in slopes.items():
+                assert np.isclose(slope, ols.loc[name, (metric, "Slope / Month")], equal_nan=True), (name, metric)
+        print(f"{n_patients:>9,} {len(cube.scans):>9,} {loop:>10} {ols_s * 1e3:>9.1f} "
+              f"{robust_s * 1e3:>15.1f} {query_s * 1e3:>15.1f} {update_s * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
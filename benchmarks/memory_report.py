@@ -0,0 +1,61 @@
+"""
+Per-column memory footprint of the DEXA tables before and after encoding.
+
+"Before" is a plain pd.read_csv of each file (text as Python strings),
+"after" is the store's categorical representation. Sizes are deep, i.e.
+they include the string objects themselves. Dictionaries shared between
+tables (e.g. Unique ID) are counted once per table here, although the
+store holds a single copy.
+
+Usage: python benchmarks/memory_report.py [--all]   (--all also lists numeric columns)
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dexa.store import BENCHMARK_CSV, COMPOSITION_CSV, MASTER_CSV, DataStore  # noqa: E402
+
+
+def column_report(before, after):
+    report = pd.DataFrame({
+        "before_dtype": before.dtypes.astype(str),
+        "before_bytes": before.memory_usage(index=False, deep=True),
+        "after_dtype": after.dtypes.astype(str),
+        "after_bytes": after.memory_usage(index=False, deep=True),
+    })
+    report["saved_pct"] = 100 * (1 - report["after_bytes"] / report["before_bytes"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="include columns whose type did not change")
+    args = parser.parse_args()
+
+    store = DataStore.from_csv()
+    tables = [
+        ("master", MASTER_CSV, store.master),
+        ("composition", COMPOSITION_CSV, store.composition),
+        ("benchmark", BENCHMARK_CSV, store.benchmark),
+    ]
+    pd.set_option("display.width", 200)
+    total_before = total_after = 0
+    for name, path, after in tables:
+        before = pd.read_csv(path, encoding="utf-8-sig")
+        report = column_report(before, after)
+        total_before += report["before_bytes"].sum()
+        total_after += report["after_bytes"].sum()
+        shown = report if args.all else report[report["before_dtype"] != report["after_dtype"]]
+        print(f"\n== {name} ({len(after):,} rows): "
+              f"{report['before_bytes'].sum() / 1024:,.0f} KiB -> {report['after_bytes'].sum() / 1024:,.0f} KiB")
+        print(shown.to_string(float_format=lambda v: f"{v:.1f}"))
+    print(f"\nAll tables: {total_before / 1024:,.0f} KiB -> {total_after / 1024:,.0f} KiB "
+          f"({100 * (1 - total_after / total_before):.1f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Where a worker's cold start goes, import by import and step by step.
+
+1. Imports: runs `python -X importtime -c "import app"` in a fresh
+   interpreter (DEXA_WARMUP=lazy, so no data is loaded) and lists the
+   cumulative time of each module imported directly by app or a page
+   (which includes the packages it is first to import, e.g. pandas under
+   whichever module imports it first), of each dexa module, and of the
+   app and page module bodies themselves.
+2. Data: loads the store in this process and lists each load step
+   (dexa.store.load_timings: CSV/snapshot reads, cube, symmetry, ...).
+3. First request: builds each page layout and runs the overview callback
+   once, i.e. what the first visitor waits for on top of the load.
+
+"Serving" is when the server can bind (the import is done); "ready" is
+when /ready turns 200 with DEXA_WARMUP=background (import + load).
+
+Usage: python benchmarks/startup_report.py [--top 15]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["DEXA_WARMUP"] = "lazy"
+os.environ.setdefault("DEXA_RELOAD_INTERVAL", "0")
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def import_times():
+    """[(module, depth, self seconds, cumulative seconds)] for `import app`, in import order."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                            env=dict(os.environ), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            rows.append((module, (len(indent) - 1) // 2, int(own) / 1e6, int(cumulative) / 1e6))
+    return rows
+
+
+def report_imports(top):
+    rows = import_times()
+    own, total = next((own, cumulative) for module, _, own, cumulative in rows if module == "app")
+    # Pages are executed by Dash (not imported by name), so their imports
+    # show up as app's direct (depth 1) imports and their bodies in app's
+    # own time
+    direct = sorted(((cumulative, module) for module, depth, _, cumulative in rows if depth == 1),
+                    reverse=True)
+    ours = sorted(((cumulative, module) for module, depth, _, cumulative in rows
+                   if module.startswith("dexa.") and depth > 1), reverse=True)
+    print(f"Imports (import app: {total * 1e3:.0f} ms)")
+    for seconds, module in direct[:top]:
+        print(f"  {module:<36} {seconds * 1e3:>8.1f} ms")
+    print(f"  {'app + page module bodies':<36} {own * 1e3:>8.1f} ms")
+    print("  dexa modules imported by the above:")
+    for seconds, module in ours[:top]:
+        print(f"    {module:<34} {seconds * 1e3:>8.1f} ms")
+    return total
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="modules listed per section")
+    args = parser.parse_args()
+
+    import_s = report_imports(args.top)
+
+    import app  # noqa: F401
+    from dexa import store as data_store
+    load_s, store = timed(data_store.load_store)
+    data_store.set_store(store)
+    print(f"\nData load ({data_store.BACKEND}, {len(store.patient_names()):,} patients): {load_s * 1e3:.0f} ms")
+    for step, seconds in data_store.load_timings.items():
+        print(f"  {step:<36} {seconds * 1e3:>8.1f} ms")
+
+    import dash
+    print("\nFirst request")
+    for page in dash.page_registry.values():
+        if callable(page["layout"]):
+            seconds, _ = timed(page["layout"])
+            print(f"  layout {page['path']:<29} {seconds * 1e3:>8.1f} ms")
+    from pages.overview import update_page_content
+    seconds, _ = timed(lambda: update_page_content(store.first_patient()))
+    print(f"  {'overview callback (cold)':<36} {seconds * 1e3:>8.1f} ms")
+
+    print(f"\nServing after {import_s:.2f}s; ready after {import_s + load_s:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
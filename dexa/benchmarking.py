@@ -0,0 +1,196 @@
+"""
+Total body fat mass benchmarked against NHANES reference medians.
+
+Replaces the offline step that produced fat_mass_benchmark_results.csv.
+The NHANES statistics are a dense float array indexed by (sex, age group,
+ethnicity) codes. Benchmarking every scan is then one array lookup plus
+vectorized arithmetic. np.select labels each scan from its difference
+to the median:
+
+    |diff| < 5%          Within Expected
+    5% <= |diff| < 15%   Above / Below Expected
+    |diff| >= 15%        Well Above / Well Below Expected
+    no reference median  No Comparison
+
+Coverage: NHANES_FAT_MASS is not the full NHANES reference. It holds
+only the sex / age group / ethnicity groups that occurred in the old
+export CSV (18 with reference values, e.g. no Male / Black and no one
+over 69). Every other group is "No Comparison", and no_reference_message()
+says so by name instead of implying that NHANES has no data for it.
+Extending coverage means adding rows to the table.
+
+Interpretations and patient messages are plain text derived from those
+columns. They are built on demand for the rows a page shows
+(interpretation(), patient_message()) instead of being stored per scan.
+"""
+import numpy as np
+import pandas as pd
+
+# NHANES 2003-2004 total body fat mass (g) by sex, age group and ethnicity:
+# (sex, age group, ethnicity, median, mean, std, n). A group with n = 0 has
+# no reference values. Only the groups of the old export - see the module
+# docstring.
+NHANES_FAT_MASS = [
+    ("Female", "18-29", "Black", 29436.6, 30563.39039106145, 15117.046188350909, 895),
+    ("Female", "18-29", "White", 23684.65, 26387.32361111111, 12072.608741007296, 1080),
+    ("Female", "30-39", "Other Hispanic", 26796.6, 28134.9125, 8922.8487618688, 80),
+    ("Female", "30-39", "White", 26242.3, 29114.09317460317, 12334.382426405777, 630),
+    ("Female", "40-49", "Black", 32883.9, 35092.5566972477, 12932.892069685578, 545),
+    ("Female", "40-49", "Other", 25324.6, 28740.1576, 11244.29369190797, 125),
+    ("Female", "40-49", "Other Hispanic", 30494.6, 32021.631666666668, 12085.8737324241, 60),
+    ("Female", "40-49", "White", 28823.5, 32109.30994475138, 13674.733707986705, 905),
+    ("Female", "50-59", "Other Hispanic", 28455.45, 29530.142, 11037.053778404075, 50),
+    ("Female", "50-59", "White", 32005.4, 33431.61037037037, 12924.667274377538, 810),
+    ("Female", "60-69", "Black", 36995.9, 39386.57119047619, 15058.07084631536, 420),
+    ("Female", "60-69", "White", 32918.9, 34537.32476821192, 13059.220475413022, 755),
+    ("Female", "70-79", "White", np.nan, np.nan, np.nan, 0),
+    ("Male", "18-29", "White", 18102.9, 21431.461238938053, 11703.226843586252, 1130),
+    ("Male", "30-39", "Other", 20790.0, 22826.51619047619, 9600.53235844767, 105),
+    ("Male", "30-39", "White", 23378.2, 25020.017325581397, 11005.059948875218, 860),
+    ("Male", "40-49", "White", 26458.4, 28105.12358695652, 10839.369783146883, 920),
+    ("Male", "50-59", "White", 27190.1, 27782.491612903224, 10532.556491757909, 930),
+    ("Male", "60-69", "White", 27317.4, 28685.612222222226, 9180.966486783938, 720),
+]
+REFERENCE_COLUMNS = ["NHANES_Median_FatMass_g", "NHANES_Mean_FatMass_g",
+                     "NHANES_Std_FatMass_g", "NHANES_N"]
+DEMOGRAPHIC_COLUMNS = ["Sex", "Age Group", "Ethnicity"]
+
+# Age (years) -> NHANES age group
+AGE_BINS = [18, 30, 40, 50, 60, 70, 80, np.inf]
+AGE_GROUPS = ["18-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80+"]
+
+# Categories in code order; CATEGORY_NONE is the default of np.select
+CATEGORIES = [
+    "🔵 Well Below Expected",
+    "🟦 Below Expected",
+    "🟢 Within Expected",
+    "🟧 Above Expected",
+    "🔴 Well Above Expected",
+    "⚪ No Comparison",
+]
+CATEGORY_NONE = len(CATEGORIES) - 1
+WITHIN_PERCENT = 5
+WELL_PERCENT = 15
+INTERPRETATIONS = {
+    "🔵 Well Below Expected": "Total body fat is notably below the typical range.",
+    "🟦 Below Expected": "Total body fat is slightly below the typical range.",
+    "🟢 Within Expected": "Total body fat is within the expected range.",
+    "🟧 Above Expected": "Total body fat is slightly above the typical range.",
+    "🔴 Well Above Expected": "Total body fat is notably above the typical range.",
+    "⚪ No Comparison": "No reference median for this sex, age group and ethnicity "
+                        "in the NHANES table bundled with the dashboard.",
+}
+REFERENCE_GROUPS = sum(1 for row in NHANES_FAT_MASS if row[-1] > 0)
+
+
+class ReferenceTable:
+    """
+    stats[sex, age group, ethnicity] = REFERENCE_COLUMNS values, with one
+    extra all-NaN slot on each axis that unknown labels are mapped to.
+    """
+
+    def __init__(self, rows=NHANES_FAT_MASS):
+        self.sexes = sorted({row[0] for row in rows})
+        self.age_groups = sorted({row[1] for row in rows})
+        self.ethnicities = sorted({row[2] for row in rows})
+        self.stats = np.full((len(self.sexes) + 1, len(self.age_groups) + 1,
+                              len(self.ethnicities) + 1, len(REFERENCE_COLUMNS)), np.nan)
+        for sex, age_group, ethnicity, *values in rows:
+            self.stats[self.sexes.index(sex), self.age_groups.index(age_group),
+                       self.ethnicities.index(ethnicity)] = values
+
+    @staticmethod
+    def _codes(values, labels):
+        # Unknown or missing labels get code -1, i.e. the trailing NaN slot
+        return pd.Categorical(np.asarray(values, dtype=object), categories=labels).codes
+
+    def lookup(self, sex, age_group, ethnicity):
+        """(n, len(REFERENCE_COLUMNS)) reference values for n demographics."""
+        return self.stats[self._codes(sex, self.sexes),
+                          self._codes(age_group, self.age_groups),
+                          self._codes(ethnicity, self.ethnicities)]
+
+
+_reference = ReferenceTable()
+
+
+def age_group(age):
+    """NHANES age group label for each age (None below 18 or missing)."""
+    return pd.cut(pd.Series(age, dtype=np.float64), AGE_BINS, right=False, labels=AGE_GROUPS)
+
+
+def scan_demographics(master, benchmark=None):
+    """
+    Sex / Age Group / Ethnicity per scan, in cube.scans order. Taken from
+    master (age binned into groups) where present, else from the latest row
+    of an exported benchmark table for the same patient.
+    """
+    first = master.drop_duplicates("Unique ID")
+    demographics = pd.DataFrame({
+        "Sex": first["Sex"].astype(object).to_numpy() if "Sex" in first else None,
+        "Age Group": (age_group(first["Age"].to_numpy()).astype(object).to_numpy()
+                      if "Age" in first else None),
+        "Ethnicity": first["Ethnicity"].astype(object).to_numpy() if "Ethnicity" in first else None,
+    }, index=first["Patient Name"].astype(str).to_numpy())
+    if benchmark is not None and not benchmark.empty:
+        exported = benchmark.drop_duplicates("Patient Name", keep="last")
+        exported = exported.set_index(exported["Patient Name"].astype(str))
+        exported = exported[[c for c in DEMOGRAPHIC_COLUMNS if c in exported]].astype(object)
+        demographics = demographics.fillna(exported.reindex(demographics.index))
+    return demographics.reset_index(drop=True)
+
+
+def compute_benchmarks(cube, demographics):
+    """
+    One row per scan, aligned with cube.scans: demographics, total fat mass,
+    the NHANES reference for the scan's group, the difference to the median
+    and the Category label (categorical over CATEGORIES).
+    """
+    fat_g = cube.get("Fat (g)", "Total").astype(np.float64)
+    reference = _reference.lookup(demographics["Sex"], demographics["Age Group"],
+                                  demographics["Ethnicity"])
+    median = reference[:, 0]
+    with np.errstate(invalid="ignore"):
+        diff_g = fat_g - median
+        diff_percent = diff_g / median * 100
+        category = np.select(
+            [diff_percent <= -WELL_PERCENT,
+             diff_percent <= -WITHIN_PERCENT,
+             diff_percent < WITHIN_PERCENT,
+             diff_percent < WELL_PERCENT,
+             diff_percent >= WELL_PERCENT],
+            np.arange(CATEGORY_NONE),
+            default=CATEGORY_NONE,
+        )
+
+    benchmarks = cube.scans.copy()
+    for column in DEMOGRAPHIC_COLUMNS:
+        benchmarks[column] = pd.Categorical(demographics[column])
+    benchmarks["TotalBodyFat_g"] = fat_g
+    benchmarks["TotalBodyFat_percent"] = cube.get("% Fat", "Total").astype(np.float64)
+    for k, column in enumerate(REFERENCE_COLUMNS):
+        benchmarks[column] = reference[:, k]
+    benchmarks["FatMass_vs_Median_g"] = diff_g
+    benchmarks["FatMass_vs_Median_percent"] = diff_percent
+    benchmarks["Category"] = pd.Categorical.from_codes(category, CATEGORIES)
+    return benchmarks
+
+
+def interpretation(category):
+    return INTERPRETATIONS.get(category, "No interpretation available")
+
+
+def no_reference_message(sex, age_group, ethnicity):
+    """Why a scan is "No Comparison": its group is not in the bundled table."""
+    return (f"No NHANES reference median for {sex}, {age_group}, {ethnicity}: the bundled table "
+            f"only covers the {REFERENCE_GROUPS} groups of the original export, not this one.")
+
+
+def patient_message(row):
+    """One-line summary for a benchmark row, as shown to patients."""
+    demographics = f"{row['Sex']}, {row['Age Group']}, {row['Ethnicity']}"
+    if row["Category"] == CATEGORIES[CATEGORY_NONE]:
+        return f"{row['Patient Name']}: " + no_reference_message(row['Sex'], row['Age Group'], row['Ethnicity'])
+    return (f"{row['Patient Name']} ({demographics}): "
+            f"{row['TotalBodyFat_g']:,.0f}g fat mass vs. {row['NHANES_Median_FatMass_g']:,.0f}g median "
+            f"({row['FatMass_vs_Median_percent']:+.1f}%). {interpretation(row['Category'])}")
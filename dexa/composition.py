@@ -0,0 +1,172 @@
+"""
+Composition indices for every scan in one vectorized pass over the cube.
+
+Replaces the offline notebook that produced composition_indices.csv. What
+the regional rows determine is derived here for all scans at once:
+
+    Total Body Weight (kg)   Total mass
+    Total Body Fat (%)       Total % fat
+    Total Lean Body (%)      100 - body fat %
+    Total Bone Mass (%)      total BMC / total tissue mass
+    Trunk/Legs Fat Ratio     trunk fat / leg fat
+    Trunk/Limb Fat Mass      trunk fat / (arm + leg) fat
+    FMI, LMI, ALMI           fat / lean / appendicular lean kg per height m²
+    BMI                      weight / height m²
+    Visceral Fat Mass/Volume from the visceral fat area
+
+The height-based indices need the patient's Height (in) and Weight (lb).
+The scanner's own readings cover the rest: Android/Gynoid ratio, visceral
+and subcutaneous fat area, and BMR. Both come in as `reported` values, one
+row per scan. A derived value wins wherever it can be computed; otherwise
+the reported value is used as-is.
+"""
+import numpy as np
+import pandas as pd
+
+SCAN_COLUMNS = ["Unique ID", "Patient Name", "Scan Date"]
+# Output columns, in composition_indices.csv order
+INDEX_COLUMNS = [
+    "Total Body Weight (kg)", "BMI (kg/m²)", "Basal Metabolic Rate (kcal/day)",
+    "Total Body Fat (%)", "Fat Mass Index (FMI)", "Android/Gynoid Fat Ratio",
+    "Trunk/Legs Fat Ratio", "Trunk/Limb Fat Mass Ratio", "Visceral Fat Area (cm²)",
+    "Visceral Fat Mass (g)", "Visceral Fat Volume (cm³)", "Subcutaneous Fat Area (cm²)",
+    "Total Lean Body (%)", "Lean Mass Index (kg/m²)", "Appendicular Lean Mass Index (kg/m²)",
+    "Total Bone Mass (%)",
+]
+# Patient measurements (imperial, as entered at the scanner) used for the
+# height-based indices
+HEIGHT_COLUMN = "Height"
+WEIGHT_COLUMN = "Weight"
+INPUT_COLUMNS = [HEIGHT_COLUMN, WEIGHT_COLUMN]
+
+INCH_M = 0.0254
+POUND_KG = 0.45359237
+# Scanner conversion of visceral fat area to mass (g per cm²) and of mass
+# to volume (cm³ per g, i.e. a density of 0.925 g/cm³)
+VISCERAL_MASS_PER_AREA = 4.821285
+VISCERAL_VOLUME_PER_MASS = 1.081081
+
+
+def scan_reported(master, composition=None):
+    """
+    One row per scan, in master's order of first appearance (= cube.scans
+    order): the reported index values and patient inputs found in master,
+    with gaps filled from a previously exported composition table.
+    """
+    first = master.drop_duplicates("Unique ID")
+    scan_ids = first["Unique ID"].astype(str).to_numpy()
+    columns = [c for c in INPUT_COLUMNS + INDEX_COLUMNS if c in first]
+    reported = pd.DataFrame(first[columns].to_numpy(dtype=np.float64),
+                            columns=columns, index=scan_ids)
+    if composition is not None and not composition.empty:
+        exported = composition.drop_duplicates("Unique ID")
+        exported = exported.set_index(exported["Unique ID"].astype(str))
+        exported = exported[[c for c in INDEX_COLUMNS if c in exported]]
+        reported = reported.combine_first(exported.reindex(scan_ids).astype(np.float64))
+    return reported.reset_index(drop=True)
+
+
+def _part(cube, values, metric, part):
+    """values[:, part, metric] in float64, all-NaN if the cube lacks either."""
+    if metric not in cube.metric_index or part not in cube.part_index:
+        return np.full(len(values), np.nan)
+    return values[:, cube.part_index[part], cube.metric_index[metric]].astype(np.float64)
+
+
+def _pair(cube, values, metric, region):
+    return _part(cube, values, metric, f"Left {region}") + _part(cube, values, metric, f"Right {region}")
+
+
+def compute_indices(cube, reported=None, rows=None):
+    """
+    Scan columns plus INDEX_COLUMNS for the scans at positions `rows`
+    (default: all), aligned with cube.scans. `reported` is row-aligned with
+    cube.scans (see scan_reported).
+    """
+    rows = np.arange(len(cube.scans)) if rows is None else np.asarray(rows, dtype=np.intp)
+    values = cube.values[rows]
+    reported = (reported.iloc[rows].reset_index(drop=True) if reported is not None
+                else pd.DataFrame(index=range(len(rows))))
+
+    def given(column):
+        if column in reported:
+            return reported[column].to_numpy(dtype=np.float64)
+        return np.full(len(rows), np.nan)
+
+    fat = _part(cube, values, "Fat (g)", "Total")
+    lean = _part(cube, values, "Lean (g)", "Total")
+    tissues = _part(cube, values, "Tissues (g)", "Total")
+    # Total BMC is often left blank; SubTotal + Head covers the whole body
+    bmc = _part(cube, values, "BMC (g)", "Total")
+    bmc = np.where(np.isnan(bmc),
+                   _part(cube, values, "BMC (g)", "SubTotal") + _part(cube, values, "BMC (g)", "Head"),
+                   bmc)
+    trunk_fat = _part(cube, values, "Fat (g)", "Trunk")
+    leg_fat = _pair(cube, values, "Fat (g)", "Leg")
+    arm_fat = _pair(cube, values, "Fat (g)", "Arm")
+    appendicular_lean = _pair(cube, values, "Lean (g)", "Arm") + _pair(cube, values, "Lean (g)", "Leg")
+    height_m2 = (given(HEIGHT_COLUMN) * INCH_M) ** 2
+    body_fat = _part(cube, values, "% Fat", "Total")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derived = {
+            "Total Body Weight (kg)": _part(cube, values, "Total Mass (kg)", "Total"),
+            "BMI (kg/m²)": given(WEIGHT_COLUMN) * POUND_KG / height_m2,
+            "Total Body Fat (%)": body_fat,
+            "Fat Mass Index (FMI)": fat / 1000 / height_m2,
+            "Trunk/Legs Fat Ratio": trunk_fat / leg_fat,
+            "Trunk/Limb Fat Mass Ratio": trunk_fat / (arm_fat + leg_fat),
+            "Total Lean Body (%)": 100 - body_fat,
+            "Lean Mass Index (kg/m²)": lean / 1000 / height_m2,
+            "Appendicular Lean Mass Index (kg/m²)": appendicular_lean / 1000 / height_m2,
+            "Total Bone Mass (%)": bmc / tissues * 100,
+        }
+
+    indices = cube.scans.iloc[rows][SCAN_COLUMNS].reset_index(drop=True)
+    for column in INDEX_COLUMNS:
+        if column in derived:
+            value = derived[column]
+            indices[column] = np.where(np.isnan(value), given(column), value)
+        elif column == "Visceral Fat Mass (g)":
+            mass = indices["Visceral Fat Area (cm²)"].to_numpy() * VISCERAL_MASS_PER_AREA
+            indices[column] = np.where(np.isnan(mass), given(column), mass)
+        elif column == "Visceral Fat Volume (cm³)":
+            volume = indices["Visceral Fat Mass (g)"].to_numpy() * VISCERAL_VOLUME_PER_MASS
+            indices[column] = np.where(np.isnan(volume), given(column), volume)
+        else:
+            indices[column] = given(column)
+    return indices
+
+
+def _cube_rows(scan_ids, cube):
+    """cube.scans position of each scan ID (float, NaN if not in the cube)."""
+    cube_ids = cube.scans["Unique ID"]
+    if isinstance(scan_ids.dtype, pd.CategoricalDtype) and scan_ids.dtype == cube_ids.dtype:
+        # Shared dictionary: translate codes through one lookup array
+        lookup = np.full(len(cube_ids.cat.categories) + 1, np.nan)
+        lookup[cube_ids.cat.codes.to_numpy()] = np.arange(len(cube_ids))
+        return lookup[scan_ids.cat.codes.to_numpy()]
+    return scan_ids.map(cube.scan_index).to_numpy(dtype=np.float64)
+
+
+def update_indices(indices, cube, reported=None):
+    """
+    `indices` brought up to date with the cube: only scans it does not cover
+    yet are computed; the result is row-aligned with cube.scans again.
+    Scans no longer in the cube are dropped.
+    """
+    cube_rows = _cube_rows(indices["Unique ID"], cube)
+    kept = ~np.isnan(cube_rows)
+    # source[i] = row of indices holding cube scan i, or -1 if it is new
+    source = np.full(len(cube.scans), -1, dtype=np.intp)
+    source[cube_rows[kept].astype(np.intp)] = np.flatnonzero(kept)
+    new = np.flatnonzero(source < 0)
+    if len(new) == 0 and np.array_equal(source, np.arange(len(indices))):
+        return indices
+    added = compute_indices(cube, reported, rows=new)
+    # Existing rows keep their values; new ones slot in at their cube position
+    source[new] = len(indices) + np.arange(len(new))
+    values = np.concatenate([indices[INDEX_COLUMNS].to_numpy(dtype=np.float64),
+                             added[INDEX_COLUMNS].to_numpy(dtype=np.float64)])[source]
+    return pd.concat([cube.scans[SCAN_COLUMNS].reset_index(drop=True),
+                      pd.DataFrame(values, columns=INDEX_COLUMNS)], axis=1)
@@ -0,0 +1,89 @@
+"""
+Dense scan x body-part x metric array of the regional DEXA data.
+
+master_dexa_data.csv is long format (one row per scan and body part). The
+cube scatters it once into a float32 array of shape (scans, parts, metrics)
+so any body-part or metric slice across any number of scans is a single
+array index instead of a filter or groupby. Missing measurements (e.g. BMC
+for Trunk and Total) are NaN.
+"""
+import numpy as np
+import pandas as pd
+
+from dexa.index import PatientIndex
+
+# Canonical body part order; parts outside this list are appended after it
+BODY_PARTS = ['Head', 'Left Arm', 'Right Arm', 'Trunk', 'Left Leg', 'Right Leg', 'SubTotal', 'Total']
+METRICS = ['% Fat', 'Fat (g)', 'Lean (g)', 'BMC (g)', 'Tissues (g)', 'Total Mass (kg)']
+
+
+class RegionalCube:
+    """
+    values[scan, part, metric] as float32, plus index maps:
+
+    scans        - DataFrame of Unique ID / Patient Name / Scan Date, one row
+                   per scan, sorted by patient then date (row i = values[i])
+    scan_index   - Unique ID -> scan position
+    patient_index - dexa.index.PatientIndex of each patient's scan range
+    part_index   - body part -> part position
+    metric_index - metric -> metric position
+    """
+
+    def __init__(self, values, scans, parts, metrics=METRICS, patient_index=None):
+        self.values = values
+        self.scans = scans
+        self.parts = list(parts)
+        self.metrics = list(metrics)
+        self.scan_index = {scan_id: i for i, scan_id in enumerate(scans["Unique ID"])}
+        self.part_index = {part: j for j, part in enumerate(self.parts)}
+        self.metric_index = {metric: k for k, metric in enumerate(self.metrics)}
+        # Passed in when already known (e.g. offset by dexa.tables.merge)
+        self.patient_index = patient_index if patient_index is not None else PatientIndex(scans)
+
+    @classmethod
+    def from_master(cls, master, metrics=METRICS, parts=None):
+        """
+        Build from long-format master rows sorted by (patient, date, part).
+        `parts` fixes the part axis (e.g. to match another cube); by default
+        it holds the parts observed, in BODY_PARTS order.
+        """
+        # Scan position = order of first appearance, which keeps each
+        # patient's scans contiguous and in date order
+        scan_pos, _ = pd.factorize(master["Unique ID"], sort=False)
+        _, first_rows = np.unique(scan_pos, return_index=True)
+
+        body_part = pd.Categorical(master["Body Part"])
+        observed = set(body_part.categories[np.unique(body_part.codes[body_part.codes >= 0])])
+        if parts is None:
+            parts = [p for p in BODY_PARTS if p in observed] + sorted(observed - set(BODY_PARTS))
+        # Translate the body part codes straight into part positions
+        lookup = np.array([parts.index(c) if c in observed and c in parts else -1
+                           for c in body_part.categories] + [-1])
+        part_pos = lookup[body_part.codes]
+
+        values = np.full((len(first_rows), len(parts), len(metrics)), np.nan, dtype=np.float32)
+        known = part_pos >= 0
+        values[scan_pos[known], part_pos[known]] = master[metrics].to_numpy(dtype=np.float32)[known]
+
+        scans = master.iloc[first_rows][["Unique ID", "Patient Name", "Scan Date"]].reset_index(drop=True)
+        return cls(values, scans, parts, metrics)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def get(self, metric, part=None):
+        """values[:, part, metric] (or [:, :, metric] with no part) as a view."""
+        k = self.metric_index[metric]
+        if part is None:
+            return self.values[:, :, k]
+        return self.values[:, self.part_index[part], k]
+
+    def subset(self, scans):
+        """Cube of the scans at `scans` (a slice or positions along the scan axis)."""
+        return RegionalCube(self.values[scans], self.scans.iloc[scans].reset_index(drop=True),
+                            self.parts, self.metrics)
+
+    def patient_slice(self, name):
+        """slice over the scan axis covering one patient's scans (date order)."""
+        return slice(*self.patient_index.range(name))
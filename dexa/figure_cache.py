@@ -0,0 +1,252 @@
+"""
+Two-tier cache of serialized callback outputs (figures, cards, tables).
+
+Tier 1 is an in-process LRU bounded by bytes. Tier 2 is a directory of JSON
+files shared by every gunicorn worker on the host, bounded by total size
+(oldest files are pruned first). Keys always include the data version of
+the patient being shown, so a data refresh (or new scans for that patient)
+makes every older entry unreachable. They also include a hash of the code
+that built the outputs (the page module and the dexa package), because the
+disk tier outlives restarts and deploys: entries written by older code are
+never served by newer code.
+
+Outputs are stored as the JSON Dash would send anyway (Plotly figures and
+components serialize to plain dicts), so a hit skips building entirely.
+"""
+import functools
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+
+import plotly
+
+from dexa.store import get_store
+
+CACHE_DIR = os.environ.get("DEXA_FIGURE_CACHE_DIR", os.path.join(".cache", "figures"))
+MEMORY_LIMIT_BYTES = int(float(os.environ.get("DEXA_FIGURE_CACHE_MB", "64")) * 2**20)
+DISK_LIMIT_BYTES = int(float(os.environ.get("DEXA_FIGURE_CACHE_DISK_MB", "512")) * 2**20)
+ENABLED = os.environ.get("DEXA_FIGURE_CACHE", "1") != "0"
+
+
+def _serialize(outputs):
+    return json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+# Outcome of the latest lookup on this thread, for per-request metrics
+# (dexa.metrics); one lookup per callback call
+_lookup = threading.local()
+
+
+def last_lookup():
+    """'memory_hits', 'disk_hits' or 'misses' for this thread's latest lookup, else None."""
+    return getattr(_lookup, "outcome", None)
+
+
+def take_lookup():
+    """last_lookup(), then cleared."""
+    outcome = last_lookup()
+    _lookup.outcome = None
+    return outcome
+
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def code_version(module_name):
+    """Hash of the source of `module_name` (e.g. a page) and of every dexa module."""
+    paths = sorted(glob.glob(os.path.join(_PACKAGE_DIR, "*.py")))
+    module_file = getattr(sys.modules.get(module_name), "__file__", None)
+    if module_file and os.path.abspath(module_file) not in paths:
+        paths.append(os.path.abspath(module_file))
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode() + b"\0" + f.read())
+    return digest.hexdigest()[:16]
+
+
+def cache_key(*parts):
+    return hashlib.sha256(_serialize(parts).encode()).hexdigest()
+
+
+class FigureCache:
+    def __init__(self, memory_limit=MEMORY_LIMIT_BYTES, disk_dir=CACHE_DIR, disk_limit=DISK_LIMIT_BYTES):
+        self.memory_limit = memory_limit
+        self.disk_dir = disk_dir
+        self.disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # measured lazily on first write
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+
+    # ---------- public API ----------
+    def get_or_compute(self, page, key_parts, compute):
+        """Return the cached outputs for `key_parts`, else `compute()` and store them."""
+        if not ENABLED:
+            return compute()
+        key = cache_key(page, *key_parts)
+        text = self._memory_get(key)
+        if text is not None:
+            self._count(page, "memory_hits")
+            return json.loads(text)
+
+        text = self._disk_get(key)
+        if text is not None:
+            self._count(page, "disk_hits")
+            self._memory_put(key, text)
+            return json.loads(text)
+
+        self._count(page, "misses")
+        text = _serialize(compute())
+        self._memory_put(key, text)
+        self._disk_put(key, text)
+        return json.loads(text)
+
+    def stats(self):
+        """Hit/miss counters and hit rate per page, plus tier sizes."""
+        with self._lock:
+            pages = {page: dict(counts) for page, counts in self._counters.items()}
+            memory = {"entries": len(self._memory), "bytes": self._memory_bytes}
+        for counts in pages.values():
+            lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+            counts["hit_rate"] = (lookups - counts["misses"]) / lookups if lookups else 0.0
+        return {"pages": pages, "memory": memory, "disk": {"bytes": self._disk_bytes}}
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    # ---------- memory tier ----------
+    def _count(self, page, counter):
+        _lookup.outcome = counter
+        with self._lock:
+            self._counters[page][counter] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+            return text
+
+    def _memory_put(self, key, text):
+        size = len(text)
+        if size > self.memory_limit:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = text
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    # ---------- disk tier ----------
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _disk_get(self, key):
+        if not self.disk_limit:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                text = f.read()
+            os.utime(self._path(key))  # mtime doubles as last-used time for pruning
+            return text
+        except OSError:
+            return None
+
+    def _disk_put(self, key, text):
+        if not self.disk_limit:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._measure_disk()
+            else:
+                self._disk_bytes += len(text)
+            over_limit = self._disk_bytes > self.disk_limit
+        if over_limit:
+            self._prune_disk()
+
+    def _disk_entries(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed by another worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _measure_disk(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _prune_disk(self):
+        """Delete least recently used files until the tier is under 80% of its limit."""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.disk_limit * 0.8:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_figure_cache():
+    """The process-wide FigureCache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = FigureCache()
+    return _cache
+
+
+def cached_outputs(page, key=None, cohort=False):
+    """
+    Decorator for patient callbacks (first argument: the patient name) whose
+    outputs depend only on their arguments and that patient's data: caches
+    them under (page, arguments, patient data version, code_version of the
+    callback's module). `key` may return extra key parts (e.g. today's date
+    for "days ago" text). With `cohort`, the outputs also depend on other
+    patients' data (cohort percentiles, clinic medians), so the whole
+    store's data version is part of the key too.
+    """
+    def decorator(fn):
+        code = code_version(fn.__module__)
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            store = get_store()
+            version = store.patient_version(args[0]) if args else store.version
+            key_parts = (args, version, code) + ((store.version,) if cohort else ()) \
+                + (tuple(key()) if key else ())
+            return get_figure_cache().get_or_compute(page, key_parts, lambda: fn(*args))
+        return wrapper
+    return decorator
@@ -0,0 +1,83 @@
+"""
+Per-patient row index over a table sorted by patient.
+
+Once a table is sorted on (Patient Name, Scan Date, ...), each patient's rows
+form one contiguous block, so the index only needs the block's start/stop.
+Looking a patient up is then a dict hit plus an `iloc` slice (a view, not a
+copy) instead of a boolean scan over the whole table. When rows are
+spliced in (dexa.tables), the ranges after them are offset instead of
+found again.
+"""
+import numpy as np
+import pandas as pd
+
+
+class PatientIndex:
+    """Maps each value of `key` to the [start, stop) row range holding it."""
+
+    def __init__(self, df, key="Patient Name"):
+        column = df[key]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Find the boundaries on the integer codes, not the strings
+            values = column.cat.codes.to_numpy()
+            labels = np.asarray(column.cat.categories, dtype=object)
+        else:
+            values = column.to_numpy()
+            labels = None
+        # Row positions where the key changes mark the block boundaries
+        boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+        starts = np.concatenate(([0], boundaries)) if len(values) else np.zeros(0, dtype=np.int64)
+        stops = np.concatenate((boundaries, [len(values)])) if len(values) else starts
+        keys = values[starts] if labels is None else labels[values[starts]]
+        self._set(np.asarray(keys, dtype=object), starts.astype(np.int64), stops.astype(np.int64))
+        if len(self._position) != len(starts):
+            raise ValueError(f"Table is not sorted by '{key}'")
+
+    def _set(self, keys, starts, stops, position=None):
+        self._keys = keys
+        self._starts = starts
+        self._stops = stops
+        self._position = position if position is not None else \
+            {name: i for i, name in enumerate(keys)}
+
+    def __contains__(self, name):
+        return name in self._position
+
+    def __len__(self):
+        return len(self._position)
+
+    def keys(self):
+        return self._position.keys()
+
+    def range(self, name):
+        """The (start, stop) row range for `name`, or (0, 0) if unknown."""
+        i = self._position.get(name)
+        if i is None:
+            return 0, 0
+        return int(self._starts[i]), int(self._stops[i])
+
+    def rows(self, df, name):
+        """The rows of `df` (the table this index was built on) for `name`."""
+        start, stop = self.range(name)
+        return df.iloc[start:stop]
+
+    def spliced(self, lengths):
+        """
+        Index of the table with each `name`'s block resized to
+        `lengths[name]` rows (unknown names are inserted in sorted order):
+        every other range is offset, nothing is rescanned.
+        """
+        sizes = self._stops - self._starts
+        known = {name: length for name, length in lengths.items() if name in self._position}
+        sizes[[self._position[name] for name in known]] = list(known.values())
+        keys, position = self._keys, self._position
+        added = sorted(name for name in lengths if name not in self._position)
+        if added:
+            at = np.searchsorted(keys, np.asarray(added, dtype=object), side="right")
+            keys = np.insert(keys, at, np.asarray(added, dtype=object))
+            sizes = np.insert(sizes, at, [lengths[name] for name in added])
+            position = None
+        stops = np.cumsum(sizes, dtype=np.int64)
+        index = PatientIndex.__new__(PatientIndex)
+        index._set(keys, stops - sizes, stops, position)
+        return index
@@ -0,0 +1,409 @@
+"""
+Incremental scan ingest.
+
+New scans arrive as master-format rows (one per scan and body part). They
+are validated against the master schema, then merged into a new DataStore
+without reparsing or recomputing the history:
+
+  * only the patients the rows belong to are re-derived - their cube rows,
+    symmetry, composition indices, benchmarks and summary rows are rebuilt
+    from their own (old + new) rows;
+  * those tables go into the store's delta (dexa.tables) and shadow the
+    patients' old rows; every other patient's rows are not even copied
+    until the delta outgrows DEXA_MERGE_SHARE of the data and is merged
+    in (one concatenation per table, with the patient ranges offset);
+  * the delta keeps its text on its own small dictionaries; the merge
+    appends the new labels to the shared ones, so existing codes stay
+    valid;
+  * the search index gets the new names and scan IDs added to a small
+    side array instead of copied in;
+  * only the touched patients get a new data version, so cached callback
+    outputs of everyone else stay valid;
+  * the cohort quantile sketches (dexa.sketches) are fed just the new scans;
+  * the similar-patient index (dexa.similarity), if built, swaps in the
+    touched patients' latest scans instead of being rebuilt;
+  * the cohort percentiles and any computed trends tables (dexa.trends)
+    swap in just the touched patients' values.
+
+Persisting appends the rows to master_dexa_data.csv (the file is never
+rewritten). Every running worker - the ingesting one included - then
+reads just the appended rows back from the file and ingests them the same
+way (ingest_appended, called by dexa.reload), instead of reloading the
+data. Data versions are sums of row hashes on top of the version of the
+data as loaded, so all workers reach the same versions, and a fresh load
+(the old snapshot plus the appended rows, see DataStore.from_csv) does too.
+
+With DEXA_BACKEND=sqlite the new scans are instead derived on their own
+and inserted into the database in place (SqliteStore.insert_scans).
+
+Python:  ingest_scans(rows_df)          -> the new, published DataStore
+CLI:     python -m dexa.ingest new_scans.csv [--dry-run]
+"""
+import argparse
+import io
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from dexa import reload, similarity, sketches, trends
+from dexa import store as data_store
+from dexa.benchmarking import compute_benchmarks, scan_demographics
+from dexa.composition import compute_indices, scan_reported
+from dexa.cube import RegionalCube
+from dexa.snapshot import is_appended, read_appended, tail_sha256
+from dexa.summary import compute_summary
+from dexa.symmetry import compute_symmetry
+from dexa.tables import MERGE_SHARE, StoreTables, decoded, local, merge
+
+KEY_COLUMNS = ["Unique ID", "Patient Name", "Scan Date", "Body Part"]
+# Measurements every row must carry (BMC is legitimately blank for some parts)
+REQUIRED_METRICS = ["% Fat", "Fat (g)", "Lean (g)", "Tissues (g)", "Total Mass (kg)"]
+# Parts every scan must include - the whole-body indices come from them
+REQUIRED_PARTS = ["Total"]
+
+# Row hashes (uint64) are summed modulo this
+HASH_MODULUS = 1 << 64
+
+_ingest_lock = threading.Lock()
+
+
+class IngestError(ValueError):
+    """New scan rows that do not fit the master schema or the current data."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("Invalid scan rows:\n  " + "\n  ".join(self.problems))
+
+
+def read_scan_rows(path, names=None):
+    """
+    Read a master-format CSV of new scans as text (validated later);
+    `names` are the columns of one without a header row.
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[""], encoding="utf-8-sig",
+                       header=None if names is not None else "infer", names=names)
+
+
+def validate_scan_rows(rows, store):
+    """
+    Check new master-format rows against the schema and the store's data;
+    raises IngestError listing every problem. Returns the rows typed like
+    the store's master table (columns in master order, numbers as floats,
+    dates parsed, text left as strings), sorted by patient, date and part.
+    """
+    schema = store.master_schema()
+    problems = []
+    unknown = [c for c in rows.columns if c not in schema]
+    if unknown:
+        problems.append(f"unknown columns: {', '.join(map(str, unknown))}")
+    missing = [c for c in KEY_COLUMNS + REQUIRED_METRICS if c not in rows.columns]
+    if missing:
+        problems.append(f"missing columns: {', '.join(missing)}")
+    if problems or rows.empty:
+        raise IngestError(problems or ["no rows"])
+
+    typed = pd.DataFrame(index=rows.index)
+    for col, kind in schema.items():
+        values = rows[col] if col in rows else pd.Series(np.nan, index=rows.index)
+        if kind == "date":
+            if pd.api.types.is_datetime64_any_dtype(values):
+                typed[col] = values
+            else:
+                typed[col] = pd.to_datetime(values, format=data_store.DATE_FORMAT, errors="coerce")
+                bad = values.notna() & typed[col].isna()
+                if bad.any():
+                    problems.append(f"Scan Date not {data_store.DATE_FORMAT} on rows {_rows(bad)}")
+        elif kind == "text":
+            typed[col] = values.where(values.isna(), values.astype(str).str.strip()).replace("", np.nan)
+        else:
+            typed[col] = pd.to_numeric(values, errors="coerce")
+            bad = values.notna() & typed[col].isna()
+            if bad.any():
+                problems.append(f"{col} not numeric on rows {_rows(bad)}")
+
+    for col in KEY_COLUMNS + REQUIRED_METRICS:
+        blank = rows[col].isna() | rows[col].astype(str).str.strip().eq("")
+        if blank.any():
+            problems.append(f"{col} missing on rows {_rows(blank)}")
+    parts = typed["Body Part"].dropna()
+    unknown_parts = sorted(set(parts) - set(store.body_parts()))
+    if unknown_parts:
+        problems.append(f"unknown body parts: {', '.join(unknown_parts)}")
+    duplicated = typed.duplicated(["Unique ID", "Body Part"], keep=False)
+    if duplicated.any():
+        problems.append(f"duplicate (Unique ID, Body Part) on rows {_rows(duplicated)}")
+    scans = typed.dropna(subset=["Unique ID"]).groupby("Unique ID", sort=False)
+    inconsistent = scans[["Patient Name", "Scan Date"]].nunique(dropna=False).gt(1).any(axis=1)
+    if inconsistent.any():
+        problems.append("scans with more than one patient or date: "
+                        + ", ".join(inconsistent.index[inconsistent][:10]))
+    existing = store.loaded_scans(list(scans.groups))
+    if existing:
+        problems.append(f"scans already loaded: {', '.join(existing[:10])}")
+    for part in REQUIRED_PARTS:
+        lacking = [scan_id for scan_id, group in scans["Body Part"] if part not in set(group)]
+        if lacking:
+            problems.append(f"scans without a {part} row: {', '.join(lacking[:10])}")
+    if problems:
+        raise IngestError(problems)
+    return typed.sort_values(data_store.MASTER_SORT, kind="stable").reset_index(drop=True)
+
+
+def _rows(mask):
+    positions = np.flatnonzero(np.asarray(mask))
+    shown = ", ".join(str(i) for i in positions[:10])
+    return shown + (f" (+{len(positions) - 10} more)" if len(positions) > 10 else "")
+
+
+def _by_scan(frame, scan_ids):
+    return frame.set_axis(pd.Index(np.asarray(scan_ids, dtype=str)))
+
+
+def apply_scans(store, rows):
+    """
+    New DataStore = `store` plus validated `rows` (see validate_scan_rows).
+    Work is proportional to the new rows plus the history of the patients
+    they belong to: their tables are derived on their own and added to the
+    store's delta (dexa.tables), nothing else is copied - until the delta
+    outgrows MERGE_SHARE of the data and is merged in once.
+    """
+    # Continue from the merged tables if a whole-table read already made them
+    bulk, delta = (store._merged, {}) if store._merged is not None else (store._tables, dict(store._delta))
+    parts, metrics = bulk.cube.parts, bulk.cube.metrics
+    names = rows["Patient Name"].astype(str)
+    new_first = rows.drop_duplicates("Unique ID")
+    new_ids = new_first["Unique ID"].astype(str).tolist()
+    new_patients = new_first["Patient Name"].astype(str).tolist()
+
+    old_blocks, new_blocks = [], []
+    for patient, new_rows in rows.groupby(names, sort=True):
+        # The patient's current tables on their own dictionaries, so nothing
+        # below touches the shared ones
+        old = delta.get(patient) or bulk.patient(patient)
+        patient_rows = local(pd.concat([decoded(old.master), new_rows[old.master.columns]], ignore_index=True),
+                             bulk.shared_dtypes())
+        patient_rows = patient_rows.sort_values(data_store.MASTER_SORT, kind="stable").reset_index(drop=True)
+
+        # Re-derive this patient's scans from their own rows only
+        patient_cube = RegionalCube.from_master(patient_rows, metrics, parts=parts)
+        scan_ids = patient_cube.scans["Unique ID"].astype(object)
+        old_ids = old.cube.scans["Unique ID"].astype(object)
+        new_ids_here = new_rows["Unique ID"].drop_duplicates()
+        reported = pd.concat([
+            _by_scan(old.reported, old_ids),
+            _by_scan(scan_reported(new_rows), new_ids_here),
+        ]).reindex(scan_ids).reset_index(drop=True)
+        demographics = pd.concat([
+            _by_scan(old.demographics, old_ids),
+            # New scans of a known patient inherit their latest demographics
+            _by_scan(scan_demographics(new_rows, old.benchmark), new_ids_here),
+        ]).reindex(scan_ids).reset_index(drop=True)
+        indices = compute_indices(patient_cube, reported)
+        delta[patient] = StoreTables(
+            patient_rows, patient_cube,
+            symmetry=compute_symmetry(patient_cube),
+            reported=reported,
+            composition=indices,
+            demographics=demographics,
+            benchmark=compute_benchmarks(patient_cube, demographics),
+            summary=compute_summary(patient_cube, indices),
+        )
+        old_blocks.append((old.composition, old.demographics))
+        new_blocks.append((indices, demographics))
+
+    # Search: new patient names plus every new scan ID
+    new_names = [name for name in dict.fromkeys(new_patients)
+                 if name not in bulk.master_index and name not in store._delta_patients]
+    search = store.search.with_entries(new_names + new_ids, new_names + new_patients)
+
+    # Versions: every row's hash is added to the store's running sums, in
+    # total and per patient, so the same rows give the same versions in
+    # every process that ingests them (see DataStore._assemble)
+    total, patient_totals = store._ingested["total"], dict(store._ingested["patients"])
+    for name, row_hash in zip(names.tolist(), pd.util.hash_pandas_object(rows, index=False).tolist()):
+        total = (total + row_hash) % HASH_MODULUS
+        patient_totals[name] = (patient_totals.get(name, 0) + row_hash) % HASH_MODULUS
+    patient_versions = dict(store._patient_versions)
+    patient_versions.update({name: data_store.ingested_version(store._base_version, patient_totals[name], name)
+                             for name in dict.fromkeys(new_patients)})
+
+    # Only the touched patients' reference values are swapped
+    percentiles = store.percentiles.with_patients(
+        *[tuple(pd.concat([block[i] for block in blocks], ignore_index=True) for i in range(2))
+          for blocks in (old_blocks, new_blocks)])
+    if sum(len(tables.cube.scans) for tables in delta.values()) > MERGE_SHARE * len(bulk.cube.scans):
+        bulk, delta = merge(bulk, delta), {}
+    updated = data_store.DataStore.__new__(data_store.DataStore)
+    updated._assemble(
+        bulk,
+        search=search,
+        percentiles=percentiles,
+        version=store._base_version,
+        delta=delta,
+        ingested={"total": total, "patients": patient_totals},
+        patient_versions=patient_versions,
+    )
+    return updated
+
+
+def append_to_csv(rows, csv_path):
+    """
+    Append typed rows to the master CSV in its own column order and date
+    format. The file is never rewritten, so its snapshot stays a prefix of
+    it (dexa.snapshot) and loads read just the rows after that.
+    """
+    header = pd.read_csv(csv_path, nrows=0, encoding="utf-8-sig").columns
+    out = rows.reindex(columns=header)
+    out["Scan Date"] = out["Scan Date"].dt.strftime(data_store.DATE_FORMAT)
+    with open(csv_path, "rb") as f:
+        # Exports often end without a newline; don't glue a row onto the last one
+        f.seek(-1, os.SEEK_END)
+        needs_newline = f.read(1) != b"\n"
+    with open(csv_path, "a", encoding="utf-8", newline="") as f:
+        if needs_newline:
+            f.write("\n")
+        out.to_csv(f, header=False, index=False, lineterminator="\n")
+
+
+def _appended_rows(store):
+    """
+    (validated rows appended to the master CSV `store` was read from since,
+    offset read up to) - () if there are no complete new rows. None if the
+    CSV was not just appended to, or the new rows do not validate.
+    """
+    source = store.source
+    if source is None or not is_appended(source["paths"][0], {"size": source["offset"],
+                                                              "tail_sha256": source["tail_sha256"]}):
+        return None
+    data, end = read_appended(source["paths"][0], source["offset"])
+    # A row still being written is left for the next read
+    complete = data[:data.rfind(b"\n") + 1]
+    end -= len(data) - len(complete)
+    if not complete.strip():
+        return ()
+    header = pd.read_csv(source["paths"][0], nrows=0, encoding="utf-8-sig").columns
+    try:
+        return validate_scan_rows(read_scan_rows(io.BytesIO(complete), names=header), store), end
+    except IngestError as e:
+        warnings.warn(f"Rows appended to {source['paths'][0]} cannot be ingested: {e}")
+        return None
+
+
+def _with_appended(store, rows, end):
+    updated = apply_scans(store, rows.copy())
+    master_csv = store.source["paths"][0]
+    updated.source = dict(store.source, offset=end, tail_sha256=tail_sha256(master_csv, end))
+    return updated
+
+
+def apply_appended(store):
+    """
+    `store` plus the rows appended to its master CSV since it was read
+    (store.source), without advancing any cache - for loads. None if the
+    CSV was rewritten rather than appended to.
+    """
+    appended = _appended_rows(store)
+    if not appended:
+        return None if appended is None else store
+    return _with_appended(store, *appended)
+
+
+def _advance(store, updated, rows, persist):
+    """Bring the caches over `store` up to date for `updated` (= store + rows) and publish it."""
+    patients = rows["Patient Name"].astype(str).unique()
+    # Cohort sketches: the new scans are streamed in, nothing is rebuilt
+    sketches.advance(store, updated, rows["Unique ID"].astype(str).unique(), patients, persist=persist)
+    similarity.advance(store.version, updated, patients)
+    trends.advance(store, updated, patients)
+    data_store.set_store(updated)
+    return updated
+
+
+def _ingest_appended(store, persist):
+    appended = _appended_rows(store)
+    if not appended:
+        return None if appended is None else store
+    rows, end = appended
+    return _advance(store, _with_appended(store, rows, end), rows, persist)
+
+
+def ingest_appended():
+    """
+    Ingest the rows appended to the master CSV since the current store read
+    it - by another process, e.g. this module's CLI - and publish the
+    result (dexa.reload calls this before reloading). Every process that
+    does so reaches the same data versions. Returns the current store
+    (unchanged if nothing was appended), or None if the data files changed
+    otherwise and must be reloaded.
+    """
+    with _ingest_lock:
+        store = data_store.get_store()
+        if not isinstance(store, data_store.DataStore) or store.source is None:
+            return None
+        if data_store.data_files_stat(store.source["paths"])[1:] != store.source["stat"][1:]:
+            return None  # composition or benchmark data changed
+        return _ingest_appended(store, persist=False)
+
+
+def ingest_scans(rows, persist=True, master_csv=None):
+    """
+    Validate `rows` (master-format DataFrame), merge them into the current
+    store and publish the result; with `persist`, also append them to the
+    master CSV - and take them back from it the way every other worker
+    watching the file does (ingest_appended). Returns the new store.
+    Concurrent ingests run one at a time.
+    """
+    master_csv = master_csv or data_store.MASTER_CSV
+    with _ingest_lock:
+        store = data_store.get_store()
+        typed = validate_scan_rows(rows, store)
+        patients = typed["Patient Name"].astype(str).unique()
+        if not isinstance(store, data_store.DataStore):
+            version = store.version
+            # SQLite backend: the database is updated in place (and shared by
+            # every worker), so there is no new store to publish
+            store.insert_scans(typed, commit=persist)
+            if persist:
+                append_to_csv(typed, master_csv)
+                sketches.get_sketches(store, write=True)  # feeds the new scans to the sketch file
+                similarity.advance(version, store, patients)
+            return store
+        if not persist:
+            return _advance(store, apply_scans(store, typed.copy()), typed, persist)
+        append_to_csv(typed, master_csv)
+        # This process already has the data; don't reload it from disk
+        reload.mark_current()
+        if store.source is not None and os.path.samefile(store.source["paths"][0], master_csv):
+            updated = _ingest_appended(store, persist)
+            if updated is not None:
+                return updated
+        return _advance(store, apply_scans(store, typed.copy()), typed, persist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new scans to the DEXA master data.")
+    parser.add_argument("csv", help="master-format CSV with the new scan rows")
+    parser.add_argument("--dry-run", action="store_true", help="validate and merge, but write nothing")
+    args = parser.parse_args()
+
+    rows = read_scan_rows(args.csv)
+    known = set(data_store.get_store().patient_names())
+    started = time.perf_counter()
+    try:
+        updated = ingest_scans(rows, persist=not args.dry_run)
+    except IngestError as e:
+        parser.exit(1, f"{e}\n")
+    elapsed = time.perf_counter() - started
+    new_scans = rows["Unique ID"].nunique()
+    new_patients = len(set(rows["Patient Name"]) - known)
+    action = "Validated" if args.dry_run else "Ingested"
+    print(f"{action} {new_scans} scans ({len(rows)} rows, {new_patients} new patients) "
+          f"in {elapsed * 1e3:.0f} ms; data version {updated.version}")
+
+
+if __name__ == "__main__":
+    main()
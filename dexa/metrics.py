@@ -0,0 +1,207 @@
+"""
+Per-callback request metrics in Prometheus text format (GET /metrics).
+
+Every Dash callback request (POST /_dash-update-component) is timed by a
+pair of Flask hooks and recorded under the callback's function name and
+its first output, e.g. update_page_content / key-metrics-banner.children:
+
+    dexa_callback_calls_total            requests
+    dexa_callback_errors_total           requests answered with a 5xx
+    dexa_callback_latency_seconds        histogram of server time
+    dexa_callback_response_bytes         histogram of response body size
+    dexa_callback_cache_total            figure cache lookups by result
+                                         (memory_hit, disk_hit, miss) for
+                                         callbacks behind cached_outputs
+
+Recording a request is a few counter increments under one lock; the text
+is only rendered when /metrics is scraped. Figure cache sizes and the data
+generation are read at scrape time too.
+
+Counters are per worker process (labelled with its pid), so scrape every
+worker or run a single one. The route answers requests carrying
+Authorization: Bearer <DEXA_METRICS_TOKEN> (Prometheus' bearer_token), or
+everyone with DEXA_METRICS_PUBLIC=1. Requests from this host are only
+trusted with DEXA_TRUST_LOOPBACK=1: behind a reverse proxy on the same
+host every request comes from loopback.
+"""
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, request
+
+from dexa import figure_cache
+from dexa import store as data_store
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+CACHE_RESULTS = {"memory_hits": "memory_hit", "disk_hits": "disk_hit", "misses": "miss"}
+DASH_UPDATE_PATH = "/_dash-update-component"
+PUBLIC = os.environ.get("DEXA_METRICS_PUBLIC", "0") == "1"
+METRICS_TOKEN = os.environ.get("DEXA_METRICS_TOKEN", "")
+# Opt-in: only safe when nothing on this host forwards outside requests
+TRUST_LOOPBACK = os.environ.get("DEXA_TRUST_LOOPBACK", "0") == "1"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1", "localhost")
+
+
+class Histogram:
+    """Cumulative-on-render bucket counts plus sum and count."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield f'{name}_bucket{{{labels},le="{le}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum!r}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class CallbackStats:
+    __slots__ = ("calls", "errors", "latency", "size", "cache")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.cache = dict.fromkeys(CACHE_RESULTS.values(), 0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CallbackMetrics:
+    """Per-callback counters and histograms for one process."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, callback, output, seconds, size, error=False, cache=None):
+        with self._lock:
+            stats = self._stats.get((callback, output))
+            if stats is None:
+                stats = self._stats[(callback, output)] = CallbackStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.latency.observe(seconds)
+            if size is not None:
+                stats.size.observe(size)
+            if cache is not None:
+                stats.cache[CACHE_RESULTS[cache]] += 1
+
+    def render(self):
+        """All metrics as Prometheus text exposition format."""
+        pid = os.getpid()
+        with self._lock:
+            # Copy under the lock so rendering never sees a half-recorded request
+            snapshot = []
+            for (callback, output), stats in sorted(self._stats.items()):
+                labels = f'callback="{_escape(callback)}",output="{_escape(output)}",pid="{pid}"'
+                snapshot.append((labels, stats.calls, stats.errors, dict(stats.cache),
+                                 list(stats.latency.lines("dexa_callback_latency_seconds", labels)),
+                                 list(stats.size.lines("dexa_callback_response_bytes", labels))))
+        out = []
+
+        def family(name, kind, help_text, lines):
+            out.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *lines])
+
+        family("dexa_callback_calls_total", "counter", "Dash callback requests.",
+               [f"dexa_callback_calls_total{{{labels}}} {calls}" for labels, calls, *_ in snapshot])
+        family("dexa_callback_errors_total", "counter", "Dash callback requests answered with a 5xx.",
+               [f"dexa_callback_errors_total{{{labels}}} {errors}" for labels, _, errors, *_ in snapshot])
+        family("dexa_callback_latency_seconds", "histogram", "Server time per Dash callback request.",
+               [line for *_, latency, _ in snapshot for line in latency])
+        family("dexa_callback_response_bytes", "histogram", "Response body size per Dash callback request.",
+               [line for *_, size in snapshot for line in size])
+        family("dexa_callback_cache_total", "counter", "Figure cache lookups by Dash callback and result.",
+               [f'dexa_callback_cache_total{{{labels},result="{result}"}} {n}'
+                for labels, _, _, cache, *_ in snapshot for result, n in cache.items()])
+
+        cache_stats = figure_cache.get_figure_cache().stats()
+        family("dexa_figure_cache_bytes", "gauge", "Bytes held by each figure cache tier.",
+               [f'dexa_figure_cache_bytes{{tier="memory",pid="{pid}"}} {cache_stats["memory"]["bytes"]}']
+               + ([f'dexa_figure_cache_bytes{{tier="disk",pid="{pid}"}} {cache_stats["disk"]["bytes"]}']
+                  if cache_stats["disk"]["bytes"] is not None else []))
+        family("dexa_data_generation", "gauge", "Data stores this worker has published (0: not loaded yet).",
+               [f'dexa_data_generation{{pid="{pid}"}} '
+                f'{data_store.get_store().generation if data_store.is_ready() else 0}'])
+        return "\n".join(out) + "\n"
+
+
+def callback_names(dash_app):
+    """Output spec -> (function name, first output) label pair, resolved lazily."""
+    names = {}
+
+    def resolve(output):
+        label = names.get(output)
+        if label is None:
+            entry = dash_app.callback_map.get(output, {})
+            fn = entry.get("callback")
+            first = output.strip(".").split("...")[0]
+            label = names[output] = (getattr(fn, "__name__", "unknown"), first)
+        return label
+    return resolve
+
+
+def trusted_local():
+    """Whether this request comes from loopback and DEXA_TRUST_LOOPBACK allows that."""
+    return TRUST_LOOPBACK and request.remote_addr in LOCAL_ADDRESSES
+
+
+def _authorized():
+    if PUBLIC or trusted_local():
+        return True
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return bool(METRICS_TOKEN and scheme.lower() == "bearer" and token
+                and hmac.compare_digest(token, METRICS_TOKEN))
+
+
+def instrument(dash_app, path="/metrics", metrics=None):
+    """Record every Dash callback request of `dash_app` and serve the metrics at `path`."""
+    metrics = metrics or CallbackMetrics()
+    server = dash_app.server
+    resolve = callback_names(dash_app)
+
+    @server.before_request
+    def _start_timer():
+        if request.path.endswith(DASH_UPDATE_PATH):
+            g.dexa_started = time.perf_counter()
+            figure_cache.take_lookup()  # drop any outcome left over on this thread
+
+    @server.after_request
+    def _record(response):
+        started = g.pop("dexa_started", None)
+        if started is None:
+            return response
+        body = request.get_json(silent=True) or {}
+        callback, output = resolve(body.get("output", ""))
+        metrics.observe(callback, output, time.perf_counter() - started,
+                        response.calculate_content_length(),
+                        error=response.status_code >= 500, cache=figure_cache.take_lookup())
+        return response
+
+    def serve_metrics():
+        if not _authorized():
+            abort(403)
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    server.add_url_rule(path, "dexa_metrics", serve_metrics)
+    return metrics
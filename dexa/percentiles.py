@@ -0,0 +1,206 @@
+"""
+Where a patient stands in our own population: percentiles and p10/p50/p90
+bands of the key composition indices per sex and age group cohort.
+
+The reference population is each patient's latest scan in each cohort
+(one vote per patient, so frequent scanners do not dominate). Per metric,
+those values are sorted once by (cohort, value) into one flat array with
+cohort offsets, so:
+
+    percentile(...)  two binary searches in the cohort's slice, O(log n)
+    band(s)(...)     a row of the precomputed quantile table, O(1)
+
+Nothing here scans the data per request. Cohorts with fewer than
+MIN_COHORT patients have no percentiles or bands (NaN).
+
+The table is built with the data (DataStore load); an ingest swaps just
+the touched patients' values in with with_patients() - a binary search
+and an insert per value, bands recomputed only for the cohorts that
+changed. The SQLite backend builds it once per data version from the
+composition and benchmark tables.
+"""
+import numpy as np
+import pandas as pd
+
+PERCENTILE_METRICS = [
+    "Total Body Fat (%)", "Visceral Fat Area (cm²)", "Fat Mass Index (FMI)",
+    "Lean Mass Index (kg/m²)", "Appendicular Lean Mass Index (kg/m²)",
+    "Android/Gynoid Fat Ratio", "BMI (kg/m²)",
+]
+BAND_QUANTILES = (0.10, 0.50, 0.90)
+MIN_COHORT = 5
+
+
+class CohortPercentiles:
+    """
+    values[metric]  - reference values sorted by (cohort, value)
+    offsets[metric] - cohort i is values[metric][offsets[i]:offsets[i + 1]]
+    bands[metric]   - (cohorts + 1, BAND_QUANTILES) table; the extra last
+                      row (NaN) is where unknown cohorts are mapped to
+    """
+
+    def __init__(self, cohorts, values, offsets, quantiles=BAND_QUANTILES, bands=None):
+        self.cohorts = list(cohorts)
+        self.cohort_index = {cohort: i for i, cohort in enumerate(self.cohorts)}
+        self.values = values
+        self.offsets = offsets
+        self.quantiles = tuple(quantiles)
+        self.bands = bands if bands is not None else {metric: self._band_table(metric) for metric in values}
+
+    @classmethod
+    def from_scans(cls, composition, demographics, metrics=PERCENTILE_METRICS, quantiles=BAND_QUANTILES):
+        """
+        From a composition table sorted by patient and date and the per-scan
+        demographics (Sex, Age Group) row-aligned with it.
+        """
+        sex, sexes, age, ages, latest = _cohort_latest(composition, demographics)
+        code = sex[latest] * len(ages) + age[latest]
+        cohorts = [(str(s), str(a)) for s in sexes for a in ages]
+        values, offsets = {}, {}
+        for metric in metrics:
+            if metric not in composition:
+                continue
+            metric_values = np.asarray(composition[metric], dtype=np.float64)[latest]
+            ok = ~np.isnan(metric_values)
+            order = np.lexsort((metric_values[ok], code[ok]))
+            values[metric] = metric_values[ok][order]
+            offsets[metric] = np.r_[0, np.cumsum(np.bincount(code[ok], minlength=len(cohorts)))]
+        return cls(list(cohorts), values, offsets, quantiles)
+
+    def with_patients(self, old, new):
+        """
+        Copy with some patients' reference values replaced, e.g. after an
+        ingest: `old` and `new` are (composition, demographics) of every
+        scan of just those patients, before and after (as for from_scans).
+        Each old value is found by binary search in its cohort and removed,
+        each new one inserted at its sorted position; only the cohorts they
+        fall in get their bands recomputed. New cohorts are appended.
+        """
+        cohorts = list(self.cohorts)
+        cohort_index = dict(self.cohort_index)
+
+        def contributions(composition, demographics):
+            sex, sexes, age, ages, latest = _cohort_latest(composition, demographics)
+            codes = []
+            for pair in zip(sexes[sex[latest]], ages[age[latest]]):
+                pair = (str(pair[0]), str(pair[1]))
+                if pair not in cohort_index:
+                    cohort_index[pair] = len(cohorts)
+                    cohorts.append(pair)
+                codes.append(cohort_index[pair])
+            return np.asarray(codes, dtype=np.intp), composition.iloc[np.flatnonzero(latest)]
+
+        old_codes, old_rows = contributions(*old)
+        new_codes, new_rows = contributions(*new)
+        added = len(cohorts) - len(self.cohorts)
+        values, offsets = {}, {}
+        for metric, sorted_values in self.values.items():
+            metric_offsets = np.r_[self.offsets[metric], np.full(added, self.offsets[metric][-1])]
+            # Drop the old values (ties with another patient's value: any equal one will do)
+            old_values = np.asarray(old_rows[metric], dtype=np.float64)
+            ok = ~np.isnan(old_values)
+            drop = set()
+            for code, value in zip(old_codes[ok], old_values[ok]):
+                start, stop = metric_offsets[code], metric_offsets[code + 1]
+                position = start + np.searchsorted(sorted_values[start:stop], value)
+                while position in drop:
+                    position += 1
+                if position >= stop or sorted_values[position] != value:
+                    raise ValueError(f"{metric} {value} is not in cohort {cohorts[code]}")
+                drop.add(position)
+            metric_values = np.delete(sorted_values, sorted(drop))
+            metric_offsets = metric_offsets - np.r_[0, np.cumsum(np.bincount(old_codes[ok], minlength=len(cohorts)))]
+            # Insert the new ones, in (cohort, value) order so equal positions stay sorted
+            new_values = np.asarray(new_rows[metric], dtype=np.float64)
+            ok = ~np.isnan(new_values)
+            order = np.lexsort((new_values[ok], new_codes[ok]))
+            codes, inserted = new_codes[ok][order], new_values[ok][order]
+            positions = [metric_offsets[code] + np.searchsorted(
+                metric_values[metric_offsets[code]:metric_offsets[code + 1]], value, side="right")
+                for code, value in zip(codes, inserted)]
+            values[metric] = np.insert(metric_values, np.asarray(positions, dtype=np.intp), inserted)
+            offsets[metric] = metric_offsets + np.r_[0, np.cumsum(np.bincount(codes, minlength=len(cohorts)))]
+
+        updated = CohortPercentiles(cohorts, values, offsets, self.quantiles, bands={})
+        touched = np.unique(np.r_[old_codes, new_codes])
+        for metric, table in self.bands.items():
+            # The NaN row for unknown cohorts stays last, after any new cohorts
+            bands = np.full((len(cohorts) + 1, len(self.quantiles)), np.nan)
+            bands[:len(self.cohorts)] = table[:-1]
+            bands[touched] = updated._band_table(metric, touched)
+            updated.bands[metric] = bands
+        return updated
+
+    def _band_table(self, metric, cohorts=None):
+        """Band rows of the cohort positions `cohorts`; by default every cohort plus the NaN row."""
+        if cohorts is None:
+            return np.vstack([self._band_table(metric, range(len(self.cohorts))),
+                              np.full((1, len(self.quantiles)), np.nan)])
+        table = np.full((len(cohorts), len(self.quantiles)), np.nan)
+        for row, i in enumerate(cohorts):
+            cohort = self._slice(metric, i)
+            if len(cohort) >= MIN_COHORT:
+                table[row] = _sorted_quantiles(cohort, self.quantiles)
+        return table
+
+    def _slice(self, metric, i):
+        offsets = self.offsets[metric]
+        return self.values[metric][offsets[i]:offsets[i + 1]]
+
+    def size(self, metric, sex, age_group):
+        """Reference patients in the cohort with a value for `metric`."""
+        i = self.cohort_index.get((str(sex), str(age_group)))
+        return 0 if i is None or metric not in self.values else len(self._slice(metric, i))
+
+    def percentile(self, metric, value, sex, age_group):
+        """
+        Percentile (0-100) of `value` in the cohort: the share below it,
+        counting ties as half. NaN without a (large enough) cohort.
+        """
+        i = self.cohort_index.get((str(sex), str(age_group)))
+        if i is None or metric not in self.values or pd.isna(value):
+            return np.nan
+        cohort = self._slice(metric, i)
+        if len(cohort) < MIN_COHORT:
+            return np.nan
+        below = np.searchsorted(cohort, value, side="left")
+        at_most = np.searchsorted(cohort, value, side="right")
+        return 100 * (below + (at_most - below) / 2) / len(cohort)
+
+    def band(self, metric, sex, age_group):
+        """The cohort's BAND_QUANTILES values (NaN if unknown or too small)."""
+        return self.bands_for(metric, [sex], [age_group])[0]
+
+    def bands_for(self, metric, sexes, age_groups):
+        """(len(sexes), BAND_QUANTILES) - one band row per (sex, age group) pair, e.g. per scan."""
+        if metric not in self.bands:
+            return np.full((len(sexes), len(self.quantiles)), np.nan)
+        missing = len(self.cohorts)
+        rows = [self.cohort_index.get((str(sex), str(age)), missing) for sex, age in zip(sexes, age_groups)]
+        return self.bands[metric][np.asarray(rows, dtype=np.intp)]
+
+
+def _cohort_latest(composition, demographics):
+    """
+    Factorized Sex and Age Group per scan (codes and sorted labels) and the
+    mask of each patient's last scan in each cohort they passed through.
+    """
+    names = composition["Patient Name"]
+    patient = (names.cat.codes.to_numpy() if isinstance(names.dtype, pd.CategoricalDtype)
+               else pd.factorize(np.asarray(names))[0])
+    sex, sexes = pd.factorize(np.asarray(demographics["Sex"], dtype=object), sort=True)
+    age, ages = pd.factorize(np.asarray(demographics["Age Group"], dtype=object), sort=True)
+    # A patient's cohort only changes forward in time (age), so their
+    # scans in one cohort are a run: keep the last scan of each run
+    key = (patient.astype(np.int64) * (len(sexes) + 1) + sex) * (len(ages) + 1) + age
+    latest = np.r_[key[1:] != key[:-1], True] & (sex >= 0) & (age >= 0) if len(key) else \
+        np.zeros(0, dtype=bool)
+    return sex, np.asarray(sexes, dtype=object), age, np.asarray(ages, dtype=object), latest
+
+
+def _sorted_quantiles(values, quantiles):
+    """np.quantile (linear interpolation) of already sorted `values`, without partitioning them."""
+    position = (len(values) - 1) * np.asarray(quantiles, dtype=np.float64)
+    below = np.floor(position).astype(np.intp)
+    above = np.minimum(below + 1, len(values) - 1)
+    return values[below] + (position - below) * (values[above] - values[below])
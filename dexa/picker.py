@@ -0,0 +1,57 @@
+"""
+Search-as-you-type patient picker.
+
+The dropdown is sent with a single option (the selected patient), so the
+page payload is the same for 100 or 100k patients. Each keystroke asks the
+server for the top SEARCH_LIMIT prefix matches over patient names and IDs
+(dexa.search) and replaces the options with those.
+"""
+import os
+
+from dash import Input, Output, State, callback, dcc
+from dash.exceptions import PreventUpdate
+
+from dexa.store import get_store
+
+SEARCH_LIMIT = int(os.environ.get("DEXA_SEARCH_LIMIT", "20"))
+
+
+def _option(patient, search=None):
+    option = {'label': patient, 'value': patient}
+    if search is not None:
+        # Lets the dropdown's own filter keep options matched by an ID
+        option['search'] = search
+    return option
+
+
+def patient_picker(id, value=None, **kwargs):
+    """dcc.Dropdown preselecting `value` (default: the first patient)."""
+    if value is None:
+        value = get_store().first_patient()
+    return dcc.Dropdown(
+        id=id,
+        options=[_option(value)] if value is not None else [],
+        value=value,
+        placeholder="Search by patient name or ID...",
+        **kwargs
+    )
+
+
+def register_patient_search(id):
+    """Register the callback that fills `id`'s options from the search index."""
+    @callback(
+        Output(id, 'options'),
+        Input(id, 'search_value'),
+        State(id, 'value')
+    )
+    def update_patient_options(search_value, value):
+        # Closing the menu clears the search - keep the current options
+        if not search_value:
+            raise PreventUpdate
+        matches = get_store().search_patients(search_value, SEARCH_LIMIT)
+        options = [_option(patient, key) for patient, key in matches]
+        # The selected patient must stay an option or its label disappears
+        if value is not None and all(patient != value for patient, _ in matches):
+            options.append(_option(value))
+        return options
+    return update_patient_options
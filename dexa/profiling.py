@@ -0,0 +1,220 @@
+"""
+On-demand profiling of individual Dash callback requests.
+
+Off unless asked for. A callback request is profiled when either
+
+    DEXA_PROFILE=update_page_content,update_series   (or "all") names its
+        callback function - every such request in this worker is profiled;
+    the request carries X-Dexa-Profile: <token> matching DEXA_PROFILE_TOKEN
+        - e.g. an admin reproducing one slow patient from the browser
+        (a header extension or `curl`). Without DEXA_PROFILE_TOKEN the
+        header is ignored.
+
+The whole request runs under cProfile (deterministic, stdlib), so the
+profile covers the data access, the figure and component building, and
+Dash's JSON serialization of the response. It is written to
+DEXA_PROFILE_DIR (default .cache/profiles) as a .prof file, which
+`python -m pstats` or snakeviz can open, plus a small JSON summary: own
+time per area (app code, DataFrame / NumPy, figure building, components,
+JSON serialization, Dash / Flask, builtins) and the top functions by own
+time. Only the newest DEXA_PROFILE_KEEP profiles are kept.
+
+GET /profiles lists the recent profiles with their summaries; GET
+/profiles/<file> downloads one. Both need the token (header or ?token=):
+the index lists callback inputs, i.e. patient names. Requests from this
+host are only let in without it under DEXA_TRUST_LOOPBACK=1 (see
+dexa.metrics), since behind a reverse proxy every request is local.
+
+A profiled request runs several times slower, and its latency is recorded
+by dexa.metrics like any other. A figure cache hit profiles only the
+lookup; the summary says whether the call was a hit.
+"""
+import cProfile
+import hmac
+import html
+import json
+import os
+import pstats
+import time
+
+from flask import Response, abort, g, request, send_from_directory
+
+from dexa import figure_cache
+from dexa.metrics import DASH_UPDATE_PATH, callback_names, trusted_local
+
+PROFILE_CALLBACKS = {name.strip() for name in os.environ.get("DEXA_PROFILE", "").split(",") if name.strip()}
+PROFILE_TOKEN = os.environ.get("DEXA_PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("DEXA_PROFILE_DIR", os.path.join(".cache", "profiles"))
+PROFILE_KEEP = int(os.environ.get("DEXA_PROFILE_KEEP", "50"))
+HEADER = "X-Dexa-Profile"
+TOP_FUNCTIONS = 15
+
+# Where time goes, by the path of the function's file (first match wins)
+AREAS = [
+    ("JSON serialization", ("/json/", "/plotly/io/_json", "/_plotly_utils/utils", "/orjson")),
+    ("app code", ("/pages/", "/dexa/")),
+    ("DataFrame / NumPy", ("/pandas/", "/numpy/")),
+    ("figure building", ("/plotly/", "/_plotly_utils/")),
+    ("components", ("/dash/development/", "/dash/html/", "/dash/dcc/", "/dash/dash_table/")),
+    ("Dash / Flask", ("/dash/", "/flask/", "/werkzeug/")),
+]
+
+
+def _area(filename):
+    if filename == "~":
+        return "builtins"  # C functions (isinstance, dict methods, ...), not attributable here
+    path = filename.replace("\\", "/")
+    for area, patterns in AREAS:
+        if any(pattern in path for pattern in patterns):
+            return area
+    return "other"
+
+
+def summarize(profile, top=TOP_FUNCTIONS):
+    """Own time per area and the `top` functions by own time."""
+    stats = pstats.Stats(profile).stats
+    areas = {}
+    functions = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.items():
+        areas[_area(filename)] = areas.get(_area(filename), 0.0) + own
+        functions.append((own, cumulative, calls, f"{os.path.basename(filename)}:{line}({name})"))
+    functions.sort(reverse=True)
+    return {
+        "areas": dict(sorted(areas.items(), key=lambda item: -item[1])),
+        "top": [{"function": label, "own_s": own, "cumulative_s": cumulative, "calls": calls}
+                for own, cumulative, calls, label in functions[:top]],
+    }
+
+
+def _authorized(expected):
+    token = request.headers.get(HEADER) or request.args.get("token")
+    if expected and token and hmac.compare_digest(token, expected):
+        return True
+    return trusted_local()
+
+
+class CallbackProfiler:
+    """Profiles selected callback requests and keeps the results in `folder`."""
+
+    def __init__(self, folder=PROFILE_DIR, callbacks=PROFILE_CALLBACKS, token=PROFILE_TOKEN,
+                 keep=PROFILE_KEEP):
+        self.folder = folder
+        self.callbacks = set(callbacks)
+        self.token = token
+        self.keep = keep
+
+    def wanted(self, callback, header):
+        if "all" in self.callbacks or callback in self.callbacks:
+            return True
+        return bool(self.token and header and hmac.compare_digest(header, self.token))
+
+    def save(self, profile, callback, output, inputs, seconds, cache):
+        """Write the .prof file and its JSON summary; returns the summary."""
+        os.makedirs(self.folder, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 10**9:09d}"
+        name = f"{stamp}-{callback}-{os.getpid()}"
+        profile.dump_stats(os.path.join(self.folder, name + ".prof"))
+        summary = {"file": name + ".prof", "callback": callback, "output": output, "inputs": inputs,
+                   "seconds": seconds, "cache": cache, "time": time.time(), **summarize(profile)}
+        with open(os.path.join(self.folder, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f)
+        self._prune()
+        return summary
+
+    def recent(self, limit=None):
+        """Summaries of the kept profiles, newest first."""
+        try:
+            names = sorted((n for n in os.listdir(self.folder) if n.endswith(".json")), reverse=True)
+        except FileNotFoundError:
+            return []
+        summaries = []
+        for name in names[:limit]:
+            try:
+                with open(os.path.join(self.folder, name), encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned by another worker, or being written
+        return summaries
+
+    def _prune(self):
+        names = sorted(n for n in os.listdir(self.folder) if n.endswith(".json"))
+        for name in names[:max(len(names) - self.keep, 0)]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.unlink(os.path.join(self.folder, name[:-len(".json")] + suffix))
+                except OSError:
+                    pass
+
+
+def render_index(summaries, query=""):
+    """HTML page listing `summaries` with their areas and hot spots (`query` is kept on links)."""
+    rows = []
+    for s in summaries:
+        total = sum(s["areas"].values()) or 1.0
+        areas = ", ".join(f"{html.escape(area)} {seconds / total:.0%}"
+                          for area, seconds in s["areas"].items() if seconds / total >= 0.01)
+        hot = "".join(f"<li><code>{html.escape(f['function'])}</code> {f['own_s'] * 1e3:.1f} ms own, "
+                      f"{f['cumulative_s'] * 1e3:.1f} ms cumulative, {f['calls']} calls</li>"
+                      for f in s["top"][:5])
+        rows.append(
+            f"<tr><td>{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(s['time']))}</td>"
+            f"<td>{html.escape(s['callback'])}<br><small>{html.escape(s['output'])}</small></td>"
+            f"<td>{html.escape(json.dumps(s['inputs']))}</td>"
+            f"<td>{s['seconds'] * 1e3:.1f} ms{' (cache ' + html.escape(s['cache']) + ')' if s['cache'] else ''}</td>"
+            f"<td>{areas}</td><td><ol>{hot}</ol></td>"
+            f"<td><a href=\"profiles/{html.escape(s['file'] + query)}\">.prof</a></td></tr>")
+    return ("<!DOCTYPE html><html><head><title>Callback profiles</title>"
+            "<style>body{font-family:sans-serif;margin:1rem}td{vertical-align:top;padding:4px 8px;"
+            "border-bottom:1px solid #ddd}ol{margin:0;padding-left:1.2rem}</style></head><body>"
+            f"<h1>Callback profiles</h1><p>{len(summaries)} recent (newest first). "
+            "Open a .prof with <code>python -m pstats</code> or snakeviz.</p>"
+            "<table><tr><th>When</th><th>Callback</th><th>Inputs</th><th>Time</th>"
+            "<th>Own time by area</th><th>Hot spots</th><th></th></tr>"
+            + "".join(rows) + "</table></body></html>")
+
+
+def enable_profiling(dash_app, path="/profiles", profiler=None):
+    """Profile selected callback requests of `dash_app`; index and downloads under `path`."""
+    profiler = profiler or CallbackProfiler()
+    server = dash_app.server
+    resolve = callback_names(dash_app)
+
+    @server.before_request
+    def _start_profile():
+        if not request.path.endswith(DASH_UPDATE_PATH):
+            return
+        header = request.headers.get(HEADER)
+        if not profiler.callbacks and not header:
+            return  # the common case: profiling is off
+        body = request.get_json(silent=True) or {}
+        callback, output = resolve(body.get("output", ""))
+        if profiler.wanted(callback, header):
+            g.dexa_profile = (cProfile.Profile(), callback, output,
+                              [i.get("value") for i in body.get("inputs", [])], time.perf_counter())
+            g.dexa_profile[0].enable()
+
+    @server.after_request
+    def _save_profile(response):
+        active = g.pop("dexa_profile", None)
+        if active is None:
+            return response
+        profile, callback, output, inputs, started = active
+        profile.disable()
+        profiler.save(profile, callback, output, inputs, time.perf_counter() - started,
+                      figure_cache.last_lookup())
+        return response
+
+    def index():
+        if not _authorized(profiler.token):
+            abort(403)
+        query = "?" + request.query_string.decode() if request.query_string else ""
+        return Response(render_index(profiler.recent(profiler.keep), query), mimetype="text/html")
+
+    def download(name):
+        if not _authorized(profiler.token) or not name.endswith(".prof"):
+            abort(403)
+        return send_from_directory(os.path.abspath(profiler.folder), name, as_attachment=True)
+
+    server.add_url_rule(path, "dexa_profiles", index)
+    server.add_url_rule(path + "/<name>", "dexa_profile_file", download)
+    return profiler
@@ -0,0 +1,127 @@
+"""
+Hot reload of the data files without restarting workers.
+
+A daemon thread per process polls the size and mtime of the data CSVs every
+DEXA_RELOAD_INTERVAL seconds (0 disables it). Once they have changed and
+then held still for one more poll (so a file still being copied in is
+usually not read half-written - writers that replace files atomically via
+rename are always safe), it builds a complete new DataStore off the request
+path and publishes it with set_store(). The store's `generation` counts the
+swaps. When rows were only appended to the master CSV (dexa.ingest), just
+those rows are ingested instead (ingest_appended): the new store keeps
+every untouched patient's data version, so their cached figures stay valid.
+
+Readers take no lock: a callback calls get_store() once and uses that
+object throughout, so it sees one consistent data version even if a swap
+lands mid-request. The old store is freed once the last such callback
+returns. Figure cache keys include the data version, so entries built from
+the old files simply stop being hit.
+
+With DEXA_BACKEND=sqlite the watched file is the database instead, and a
+"reload" just reopens it (see dexa.sqlite_store).
+"""
+import os
+import threading
+import time
+import warnings
+
+from dexa import store as data_store
+
+RELOAD_INTERVAL = float(os.environ.get("DEXA_RELOAD_INTERVAL", "5"))
+
+
+class DataWatcher(threading.Thread):
+    """Polls the data files and swaps in a rebuilt store when they change."""
+
+    def __init__(self, interval=RELOAD_INTERVAL, paths=None):
+        super().__init__(name="dexa-data-watcher", daemon=True)
+        self.interval = interval
+        self.paths = paths or data_store.watched_files()
+        self._loaded = data_store.data_files_stat(self.paths)
+        self._pending = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+
+    def check(self):
+        """One poll; returns the newly published store, if any."""
+        current = data_store.data_files_stat(self.paths)
+        if current == self._loaded:
+            self._pending = None
+            return None
+        if current != self._pending:
+            # Changed since the last poll - wait until the files settle
+            self._pending = current
+            return None
+        self._pending = None
+        return self.reload(current)
+
+    def reload(self, stat=None):
+        started = time.perf_counter()
+        current = data_store._store
+        store = self._ingest_appended()
+        if store is not None:
+            self._loaded = stat or data_store.data_files_stat(self.paths)
+            if store is current:
+                # Touched, not changed
+                return None
+            print(f"Data appended: version {store.version} (generation {store.generation}) "
+                  f"in {time.perf_counter() - started:.2f}s")
+            return store
+        try:
+            store = data_store.load_store()
+        except Exception as e:  # keep serving the old data
+            warnings.warn(f"Data reload failed, keeping the current store: {e}")
+            self._loaded = stat or data_store.data_files_stat(self.paths)
+            return None
+        self._loaded = stat or data_store.data_files_stat(self.paths)
+        if data_store._store is not None and store.version == data_store._store.version:
+            # Touched, not changed
+            return None
+        data_store.set_store(store)
+        print(f"Data reloaded: version {store.version} (generation {store.generation}) "
+              f"in {time.perf_counter() - started:.2f}s")
+        return store
+
+    def _ingest_appended(self):
+        """The store with rows appended to master ingested (dexa.ingest), or None to reload."""
+        if data_store.BACKEND != "memory" or data_store._store is None:
+            return None
+        from dexa import ingest
+        try:
+            return ingest.ingest_appended()
+        except Exception as e:  # fall back to a full reload
+            warnings.warn(f"Ingesting appended rows failed, reloading: {e}")
+            return None
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def start_watcher(interval=RELOAD_INTERVAL):
+    """Start this process's watcher (once); None when reloading is disabled."""
+    global _watcher
+    if interval <= 0:
+        return None
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = DataWatcher(interval)
+            _watcher.start()
+    return _watcher
+
+
+def mark_current():
+    """
+    Tell this process's watcher the data files on disk are already loaded
+    (after an in-process write such as dexa.ingest), so it doesn't reload them.
+    """
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher._loaded = data_store.data_files_stat(_watcher.paths)
+            _watcher._pending = None
@@ -0,0 +1,119 @@
+"""
+Prefix search over patient names and IDs.
+
+Every searchable key (patient name, patient ID, scan ID) is lower-cased and
+kept in one sorted numpy array next to the patient it belongs to. All keys
+starting with a query then sit in one contiguous block, found with two
+binary searches, so a keystroke costs O(log n + limit) however many patients
+are loaded - and the picker only ever ships the top `limit` matches.
+
+Keys added after the build (dexa.ingest) go into a second, small sorted
+array searched alongside, so an ingest does not copy the whole index; it
+is folded into the main one once it outgrows FOLD_SHARE of it.
+"""
+import heapq
+
+import numpy as np
+import pandas as pd
+
+# Sorts after any character a key can contain: query + this bounds the block
+_PREFIX_END = "\U0010ffff"
+
+# Added keys, as a share of the main array, that trigger folding them in
+FOLD_SHARE = 0.05
+
+
+def _keys(column):
+    """Non-null string values of a (possibly categorical) column."""
+    column = column.dropna()
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    return column.astype(str)
+
+
+class PatientSearch:
+    """Case-insensitive prefix index from names and IDs to patient names."""
+
+    def __init__(self, keys, patients):
+        keys = np.char.lower(np.asarray(keys, dtype=str))
+        patients = np.asarray(patients, dtype=object)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._patients = patients[order]
+        self._added_keys = self._keys[:0]
+        self._added_patients = self._patients[:0]
+
+    @classmethod
+    def from_master(cls, master, key_columns=("Patient ID", "Unique ID")):
+        """Index patient names plus each of `key_columns` present in master."""
+        names = _keys(master["Patient Name"].drop_duplicates())
+        keys, patients = [names.to_numpy()], [names.to_numpy()]
+        for column in key_columns:
+            if column not in master:
+                continue
+            pairs = master[[column, "Patient Name"]].dropna().drop_duplicates()
+            if pairs.empty:
+                continue
+            keys.append(_keys(pairs[column]).to_numpy())
+            patients.append(_keys(pairs["Patient Name"]).to_numpy())
+        return cls(np.concatenate(keys), np.concatenate(patients))
+
+    def with_entries(self, keys, patients):
+        """
+        Copy of the index with (key, patient) pairs added - each inserted at
+        its sorted position among the added keys; the main array is shared.
+        """
+        keys = np.char.lower(np.asarray(keys, dtype=str))
+        order = np.argsort(keys, kind="stable")
+        keys, patients = keys[order], np.asarray(patients, dtype=object)[order]
+        positions = np.searchsorted(self._added_keys, keys, side="right")
+        index = PatientSearch.__new__(PatientSearch)
+        index._keys, index._patients = self._keys, self._patients
+        index._added_keys = np.insert(self._added_keys.astype(np.result_type(self._added_keys, keys)),
+                                      positions, keys)
+        index._added_patients = np.insert(self._added_patients, positions, patients)
+        if len(index._added_keys) > FOLD_SHARE * len(index._keys):
+            index._keys, index._patients = index.entries()
+            index._added_keys, index._added_patients = index._keys[:0], index._patients[:0]
+        return index
+
+    def entries(self):
+        """(lower-cased keys, patients), both in key order."""
+        if not len(self._added_keys):
+            return self._keys, self._patients
+        # Added keys go after equal main ones
+        positions = np.searchsorted(self._keys, self._added_keys, side="right")
+        return (np.insert(self._keys.astype(np.result_type(self._keys, self._added_keys)),
+                          positions, self._added_keys),
+                np.insert(self._patients, positions, self._added_patients))
+
+    def __len__(self):
+        return len(self._keys) + len(self._added_keys)
+
+    def search(self, query, limit=20):
+        """
+        Up to `limit` (patient, matched key) pairs whose key starts with
+        `query`, in key order; each patient is listed once. An empty query
+        returns the first `limit` patients.
+        """
+        query = (query or "").strip().lower()
+        matches, seen = [], set()
+        # A patient's scan IDs share its name as prefix, so they sort right
+        # after it - the walk only skips a few duplicates per patient
+        blocks = [_block(keys, patients, query) for keys, patients in
+                  ((self._keys, self._patients), (self._added_keys, self._added_patients))]
+        for key, patient in heapq.merge(*blocks, key=lambda pair: pair[0]):
+            if patient in seen:
+                continue
+            seen.add(patient)
+            matches.append((patient, key))
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+def _block(keys, patients, query):
+    """(key, patient) pairs of the sorted `keys` starting with `query`, lazily."""
+    start = np.searchsorted(keys, query, side="left")
+    stop = np.searchsorted(keys, query + _PREFIX_END, side="left")
+    return zip(keys[start:stop], patients[start:stop])
@@ -0,0 +1,289 @@
+"""
+Similar-patient search: the k patients whose latest scan is closest.
+
+Each patient is one vector from their latest scan: Fat, Lean and BMC (g)
+of every region (the body parts, not SubTotal / Total, which only sum
+them) plus the composition indices in FEATURE_INDICES. Features are
+z-scored over the population, so grams and ratios weigh the same, and a
+missing value (no BMC for Trunk, no scanner-reported BMR) sits at the
+mean. Similarity is the Euclidean distance between those vectors.
+
+SimilarityIndex answers exactly what a brute-force scan would, without
+the scan:
+
+  * the vectors are rotated onto their principal axes (an orthogonal
+    rotation, so distances do not change) and a KD-tree splits the rows
+    on the first TREE_DIMS axes, which carry most of the spread, into
+    leaves of at most LEAF_SIZE contiguous rows. The distance to a leaf's
+    bounding box over those axes is a lower bound of the distance to any
+    row in it, so a query scores leaves in order of that bound and stops
+    at the first leaf that cannot beat the k-th best found so far.
+  * an ingest does not rebuild the tree (with_patients): the changed
+    patients' old rows are tombstoned and their new vectors go to a small
+    buffer that is searched by brute force next to the tree.
+    Normalization and axes stay those of the last build. Once the buffer
+    and the tombstones exceed REBUILD_SHARE of the tree, advance()
+    rebuilds it from the store instead.
+
+get_index(store) builds the index once per data version and keeps the
+latest CACHE_ENTRIES; advance() derives the next version's index from the
+previous one after an ingest (dexa.ingest).
+"""
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from dexa.composition import INDEX_COLUMNS
+
+FEATURE_METRICS = ["Fat (g)", "Lean (g)", "BMC (g)"]
+# Sums of the regions, not regions of their own
+SUM_PARTS = ["SubTotal", "Total"]
+# Exact linear functions of another index (of the visceral fat area, and
+# 100 - body fat %) would only double that index's weight
+FEATURE_INDICES = [col for col in INDEX_COLUMNS if col not in (
+    "Visceral Fat Mass (g)", "Visceral Fat Volume (cm³)", "Total Lean Body (%)")]
+# Latest values shown next to each match
+DISPLAY_COLUMNS = ["Total Body Weight (kg)", "BMI (kg/m²)", "Total Body Fat (%)",
+                   "Lean Mass Index (kg/m²)", "Visceral Fat Area (cm²)"]
+
+DEFAULT_K = 10
+TREE_DIMS = 8
+LEAF_SIZE = 128
+REBUILD_SHARE = 0.1
+CACHE_ENTRIES = 4
+
+
+def latest_positions(scans):
+    """Position of each patient's last scan in `scans` (sorted by patient, then date)."""
+    names = scans["Patient Name"]
+    keys = (names.cat.codes if isinstance(names.dtype, pd.CategoricalDtype) else names).to_numpy()
+    if not len(keys):
+        return np.array([], dtype=np.intp)
+    return np.flatnonzero(np.r_[keys[1:] != keys[:-1], True])
+
+
+def patient_features(cube, composition):
+    """
+    (names, scan dates, features, feature names) of each patient's latest
+    scan, from a cube and the composition table row-aligned with it.
+    """
+    latest = latest_positions(cube.scans)
+    parts = [cube.part_index[part] for part in cube.parts if part not in SUM_PARTS]
+    metrics = [cube.metric_index[metric] for metric in FEATURE_METRICS]
+    regional = cube.values[np.ix_(latest, parts, metrics)].reshape(len(latest), -1)
+    indices = composition.reindex(columns=FEATURE_INDICES).to_numpy(dtype=np.float64)[latest]
+    names = cube.scans["Patient Name"].astype(str).to_numpy(dtype=object)[latest]
+    dates = cube.scans["Scan Date"].to_numpy()[latest]
+    feature_names = [f"{part} {metric}" for part in cube.parts if part not in SUM_PARTS
+                     for metric in FEATURE_METRICS] + FEATURE_INDICES
+    return names, dates, np.hstack([regional.astype(np.float64), indices]), feature_names
+
+
+def _build_tree(coords, leaf_size):
+    """
+    KD-tree over `coords` (rows, dims), split at the median of each node's
+    widest axis down to at most `leaf_size` rows. Returns the row order
+    that makes every leaf a contiguous [start, stop) range, and per leaf
+    that range and its bounding box (lo, hi) - the search needs no more.
+    """
+    order = np.arange(len(coords))
+    pending, leaves = [(0, len(coords))], []
+    while pending:
+        start, stop = pending.pop()
+        rows = order[start:stop]
+        if stop - start <= leaf_size:
+            leaves.append((start, stop))
+            continue
+        spread = coords[rows].max(axis=0) - coords[rows].min(axis=0)
+        axis = np.argmax(spread)
+        middle = (stop - start) // 2
+        order[start:stop] = rows[np.argpartition(coords[rows, axis], middle)]
+        pending.extend([(start + middle, stop), (start, start + middle)])
+    leaves.sort()
+    dims = coords.shape[1]
+    lo = np.array([coords[order[a:b]].min(axis=0) if b > a else np.zeros(dims) for a, b in leaves])
+    hi = np.array([coords[order[a:b]].max(axis=0) if b > a else np.zeros(dims) for a, b in leaves])
+    return order, np.array(leaves, dtype=np.intp).reshape(-1, 2), lo.reshape(-1, dims), hi.reshape(-1, dims)
+
+
+class SimilarityIndex:
+    """
+    Rows 0..len(tree)-1 are the tree's, in leaf order; rows after them are
+    the buffer (patients updated since the build). alive[row] is False for
+    rows superseded by a newer vector of the same patient.
+    """
+
+    def __init__(self, names, dates, features, feature_names, tree_dims=TREE_DIMS, leaf_size=LEAF_SIZE):
+        self.feature_names = list(feature_names)
+        self.display = [self.feature_names.index(col) for col in DISPLAY_COLUMNS]
+        features = np.asarray(features, dtype=np.float64)
+        # Scale of the build population; a feature nobody has stays at 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+            self.mean = np.nan_to_num(np.nanmean(features, axis=0))
+            scale = np.nan_to_num(np.nanstd(features, axis=0))
+        self.scale = np.where(scale > 0, scale, 1.0)
+        normalized = self.normalize(features)
+        # Principal axes, largest variance first (complete, so a rotation)
+        _, vectors = np.linalg.eigh(normalized.T @ normalized)
+        self.axes = vectors[:, ::-1]
+        points = normalized @ self.axes
+        self.tree_dims = min(tree_dims, points.shape[1])
+        order, self.leaves, self.lo, self.hi = _build_tree(points[:, :self.tree_dims],
+                                                              leaf_size)
+        self.tree_size = len(order)
+        self.points = points[order]
+        self.names = np.asarray(names, dtype=object)[order]
+        self.dates = np.asarray(dates)[order]
+        self.values = features[order][:, self.display]
+        self.alive = np.ones(len(order), dtype=bool)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(*patient_features(*store.latest_scans()))
+
+    def __len__(self):
+        """Patients in the index."""
+        return len(self.rows)
+
+    @property
+    def stale(self):
+        """Buffered plus tombstoned rows: the rows the tree does not serve."""
+        return len(self.alive) - self.tree_size + int((~self.alive[:self.tree_size]).sum())
+
+    def normalize(self, features):
+        """Features z-scored with the build population's scale, missing values at 0."""
+        return np.nan_to_num((np.asarray(features, dtype=np.float64) - self.mean) / self.scale)
+
+    def with_patients(self, names, dates, features):
+        """
+        A new index with these patients' vectors replaced (or added): their
+        old rows are tombstoned and the new ones buffered. The tree arrays
+        are shared with this index, which is left unchanged.
+        """
+        updated = object.__new__(SimilarityIndex)
+        updated.__dict__.update(self.__dict__)
+        names = np.asarray(names, dtype=object)
+        updated.points = np.vstack([self.points, self.normalize(features) @ self.axes])
+        updated.names = np.concatenate([self.names, names])
+        updated.dates = np.concatenate([self.dates, np.asarray(dates, dtype=self.dates.dtype)])
+        updated.values = np.vstack([self.values, np.asarray(features, dtype=np.float64)[:, self.display]])
+        updated.alive = np.r_[self.alive, np.ones(len(names), dtype=bool)]
+        updated.rows = dict(self.rows)
+        for row, name in enumerate(names, start=len(self.alive)):
+            previous = updated.rows.get(name)
+            if previous is not None:
+                updated.alive[previous] = False
+            updated.rows[name] = row
+        return updated
+
+    def _search_tree(self, query, k):
+        """(squared distances, rows) of the k nearest live tree rows, unsorted."""
+        # Lower bound of the distance to every row of each leaf: the
+        # distance to the leaf's box over the tree axes
+        corner = query[:self.tree_dims]
+        gaps = np.maximum(self.lo - corner, 0) + np.maximum(corner - self.hi, 0)
+        bounds = (gaps ** 2).sum(axis=1)
+        order = np.argsort(bounds)
+        best_d = np.full(k, np.inf)
+        best_rows = np.full(k, -1, dtype=np.intp)
+        # Leaves nearest-bound first, in doubling batches (fewer, larger
+        # array operations) - each batch only keeps the leaves that can
+        # still beat the current k-th best
+        done, batch = 0, 1
+        while done < len(order) and bounds[order[done]] < best_d.max():
+            leaves = order[done:done + batch]
+            leaves = leaves[bounds[leaves] < best_d.max()]
+            done, batch = done + batch, batch * 2
+            rows = np.concatenate([np.arange(start, stop) for start, stop in self.leaves[leaves]])
+            distances = ((self.points[rows] - query) ** 2).sum(axis=1)
+            distances[~self.alive[rows]] = np.inf
+            candidates_d = np.concatenate([best_d, distances])
+            candidates = np.concatenate([best_rows, rows])
+            keep = np.argpartition(candidates_d, k - 1)[:k]
+            best_d, best_rows = candidates_d[keep], candidates[keep]
+        return best_d, best_rows
+
+    def nearest_rows(self, query, k):
+        """(distances, rows) of the k live rows nearest the rotated `query`, nearest first."""
+        k = min(k, len(self.alive))
+        if k <= 0:
+            return np.zeros(0), np.zeros(0, dtype=np.intp)
+        distances, rows = self._search_tree(query, k)
+        if len(self.alive) > self.tree_size:
+            buffered = ((self.points[self.tree_size:] - query) ** 2).sum(axis=1)
+            buffered[~self.alive[self.tree_size:]] = np.inf
+            distances = np.r_[distances, buffered]
+            rows = np.r_[rows, np.arange(self.tree_size, len(self.alive))]
+        order = np.argsort(distances, kind="stable")[:k]
+        order = order[np.isfinite(distances[order])]
+        return np.sqrt(distances[order]), rows[order]
+
+    def _table(self, distances, rows):
+        values = self.values[rows]
+        return pd.DataFrame({"Patient Name": self.names[rows], "Distance": distances,
+                             "Latest Scan": self.dates[rows],
+                             **{col: values[:, i] for i, col in enumerate(DISPLAY_COLUMNS)}})
+
+    def nearest(self, name, k=DEFAULT_K):
+        """
+        The k patients most similar to `name` (not including them), nearest
+        first: Patient Name, Distance, Latest Scan and DISPLAY_COLUMNS.
+        Empty for an unknown patient.
+        """
+        row = self.rows.get(name)
+        if row is None:
+            return self._table(np.zeros(0), np.zeros(0, dtype=np.intp))
+        distances, rows = self.nearest_rows(self.points[row], k + 1)
+        mine = rows == row
+        return self._table(distances[~mine][:k], rows[~mine][:k])
+
+    def patient(self, name):
+        """The patient's own row in the nearest() format (Distance 0)."""
+        row = self.rows.get(name)
+        rows = np.array([] if row is None else [row], dtype=np.intp)
+        return self._table(np.zeros(len(rows)), rows)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(version, index):
+    with _cache_lock:
+        _cache[version] = index
+        while len(_cache) > CACHE_ENTRIES:
+            del _cache[next(iter(_cache))]
+
+
+def get_index(store):
+    """The SimilarityIndex for `store`'s data version (built once per version)."""
+    version = store.version
+    with _cache_lock:
+        index = _cache.get(version)
+    if index is None:
+        index = SimilarityIndex.from_store(store)
+        _remember(version, index)
+    return index
+
+
+def advance(previous_version, updated, patients):
+    """
+    After an ingest: if the index of `previous_version` is built, the index
+    of `updated` is that one with `patients`' latest scans swapped in (or,
+    past REBUILD_SHARE, rebuilt). Nothing to do if it was never built.
+    """
+    with _cache_lock:
+        previous = _cache.get(previous_version)
+    if previous is None:
+        return
+    names, dates, features, feature_names = patient_features(*updated.latest_scans(patients))
+    if feature_names != previous.feature_names or \
+            previous.stale + len(names) > REBUILD_SHARE * max(previous.tree_size, 1):
+        index = SimilarityIndex.from_store(updated)
+    else:
+        index = previous.with_patients(names, dates, features)
+    _remember(updated.version, index)
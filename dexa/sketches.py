@@ -0,0 +1,445 @@
+"""
+Streaming quantile sketches of the clinic population per cohort and metric.
+
+dexa.percentiles sorts the whole reference population whenever the data
+changes. The sketches here instead summarize every scan in a KLL sketch
+(Karnin, Lang & Liberty 2016) per (sex, age group, metric):
+
+  * a new scan is an O(1) amortized update per metric - ingest only feeds
+    the new scans, nothing is re-sorted;
+  * two sketches merge into one that summarizes both inputs with the same
+    guarantee, so shards (or workers, or clinics) can be built separately
+    and combined;
+  * a quantile or rank answer is within about RANK_ERROR (1.3% at the
+    default k = 200) of n in rank, with 99% confidence. E.g. a reported
+    median has between ~48.7% and ~51.3% of the cohort's scans below it.
+    Memory per sketch is O(k), however many scans it has seen.
+
+Metrics are PERCENTILE_METRICS plus the Total fat mass in grams
+(TotalBodyFat_g), so clinic medians can be compared with
+NHANES_Median_FatMass_g. Unlike dexa.percentiles (each patient's latest
+scan), every scan counts: a stream cannot take back a patient's earlier
+scan.
+
+Persistence: DEXA_SKETCH_PATH (default Data/cohort_sketches.npz) holds
+this shard's sketches and hashes of the scan IDs they have seen. Loading
+feeds only the scans the file has not seen yet. If the file has seen
+scans that are no longer in the data, it is rebuilt from scratch. Edits
+to scans it has already seen need a rebuild too (--rebuild). The file is
+written at warm-up, by ingest and by the CLI, never while answering a
+page request. Sketch values are a summary, not the data, so the file is
+small (O(cohorts x metrics x k)).
+
+Other shards: DEXA_SKETCH_SHARDS lists their sketch files (separated by
+os.pathsep, e.g. copied from other sites or combined with --merge). They
+are merged into the local sketches at load and never written. A shard
+file that has seen any local scan is skipped, since it would count those
+scans twice.
+
+CLI:  python -m dexa.sketches [--rebuild]          refresh the local file
+      python -m dexa.sketches --merge a.npz b.npz --output shards.npz
+"""
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import warnings
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from dexa import store as data_store
+from dexa.percentiles import PERCENTILE_METRICS
+
+SKETCH_PATH = os.environ.get("DEXA_SKETCH_PATH", os.path.join(data_store.DATA_DIR, "cohort_sketches.npz"))
+# Sketch files of other shards (os.pathsep-separated), merged in read-only
+SHARD_PATHS = tuple(path for path in os.environ.get("DEXA_SKETCH_SHARDS", "").split(os.pathsep) if path)
+SKETCH_K = 200
+# KLL compactor capacities shrink by this factor per level below the top,
+# down to MIN_CAPACITY items
+CAPACITY_DECAY = 2 / 3
+MIN_CAPACITY = 8
+COHORT_COLUMNS = ["Sex", "Age Group"]
+FAT_MASS_METRIC = "TotalBodyFat_g"
+SKETCH_METRICS = PERCENTILE_METRICS + [FAT_MASS_METRIC]
+# Bump when the file layout changes so old files are rebuilt
+SKETCH_FORMAT = 1
+# Sketch sets kept by get_sketches (one per data version)
+CACHE_ENTRIES = 4
+
+
+def rank_error(k=SKETCH_K):
+    """
+    Normalized rank error of a quantile from a KLL sketch with parameter
+    `k` (99% confidence), from the empirical fit published with Apache
+    DataSketches' KLL implementation, which this one follows.
+    """
+    return 2.296 / k ** 0.9723
+
+
+RANK_ERROR = rank_error()
+
+
+class KLLSketch:
+    """
+    levels[h] holds items that each stand for 2**h values. When the sketch
+    is full, the lowest level over its capacity is sorted and every other
+    item (random offset) moves up a level.
+    """
+
+    __slots__ = ("k", "levels", "n", "_items", "_limit", "_random")
+
+    def __init__(self, k=SKETCH_K, seed=None):
+        self.k = k
+        self.levels = [[]]
+        self.n = 0
+        self._items = 0
+        self._limit = self._capacity(0)
+        self._random = random.Random(seed)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * CAPACITY_DECAY ** depth)), MIN_CAPACITY)
+
+    def _grow(self):
+        self.levels.append([])
+        self._limit = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def update(self, value):
+        """Add one value (NaN is ignored)."""
+        if value != value:
+            return
+        self.levels[0].append(float(value))
+        self.n += 1
+        self._items += 1
+        if self._items >= self._limit:
+            self._compress()
+
+    def extend(self, values):
+        """Add many values at once (same result guarantees as one by one)."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.levels[0].extend(values.tolist())
+        self.n += len(values)
+        self._items += len(values)
+        self._compress()
+
+    def merge(self, other):
+        """Fold `other` into this sketch (it then summarizes both)."""
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for level, items in zip(self.levels, other.levels):
+            level.extend(items)
+        self.n += other.n
+        self._items += sum(len(items) for items in other.levels)
+        self._compress()
+        return self
+
+    def _compress(self):
+        while self._items >= self._limit:
+            h = next(h for h, level in enumerate(self.levels) if len(level) >= self._capacity(h))
+            if h + 1 == len(self.levels):
+                self._grow()
+            items = np.sort(np.asarray(self.levels[h]))
+            odd = len(items) % 2
+            promoted = items[:len(items) - odd][self._random.getrandbits(1)::2]
+            self.levels[h] = items[len(items) - odd:].tolist()
+            self.levels[h + 1].extend(promoted.tolist())
+            self._items -= len(items) - odd - len(promoted)
+
+    def _sorted(self):
+        values = np.concatenate([np.asarray(level, dtype=np.float64) for level in self.levels])
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        """Value at quantile `q` (0-1, scalar or array); NaN if empty."""
+        if not self.n:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        values, cumulative = self._sorted()
+        positions = np.searchsorted(cumulative, np.asarray(q) * cumulative[-1], side="left")
+        return values[np.minimum(positions, len(values) - 1)]
+
+    def rank(self, value):
+        """Estimated fraction of the values <= `value`; NaN if empty."""
+        if not self.n:
+            return np.nan
+        values, cumulative = self._sorted()
+        at = np.searchsorted(values, value, side="right")
+        return cumulative[at - 1] / cumulative[-1] if at else 0.0
+
+    def copy(self):
+        twin = KLLSketch(self.k)
+        twin.levels = [list(level) for level in self.levels]
+        twin.n, twin._items, twin._limit = self.n, self._items, self._limit
+        twin._random.setstate(self._random.getstate())
+        return twin
+
+
+def scan_hashes(scan_ids):
+    """64-bit hashes of scan IDs, to remember which scans a sketch has seen."""
+    return pd.util.hash_array(np.asarray(scan_ids, dtype=object).astype(str).astype(object))
+
+
+class CohortSketches:
+    """A KLLSketch per (sex, age group, metric), plus the hashes of the scans fed."""
+
+    def __init__(self, k=SKETCH_K, sketches=None, seen=None):
+        self.k = k
+        self.sketches = sketches if sketches is not None else {}
+        self.seen = seen if seen is not None else np.array([], dtype=np.uint64)
+
+    def _sketch(self, sex, age_group, metric):
+        key = (str(sex), str(age_group), metric)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = KLLSketch(self.k, seed=zlib.crc32(repr(key).encode()))
+        return sketch
+
+    @classmethod
+    def from_scans(cls, scans, k=SKETCH_K):
+        """Bulk build from a cohort_scans() table (one row per scan)."""
+        sketches = cls(k)
+        sketches.add_scans(scans, bulk=True)
+        return sketches
+
+    def add_scans(self, scans, bulk=False):
+        """
+        Feed a cohort_scans() table. One update per scan and metric; `bulk`
+        groups the rows by cohort first (faster for many scans).
+        """
+        known = scans[COHORT_COLUMNS].notna().all(axis=1)
+        scans = scans[known]
+        metrics = [metric for metric in SKETCH_METRICS if metric in scans]
+        if bulk:
+            for (sex, age_group), rows in scans.groupby(COHORT_COLUMNS, observed=True, sort=False):
+                for metric in metrics:
+                    self._sketch(sex, age_group, metric).extend(rows[metric].to_numpy(dtype=np.float64))
+        else:
+            values = scans[metrics].to_numpy(dtype=np.float64)
+            for (sex, age_group), row in zip(scans[COHORT_COLUMNS].itertuples(index=False), values):
+                for metric, value in zip(metrics, row):
+                    self._sketch(sex, age_group, metric).update(value)
+        self.seen = np.union1d(self.seen, scan_hashes(scans["Unique ID"]))
+        return self
+
+    def merge(self, other):
+        """Fold `other` (e.g. another shard's sketches) into these."""
+        for (sex, age_group, metric), sketch in other.sketches.items():
+            self._sketch(sex, age_group, metric).merge(sketch)
+        self.seen = np.union1d(self.seen, other.seen)
+        return self
+
+    def copy(self):
+        return CohortSketches(self.k, {key: sketch.copy() for key, sketch in self.sketches.items()},
+                              self.seen.copy())
+
+    def quantile(self, metric, sex, age_group, q):
+        """Cohort quantile(s) of `metric`; NaN for a cohort with no scans."""
+        sketch = self.sketches.get((str(sex), str(age_group), metric))
+        return sketch.quantile(q) if sketch is not None else (np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan)
+
+    def median(self, metric, sex, age_group):
+        return self.quantile(metric, sex, age_group, 0.5)
+
+    def percentile(self, metric, sex, age_group, value):
+        """Estimated percentile (0-100) of `value` among the cohort's scans."""
+        sketch = self.sketches.get((str(sex), str(age_group), metric))
+        return 100 * sketch.rank(value) if sketch is not None and sketch.n else np.nan
+
+    def scans(self, metric, sex, age_group):
+        sketch = self.sketches.get((str(sex), str(age_group), metric))
+        return sketch.n if sketch is not None else 0
+
+    def save(self, path, version=""):
+        """Write to `path` atomically (npz: items, level sizes and counts per sketch)."""
+        keys = list(self.sketches)
+        levels = [sketch.levels for sketch in self.sketches.values()]
+        meta = {"format": SKETCH_FORMAT, "k": self.k, "version": version,
+                "keys": keys, "n": [self.sketches[key].n for key in keys]}
+        arrays = {
+            "__meta__": np.array(json.dumps(meta)),
+            "items": np.array([x for sketch in levels for level in sketch for x in level], dtype=np.float64),
+            "level_sizes": np.array([len(level) for sketch in levels for level in sketch], dtype=np.int64),
+            "level_counts": np.array([len(sketch) for sketch in levels], dtype=np.int64),
+            "seen": self.seen,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Read a file written by save(); ValueError if its format is outdated."""
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz["__meta__"]))
+            if meta.get("format") != SKETCH_FORMAT:
+                raise ValueError(f"{path}: sketch format {meta.get('format')}, expected {SKETCH_FORMAT}")
+            items, sizes, counts, seen = npz["items"], npz["level_sizes"], npz["level_counts"], npz["seen"]
+        sketches = cls(meta["k"], seen=seen)
+        item_at, level_at = 0, 0
+        for key, n, count in zip(meta["keys"], meta["n"], counts):
+            sketch = sketches._sketch(*key)
+            sketch.levels = []
+            for size in sizes[level_at:level_at + count]:
+                sketch.levels.append(items[item_at:item_at + size].tolist())
+                item_at += size
+            level_at += count
+            sketch.n = n
+            sketch._items = sum(len(level) for level in sketch.levels)
+            sketch._limit = sum(sketch._capacity(h) for h in range(len(sketch.levels)))
+        return sketches
+
+
+def load_or_build(store, path=SKETCH_PATH, rebuild=False, write=True):
+    """
+    Sketches covering every scan in `store`: the file at `path` fed with
+    the scans it has not seen, or (rebuild, no usable file, or scans gone
+    from the data) built from all of them. With `write`, writes the file
+    back if it changed.
+    """
+    scans = store.cohort_scans()
+    hashes = scan_hashes(scans["Unique ID"])
+    sketches = None
+    if not rebuild and os.path.exists(path):
+        try:
+            sketches = CohortSketches.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            warnings.warn(f"Rebuilding cohort sketches, could not read {path}: {e}")
+        if sketches is not None and (sketches.k != SKETCH_K or not np.isin(sketches.seen, hashes).all()):
+            sketches = None
+    if sketches is None:
+        sketches = CohortSketches.from_scans(scans)
+    else:
+        new = ~np.isin(hashes, sketches.seen)
+        if not new.any():
+            return sketches
+        sketches.add_scans(scans[new], bulk=new.sum() > 1000)
+    if write:
+        _save(sketches, path, store.version)
+    return sketches
+
+
+def _save(sketches, path, version):
+    try:
+        sketches.save(path, version)
+    except OSError as e:
+        warnings.warn(f"Could not write cohort sketches {path}: {e}")
+
+
+def shards_stat(paths=SHARD_PATHS):
+    """(size, mtime_ns) per shard file - changes when another shard's sketches are replaced."""
+    return data_store.data_files_stat(paths)
+
+
+def _with_shards(local, paths=SHARD_PATHS):
+    """
+    `local` merged with the sketches of the other shards (read-only). A
+    shard file that has seen any of the local scans would count them
+    twice, so it is skipped.
+    """
+    if not paths:
+        return local
+    combined = local.copy()
+    for path in paths:
+        try:
+            shard = CohortSketches.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            warnings.warn(f"Skipping cohort sketch shard {path}: {e}")
+            continue
+        if shard.k != local.k or np.isin(shard.seen, local.seen).any():
+            warnings.warn(f"Skipping cohort sketch shard {path}: different k or overlaps the local scans")
+            continue
+        combined.merge(shard)
+    return combined
+
+
+# (data version, shard files) -> (local sketches, local merged with the shards)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(version, local):
+    _cache[(version, shards_stat())] = (local, _with_shards(local))
+    while len(_cache) > CACHE_ENTRIES:
+        del _cache[next(iter(_cache))]
+
+
+def get_sketches(store, write=False):
+    """
+    The sketches for `store`'s data version, merged with DEXA_SKETCH_SHARDS
+    (loaded / updated once per version). Only writes the local file with
+    `write` - warm-up and ingest, never a page request.
+    """
+    with _cache_lock:
+        entry = _cache.get((store.version, shards_stat()))
+        if entry is None:
+            _remember(store.version, load_or_build(store, write=write))
+            entry = _cache[(store.version, shards_stat())]
+    return entry[1]
+
+
+def advance(store, updated, scan_ids, patients, path=SKETCH_PATH, persist=False):
+    """
+    After an ingest: if `store`'s sketches are loaded, the sketches of
+    `updated` are a copy fed with just the new `scan_ids` (of `patients`) -
+    no reload or rebuild. With `persist`, the local ones are also written
+    to `path`.
+    """
+    with _cache_lock:
+        entry = _cache.get((store.version, shards_stat()))
+    if entry is None:
+        if persist:
+            get_sketches(updated, write=True)  # loads the file, feeds what it lacks, writes it back
+        return
+    # Read only the rows of `patients` (those the new scans belong to)
+    scans = updated.cohort_scans(patients)
+    local = entry[0].copy().add_scans(scans[scans["Unique ID"].astype(str).isin(set(scan_ids))])
+    with _cache_lock:
+        _remember(updated.version, local)
+    if persist:
+        _save(local, path, updated.version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, refresh or merge the cohort quantile sketches.")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild from every scan instead of refreshing")
+    parser.add_argument("--merge", nargs="+", metavar="NPZ", help="sketch files to merge (e.g. one per shard)")
+    parser.add_argument("--output", help=f"default {SKETCH_PATH} (required with --merge)")
+    args = parser.parse_args()
+
+    if args.merge:
+        # The local file only ever holds this shard's scans; a merged file
+        # there would be rejected and rebuilt at the next load
+        if not args.output or os.path.abspath(args.output) == os.path.abspath(SKETCH_PATH):
+            parser.error("--merge needs an --output other than the local sketch file; "
+                         "list it in DEXA_SKETCH_SHARDS to serve it")
+        merged = CohortSketches.load(args.merge[0])
+        for path in args.merge[1:]:
+            merged.merge(CohortSketches.load(path))
+        merged.save(args.output)
+        sketches = merged
+    else:
+        args.output = args.output or SKETCH_PATH
+        sketches = load_or_build(data_store.get_store(), args.output, rebuild=args.rebuild)
+    print(f"{args.output}: {len(sketches.sketches)} sketches over {len(sketches.seen):,} scans, "
+          f"rank error ~{rank_error(sketches.k):.2%} (k={sketches.k})")
+    for (sex, age_group, metric), sketch in sorted(sketches.sketches.items()):
+        if metric == FAT_MASS_METRIC:
+            print(f"  {sex:<7} {age_group:<6} median fat mass {sketch.quantile(0.5) / 1000:6.1f} kg "
+                  f"({sketch.n:,} scans)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Binary columnar snapshots of the Data/ CSVs.
+
+The first load of a CSV parses it as text and writes an uncompressed .npz
+snapshot next to it (one array per column, text and categorical columns dictionary-encoded).
+Later loads read the snapshot instead, as long as the CSV is unchanged:
+a matching size and mtime is trusted directly, otherwise the SHA-256 of the
+CSV decides whether the snapshot is still good or must be rebuilt.
+
+A CSV that is only ever appended to (master_dexa_data.csv, see dexa.ingest)
+can also keep its snapshot as a prefix: with `appendable`, a snapshot whose
+last TAIL_BYTES still match the CSV at the same offset is returned as is,
+and the caller reads just the rows after it (read_appended) instead of
+the whole file being hashed and reparsed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_SUFFIX = ".npz"
+
+# Bump when the on-disk encoding changes so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 2
+
+# Bytes before a snapshot's end that must still match for the CSV to count
+# as appended to (rather than rewritten) since
+TAIL_BYTES = 1 << 16
+
+
+def snapshot_path(csv_path):
+    return csv_path + SNAPSHOT_SUFFIX
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tail_sha256(path, size):
+    """SHA-256 of the TAIL_BYTES of `path` before offset `size`."""
+    with open(path, "rb") as f:
+        f.seek(max(size - TAIL_BYTES, 0))
+        return hashlib.sha256(f.read(min(size, TAIL_BYTES))).hexdigest()
+
+
+def is_appended(csv_path, fingerprint):
+    """
+    Whether `csv_path` is the file `fingerprint` was taken of with rows
+    appended since (or just touched): no shorter, same bytes before the
+    fingerprinted end.
+    """
+    if "tail_sha256" not in fingerprint or os.path.getsize(csv_path) < fingerprint["size"]:
+        return False
+    return tail_sha256(csv_path, fingerprint["size"]) == fingerprint["tail_sha256"]
+
+
+def read_appended(csv_path, offset):
+    """(bytes after `offset`, new end offset) of an appended-to CSV."""
+    with open(csv_path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    return data, offset + len(data)
+
+
+def csv_fingerprint(csv_path, **extra):
+    """Size, mtime, SHA-256 and tail hash of `csv_path` as it is now (plus `extra`)."""
+    stat = os.stat(csv_path)
+    return dict(extra, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=file_sha256(csv_path),
+                tail_sha256=tail_sha256(csv_path, stat.st_size))
+
+
+def _encode_column(values):
+    """Return (kind, arrays) for one column."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return "category", [values.cat.codes.to_numpy(), np.asarray(values.cat.categories, dtype=str)]
+    if pd.api.types.is_datetime64_dtype(values.dtype):
+        return "datetime", [values.to_numpy(dtype="datetime64[ns]")]
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        return "numeric", [values.to_numpy()]
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    return "text", [codes.astype(np.int32), np.asarray(uniques, dtype=str)]
+
+
+def _decode_column(kind, arrays):
+    if kind == "category":
+        codes, categories = arrays
+        return pd.Categorical.from_codes(codes, categories=categories)
+    if kind == "text":
+        codes, uniques = arrays
+        return pd.Categorical.from_codes(codes, categories=uniques).astype(object)
+    return arrays[0]
+
+
+def write_snapshot(df, path, meta):
+    """
+    Write `df` to `path` atomically, together with the `meta` fingerprint
+    (which may carry the loader's "versions", returned by later loads).
+    """
+    arrays, columns = {}, []
+    for i, col in enumerate(df.columns):
+        kind, parts = _encode_column(df[col])
+        columns.append({"name": col, "kind": kind})
+        for j, part in enumerate(parts):
+            arrays[f"c{i}_{j}"] = part
+    meta = dict(meta, format=SNAPSHOT_FORMAT, columns=columns)
+    arrays["__meta__"] = np.array(json.dumps(meta))
+
+    # Write to a temp file and rename so concurrently starting workers never
+    # see a half-written snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=SNAPSHOT_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot_meta(path):
+    with np.load(path, allow_pickle=False) as npz:
+        return json.loads(str(npz["__meta__"]))
+
+
+def read_snapshot(path):
+    with np.load(path, allow_pickle=False) as npz:
+        meta = json.loads(str(npz["__meta__"]))
+        data = {}
+        for i, col in enumerate(meta["columns"]):
+            n_parts = 2 if col["kind"] in ("text", "category") else 1
+            data[col["name"]] = _decode_column(col["kind"], [npz[f"c{i}_{j}"] for j in range(n_parts)])
+    return pd.DataFrame(data), meta
+
+
+def load_csv_cached(csv_path, parse, schema="", appendable=False):
+    """
+    Load `csv_path` through its snapshot, calling `parse(csv_path)` on a miss.
+
+    `schema` identifies how `parse` types the data; a snapshot written under a
+    different schema is treated as stale. Returns (DataFrame, fingerprint),
+    where the fingerprint holds the CSV's size, mtime, SHA-256 and tail hash,
+    plus any "versions" stored with the snapshot (see write_snapshot).
+
+    With `appendable`, a snapshot of an earlier, shorter state of the CSV
+    (is_appended) is returned without hashing the file: the fingerprint is
+    the snapshot's, and the rows past its "size" are left to the caller.
+    """
+    stat = os.stat(csv_path)
+    path = snapshot_path(csv_path)
+    meta = None
+    if os.path.exists(path):
+        try:
+            meta = read_snapshot_meta(path)
+        except Exception:
+            meta = None
+    if meta is not None and (meta.get("format") != SNAPSHOT_FORMAT or meta.get("schema") != schema):
+        meta = None
+
+    if meta is not None and meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+        df, _ = read_snapshot(path)
+        return df, _fingerprint(meta)
+    if meta is not None and appendable and meta["size"] < stat.st_size and is_appended(csv_path, meta):
+        df, _ = read_snapshot(path)
+        return df, _fingerprint(meta)
+
+    fingerprint = csv_fingerprint(csv_path)
+    if meta is not None and meta["sha256"] == fingerprint["sha256"]:
+        # Touched but not changed - reuse the data, refresh the stored mtime
+        df, _ = read_snapshot(path)
+        if "versions" in meta:
+            fingerprint["versions"] = meta["versions"]
+    else:
+        df = parse(csv_path)
+    try:
+        write_snapshot(df, path, dict(fingerprint, schema=schema))
+    except OSError as e:
+        warnings.warn(f"Could not write snapshot {path}: {e}")
+    return df, fingerprint
+
+
+def _fingerprint(meta):
+    return {key: meta[key] for key in ("size", "mtime_ns", "sha256", "tail_sha256", "versions") if key in meta}
@@ -0,0 +1,371 @@
+"""
+SQLite storage backend (DEXA_BACKEND=sqlite).
+
+The in-memory DataStore keeps every table in every worker. SqliteStore
+answers the same per-patient calls with indexed queries against one
+database file instead, so a worker only ever holds the rows of the patient
+it is rendering and its memory no longer grows with the data.
+
+The database is built from a DataStore, i.e. from the CSVs plus everything
+derived from them (symmetry, composition indices, benchmarks):
+
+    python -m dexa.sqlite_store [--output Data/dexa.sqlite]
+
+Tables and indexes:
+
+    master       one row per scan and body part
+                 (Patient Name, Scan Date, Body Part), (Unique ID)
+    composition  \\
+    benchmark     > one row per scan
+    symmetry     /   (Patient Name, Scan Date), (Unique ID)
+    search       prefix keys for the patient pickers, (key)
+    patient_versions / meta   data versions, body parts, metrics, column kinds
+
+Rows are inserted in the DataStore's order, so within a patient and date
+rowid gives the same tie order. A rebuild writes a new file and renames it
+over the old one; workers notice the new file (dexa.reload) and reopen it.
+New scans (dexa.ingest) are written in place in one transaction - the
+database is in WAL mode, so readers keep reading the previous state until
+it commits.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from dexa import store as data_store
+from dexa.cube import RegionalCube
+from dexa.percentiles import CohortPercentiles
+from dexa.similarity import DEFAULT_K, get_index
+from dexa.summary import compute_summary
+from dexa.trends import compute_trends
+
+# Per-scan tables, each built from the DataStore table of the same name
+SCAN_TABLES = ("composition", "benchmark", "symmetry")
+# Rows sent to executemany at a time while building
+INSERT_CHUNK = 50_000
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_kinds(df):
+    """Column -> "date", "text" or "number" (what a fetched column is cast back to)."""
+    return {col: ("date" if pd.api.types.is_datetime64_any_dtype(dtype) else
+                  "number" if pd.api.types.is_numeric_dtype(dtype) else "text")
+            for col, dtype in df.dtypes.items()}
+
+
+def _sql_values(df, kinds):
+    """Column arrays as SQLite values: ISO dates, str / None text, float / None numbers."""
+    columns = []
+    for col, kind in kinds.items():
+        values = df[col]
+        if kind == "date":
+            values = values.dt.strftime("%Y-%m-%d")
+        elif kind == "text":
+            values = values.astype(object)
+        values = values.astype(object).to_numpy()
+        values[pd.isna(values)] = None
+        columns.append(values)
+    return columns
+
+
+def _create_table(conn, table, kinds):
+    types = {"date": "TEXT", "text": "TEXT", "number": "REAL"}
+    conn.execute(f"CREATE TABLE {table} ("
+                 + ", ".join(f"{_quote(col)} {types[kind]}" for col, kind in kinds.items()) + ")")
+
+
+def _insert(conn, table, df, kinds):
+    columns = _sql_values(df.reindex(columns=list(kinds)), kinds)
+    sql = (f"INSERT INTO {table} VALUES (" + ", ".join("?" * len(kinds)) + ")")
+    for start in range(0, len(df), INSERT_CHUNK):
+        conn.executemany(sql, zip(*(values[start:start + INSERT_CHUNK] for values in columns)))
+
+
+def _create_indexes(conn):
+    conn.execute('CREATE INDEX master_patient ON master ("Patient Name", "Scan Date", "Body Part")')
+    conn.execute('CREATE INDEX master_scan ON master ("Unique ID")')
+    for table in SCAN_TABLES:
+        conn.execute(f'CREATE INDEX {table}_patient ON {table} ("Patient Name", "Scan Date")')
+        conn.execute(f'CREATE INDEX {table}_scan ON {table} ("Unique ID")')
+    conn.execute("CREATE INDEX search_key ON search (key)")
+
+
+def write_database(store, path=data_store.SQLITE_PATH):
+    """
+    Write the DataStore `store` to a new SQLite database at `path`,
+    replacing any existing file atomically.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".sqlite")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            tables = {table: getattr(store, table) for table in ("master",) + SCAN_TABLES}
+            kinds = {table: _column_kinds(df) for table, df in tables.items()}
+            with conn:
+                for table, df in tables.items():
+                    _create_table(conn, table, kinds[table])
+                    _insert(conn, table, df, kinds[table])
+                conn.execute("CREATE TABLE search (key TEXT, patient TEXT)")
+                keys, patients = store.search.entries()
+                conn.executemany("INSERT INTO search VALUES (?, ?)",
+                                 zip(keys.tolist(), patients.tolist()))
+                conn.execute("CREATE TABLE patient_versions (patient TEXT PRIMARY KEY, version TEXT)")
+                conn.executemany("INSERT INTO patient_versions VALUES (?, ?)",
+                                 store._patient_versions.items())
+                _create_indexes(conn)
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                    ("version", store.version),
+                    ("base_version", store._base_version),
+                    ("parts", json.dumps(store.cube.parts)),
+                    ("metrics", json.dumps(store.cube.metrics)),
+                    ("columns", json.dumps(kinds)),
+                ])
+            conn.execute("ANALYZE")
+            # Fold the WAL into the file so the renamed file is complete on its own
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class SqliteStore:
+    """
+    The DataStore reader interface (patient_master, patient_symmetry,
+    search_patients, ...) over a database written by write_database().
+    Each thread gets its own read-only connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.generation = 0
+        self._percentiles = (None, None)  # (version, CohortPercentiles)
+        self._percentiles_lock = threading.Lock()
+        meta = dict(self._connection().execute("SELECT key, value FROM meta"))
+        self.parts = json.loads(meta["parts"])
+        self.metrics = json.loads(meta["metrics"])
+        self._columns = json.loads(meta["columns"])
+
+    @classmethod
+    def open(cls, path=data_store.SQLITE_PATH):
+        """Open `path`, building it from the CSVs first if it does not exist."""
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            write_database(data_store.DataStore.from_csv(), path)
+            print(f"Built {path} in {time.perf_counter() - started:.1f}s")
+        return cls(path)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _fetch(self, table, where, params, order):
+        kinds = self._columns[table]
+        cursor = self._connection().execute(
+            f"SELECT * FROM {table} WHERE {where} ORDER BY {order}", params)
+        columns = list(zip(*cursor.fetchall())) or [()] * len(kinds)
+        # Typed straight from the value tuples (None -> NaN / NaT)
+        dtypes = {"date": "datetime64[ns]", "number": np.float64, "text": object}
+        return pd.DataFrame({col: np.array(values, dtype=dtypes[kind])
+                             for (col, kind), values in zip(kinds.items(), columns)})
+
+    def _meta(self, key):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else ""
+
+    @property
+    def version(self):
+        # Read per call: an in-place ingest changes it without a new store
+        return self._meta("version")
+
+    # Per-patient rows, sorted by Scan Date - one indexed range scan each
+    def patient_master(self, name):
+        return self._fetch("master", '"Patient Name" = ?', (name,), '"Scan Date", "Body Part", rowid')
+
+    def patient_composition(self, name):
+        return self._fetch("composition", '"Patient Name" = ?', (name,), '"Scan Date", rowid')
+
+    def patient_benchmark(self, name):
+        return self._fetch("benchmark", '"Patient Name" = ?', (name,), '"Scan Date", rowid')
+
+    def patient_symmetry(self, name):
+        return self._fetch("symmetry", '"Patient Name" = ?', (name,), '"Scan Date", rowid')
+
+    def patient_cube(self, name):
+        return RegionalCube.from_master(self.patient_master(name), self.metrics, parts=self.parts)
+
+    def patient_summary(self, name):
+        """The patient's dexa.summary row, computed from their own scans."""
+        return compute_summary(self.patient_cube(name), self.patient_composition(name)).loc[name]
+
+    def patient_trends(self, name, method="ols"):
+        """The patient's dexa.trends row, fitted to their own scans."""
+        return compute_trends(self.patient_cube(name), self.patient_composition(name), method).loc[name]
+
+    def cohort_percentiles(self):
+        """
+        dexa.percentiles.CohortPercentiles, built from the composition and
+        benchmark tables once per data version (not per request).
+        """
+        version = self.version
+        with self._percentiles_lock:
+            built_for, percentiles = self._percentiles
+            if built_for != version:
+                scans = self.cohort_scans()
+                percentiles = CohortPercentiles.from_scans(scans, scans)
+                self._percentiles = (version, percentiles)
+        return percentiles
+
+    def cohort_scans(self):
+        """Same columns as DataStore.cohort_scans, from one composition / benchmark join."""
+        columns = ", ".join(f"c.{_quote(col)}" for col in self._columns["composition"])
+        cursor = self._connection().execute(
+            f'SELECT {columns}, b."Sex", b."Age Group", b."TotalBodyFat_g" FROM composition c '
+            'JOIN benchmark b ON b."Unique ID" = c."Unique ID" '
+            'ORDER BY c."Patient Name", c."Scan Date", c.rowid')
+        scans = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+        numbers = [col for col, kind in self._columns["composition"].items() if kind == "number"]
+        return scans.astype({col: np.float64 for col in numbers + ["TotalBodyFat_g"]})
+
+    def latest_scans(self, names=None):
+        """Same as DataStore.latest_scans: each patient's last scan by (Scan Date, rowid)."""
+        if names is None:
+            chunks = [None]
+        else:
+            names = list(names)
+            chunks = [names[start:start + 500] for start in range(0, len(names), 500)]
+        masters, compositions = [], []
+        for chunk in chunks:
+            where = "" if chunk is None else f'WHERE "Patient Name" IN ({", ".join("?" * len(chunk))})'
+            latest = ('SELECT "Unique ID" FROM (SELECT "Unique ID", ROW_NUMBER() OVER ('
+                      'PARTITION BY "Patient Name" ORDER BY "Scan Date" DESC, rowid DESC) AS n '
+                      f'FROM composition {where}) WHERE n = 1')
+            params = chunk or ()
+            masters.append(self._fetch("master", f'"Unique ID" IN ({latest})', params,
+                                       '"Patient Name", "Scan Date", "Body Part", rowid'))
+            compositions.append(self._fetch("composition", f'"Unique ID" IN ({latest})', params,
+                                            '"Patient Name", "Scan Date", rowid'))
+        cube = RegionalCube.from_master(pd.concat(masters, ignore_index=True), self.metrics, parts=self.parts)
+        return cube, pd.concat(compositions, ignore_index=True)
+
+    def similar_patients(self, name, k=DEFAULT_K):
+        """The k nearest patients, from an index built once per data version."""
+        return get_index(self).nearest(name, k)
+
+    def patient_version(self, name):
+        row = self._connection().execute(
+            "SELECT version FROM patient_versions WHERE patient = ?", (name,)).fetchone()
+        return row[0] if row else self._meta("base_version")
+
+    def patient_names(self):
+        return [name for name, in self._connection().execute(
+            'SELECT DISTINCT "Patient Name" FROM master ORDER BY "Patient Name"')]
+
+    def first_patient(self):
+        row = self._connection().execute('SELECT MIN("Patient Name") FROM master').fetchone()
+        return row[0]
+
+    def search_patients(self, query, limit=20):
+        """Same results as PatientSearch.search, from the indexed search table."""
+        query = (query or "").strip().lower()
+        cursor = self._connection().execute(
+            "SELECT key, patient FROM search WHERE key >= ? AND key < ? ORDER BY key",
+            (query, query + "\U0010ffff"))
+        matches, seen = [], set()
+        for key, patient in cursor:
+            if patient in seen:
+                continue
+            seen.add(patient)
+            matches.append((patient, key))
+            if len(matches) >= limit:
+                break
+        cursor.close()
+        return matches
+
+    # Schema checks for new scans (dexa.ingest)
+    def master_schema(self):
+        return dict(self._columns["master"])
+
+    def body_parts(self):
+        return list(self.parts)
+
+    def loaded_scans(self, scan_ids):
+        scan_ids = list(scan_ids)
+        loaded = set()
+        for start in range(0, len(scan_ids), 500):
+            chunk = scan_ids[start:start + 500]
+            loaded.update(scan_id for scan_id, in self._connection().execute(
+                f'SELECT DISTINCT "Unique ID" FROM master WHERE "Unique ID" IN ({", ".join("?" * len(chunk))})',
+                chunk))
+        return [scan_id for scan_id in scan_ids if scan_id in loaded]
+
+    def insert_scans(self, rows, commit=True):
+        """
+        Add validated new scan rows (dexa.ingest.validate_scan_rows) in one
+        transaction. Only the new scans are derived: from their own rows,
+        with demographics from the patient's latest benchmark row.
+        """
+        patients = rows["Patient Name"].unique().tolist()
+        benchmark = pd.concat([self.patient_benchmark(name) for name in patients], ignore_index=True)
+        added = data_store.DataStore(rows, None, benchmark)
+        new_first = rows.drop_duplicates("Unique ID")
+        known = set(self.patient_names())
+        new_names = [name for name in patients if name not in known]
+        digest = pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()
+        version = hashlib.sha256(self.version.encode() + digest).hexdigest()[:16]
+
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("master",) + SCAN_TABLES:
+                _insert(conn, table, getattr(added, table), self._columns[table])
+            keys = new_names + new_first["Unique ID"].tolist()
+            conn.executemany("INSERT INTO search VALUES (?, ?)", zip(
+                [key.lower() for key in keys], new_names + new_first["Patient Name"].tolist()))
+            conn.executemany("INSERT OR REPLACE INTO patient_versions VALUES (?, ?)",
+                             [(name, version) for name in patients])
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (version,))
+            conn.execute("COMMIT" if commit else "ROLLBACK")
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the SQLite database from the DEXA CSVs.")
+    parser.add_argument("--output", default=data_store.SQLITE_PATH)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    store = data_store.DataStore.from_csv()
+    write_database(store, args.output)
+    print(f"Wrote {args.output} ({len(store.cube.scans):,} scans, {os.path.getsize(args.output) / 2**20:.1f} MiB) "
+          f"in {time.perf_counter() - started:.1f}s; data version {store.version}")
+
+
+if __name__ == "__main__":
+    main()
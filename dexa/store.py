@@ -0,0 +1,511 @@
+"""
+Process-wide, load-once access to the DEXA data files.
+
+Every page used to parse the CSVs on its own at import time. The store
+parses each file once per process (i.e. once per gunicorn worker), types the
+columns and dates up front, and hands pages shallow views of the shared
+frames so nothing is duplicated as the number of pages grows.
+"""
+import hashlib
+import os
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from dexa.benchmarking import compute_benchmarks, scan_demographics
+from dexa.composition import compute_indices, scan_reported
+from dexa.cube import RegionalCube
+from dexa.percentiles import CohortPercentiles
+from dexa.search import PatientSearch
+from dexa.similarity import DEFAULT_K, get_index, latest_positions
+from dexa.snapshot import csv_fingerprint, load_csv_cached, snapshot_path, write_snapshot
+from dexa.summary import compute_summary
+from dexa.trends import get_trends
+from dexa.symmetry import compute_symmetry
+from dexa.tables import StoreTables, concat, gather, merge
+
+# CSV paths (override the folder with DEXA_DATA_DIR, e.g. for synthetic data)
+DATA_DIR = os.environ.get("DEXA_DATA_DIR", "Data")
+MASTER_CSV = os.path.join(DATA_DIR, "master_dexa_data.csv")
+# Optional: only needed for scanner-reported indices master does not carry
+COMPOSITION_CSV = os.path.join(DATA_DIR, "composition_indices.csv")
+# Optional: only needed for demographics master does not carry
+BENCHMARK_CSV = os.path.join(DATA_DIR, "fat_mass_benchmark_results.csv")
+
+DATA_FILES = (MASTER_CSV, COMPOSITION_CSV, BENCHMARK_CSV)
+
+# Where the pages read from: "memory" (DataStore, every table in each
+# worker) or "sqlite" (dexa.sqlite_store, per-patient queries against an
+# indexed database file built from the CSVs)
+BACKEND = os.environ.get("DEXA_BACKEND", "memory")
+SQLITE_PATH = os.environ.get("DEXA_SQLITE_PATH", os.path.join(DATA_DIR, "dexa.sqlite"))
+
+DATE_FORMAT = "%m-%d-%Y"
+
+# Rows appended to master since its snapshot (as a share of the snapshot's
+# bytes) past which a load rewrites the snapshot to include them
+SNAPSHOT_COMPACT_SHARE = float(os.environ.get("DEXA_SNAPSHOT_COMPACT_SHARE", "0.05"))
+
+# Column types - text columns become categoricals (integer codes plus one
+# dictionary of distinct strings), everything else is a float
+MASTER_TEXT_COLUMNS = ['Unique ID', 'Patient Name', 'Body Part', 'Ethnicity', 'Sex']
+COMPOSITION_TEXT_COLUMNS = ['Unique ID', 'Patient Name', 'Measure', 'Result']
+BENCHMARK_TEXT_COLUMNS = ['Unique ID', 'Patient Name', 'Body Part', 'Ethnicity', 'Sex',
+                          'Age Group', 'Category', 'Interpretation', 'Patient_Message']
+
+# Text columns whose dictionary is shared by every table, so the same
+# patient / scan / body part has the same code everywhere and filters and
+# joins compare integers instead of strings
+SHARED_CATEGORY_COLUMNS = ['Unique ID', 'Patient Name', 'Body Part', 'Ethnicity', 'Sex']
+
+# Row order - grouping by patient first keeps each patient's rows contiguous
+MASTER_SORT = ['Patient Name', 'Scan Date', 'Body Part']
+COMPOSITION_SORT = ['Patient Name', 'Scan Date']
+BENCHMARK_SORT = ['Patient Name', 'Scan Date', 'Body Part']
+
+
+# Seconds per step of this process's latest load (benchmarks/startup_report.py)
+load_timings = {}
+
+
+@contextmanager
+def load_step(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        load_timings[name] = time.perf_counter() - started
+
+
+def _csv_dtypes(path, text_columns):
+    # utf-8-sig strips the BOM that the benchmark export starts with
+    header = pd.read_csv(path, nrows=0, encoding="utf-8-sig").columns
+    return {col: (str if col in text_columns else 'float64')
+            for col in header if col != 'Scan Date'}
+
+
+def _type_frame(df, text_columns, sort_by):
+    """Dates parsed, text columns as categoricals, rows sorted by `sort_by`."""
+    df["Scan Date"] = pd.to_datetime(df["Scan Date"], format=DATE_FORMAT, errors="coerce")
+    df = df.dropna(subset=["Scan Date", "Patient Name"])
+    for col in text_columns:
+        if col in df:
+            df[col] = df[col].astype("category")
+    return df.sort_values(sort_by, kind="stable").reset_index(drop=True)
+
+
+def _parse_csv(path, text_columns, sort_by):
+    df = pd.read_csv(path, dtype=_csv_dtypes(path, text_columns), encoding="utf-8-sig")
+    return _type_frame(df, text_columns, sort_by)
+
+
+def _snapshot_schema(text_columns, sort_by):
+    return "|".join([DATE_FORMAT, "category", *text_columns, "sort", *sort_by])
+
+
+def _read_csv(path, text_columns, sort_by, appendable=False):
+    """Parse `path`, going through its binary snapshot when it is fresh."""
+    return load_csv_cached(path, lambda p: _parse_csv(p, text_columns, sort_by),
+                           schema=_snapshot_schema(text_columns, sort_by), appendable=appendable)
+
+
+def _compact_snapshot(store):
+    """
+    Rewrite master's snapshot from `store` (loaded from it plus appended
+    rows) so it covers the whole file again, with the versions to resume.
+    """
+    master_csv = store.source["paths"][0]
+    fingerprint = csv_fingerprint(master_csv, versions={"origin": store.source["origin"],
+                                                        "ingested": store._ingested})
+    if fingerprint["size"] != store.source["offset"]:
+        return  # appended to again meanwhile; a later load compacts
+    schema = _snapshot_schema(MASTER_TEXT_COLUMNS, MASTER_SORT)
+    try:
+        write_snapshot(store.master, snapshot_path(master_csv), dict(fingerprint, schema=schema))
+    except OSError as e:
+        warnings.warn(f"Could not write snapshot for {master_csv}: {e}")
+
+
+def _share_categories(frames, columns=SHARED_CATEGORY_COLUMNS):
+    """Recode `columns` in every frame onto one sorted, shared dictionary."""
+    for col in columns:
+        present = [df for df in frames if df is not None and col in df]
+        categories = pd.Index(sorted(set().union(*(df[col].cat.categories for df in present))))
+        for df in present:
+            df[col] = df[col].cat.set_categories(categories)
+
+
+def ingested_version(version, total, name=""):
+    """
+    Version of the data `version` stands for plus ingested rows whose
+    hashes sum to `total` (dexa.ingest) - of patient `name`'s data, if given.
+    """
+    if not total:
+        return version
+    return hashlib.sha256(f"{version}:{name}:{total}".encode()).hexdigest()[:16]
+
+
+class DataStore:
+    """Parsed master data and the tables derived from it, for one process."""
+
+    def __init__(self, master, composition, benchmark, version=""):
+        # Regional data as a dense (scans, body parts, metrics) array
+        with load_step("cube"):
+            cube = RegionalCube.from_master(master)
+        with load_step("symmetry"):
+            symmetry = compute_symmetry(cube)
+        # Composition indices are derived from the cube, with the exported
+        # table (None if there is none) only filling in what master cannot
+        # determine
+        with load_step("composition"):
+            reported = scan_reported(master, composition)
+            indices = compute_indices(cube, reported)
+        # The exported benchmark table (None if there is none) only
+        # supplies the demographics master lacks
+        with load_step("benchmarks"):
+            demographics = scan_demographics(master, benchmark)
+            benchmarks = compute_benchmarks(cube, demographics)
+        with load_step("search index"):
+            search = PatientSearch.from_master(master)
+        with load_step("patient summary"):
+            summary = compute_summary(cube, indices)
+        with load_step("cohort percentiles"):
+            percentiles = CohortPercentiles.from_scans(indices, demographics)
+        with load_step("patient indexes"):
+            tables = StoreTables(master, cube, symmetry, reported, indices, demographics, benchmarks, summary)
+        self._assemble(tables, search=search, percentiles=percentiles, version=version)
+
+    def _assemble(self, tables, search, percentiles, version, delta=None, ingested=None,
+                  patient_versions=None):
+        """Set the tables (already derived, see dexa.tables) and the indexes over them."""
+        # Bulk tables, plus per-patient tables of the patients with scans
+        # ingested since (dexa.ingest), which shadow their bulk rows
+        self._tables = tables
+        self._delta = delta if delta is not None else {}
+        # Scan IDs in the delta (the ones ingested since are only there)
+        self._delta_scans = frozenset().union(*(block.cube.scan_index for block in self._delta.values()))
+        # Patients only the delta holds, sorted
+        self._delta_patients = sorted(name for name in self._delta if name not in tables.master_index)
+        # The delta spliced into the bulk tables, on first whole-table use
+        self._merged = None if self._delta else tables
+        self._merge_lock = threading.Lock()
+        # Content hash of the data as loaded, and of the rows ingested on top
+        # since (dexa.ingest): "total" sums their row hashes, "patients" per
+        # patient. A sum, so the same rows give the same versions in every
+        # process, however they were batched
+        self._base_version = version
+        self._ingested = ingested or {"total": 0, "patients": {}}
+        # Changes whenever any of the data does
+        self.version = ingested_version(version, self._ingested["total"])
+        # Data version per patient for cache keys: patients untouched by an
+        # ingest keep theirs, so their cached outputs stay valid
+        self._patient_versions = patient_versions if patient_versions is not None else {
+            name: ingested_version(version, total, name) for name, total in self._ingested["patients"].items()}
+        # Where the data was read from (set by from_csv): the master CSV
+        # and the byte offset read up to, so rows appended to it later can
+        # be ingested instead of reloaded (dexa.ingest.ingest_appended)
+        self.source = None
+        # Position in the sequence of stores this process has served (set
+        # by set_store; 0 until published)
+        self.generation = 0
+        # Prefix index over patient names and IDs for the patient pickers
+        self.search = search
+        # Sorted per-cohort reference values for percentiles and bands
+        self.percentiles = percentiles
+
+    def _whole(self):
+        """The StoreTables over every patient (merging the delta in once)."""
+        if self._merged is None:
+            with self._merge_lock:
+                if self._merged is None:
+                    self._merged = merge(self._tables, self._delta)
+        return self._merged
+
+    def _holder(self, name):
+        """The StoreTables holding `name`'s current rows."""
+        return self._delta.get(name, self._tables)
+
+    @classmethod
+    def from_csv(cls, master_csv=MASTER_CSV, composition_csv=COMPOSITION_CSV,
+                 benchmark_csv=BENCHMARK_CSV):
+        """
+        Load the CSVs. Rows appended to master since its snapshot was
+        written (dexa.ingest) are ingested on top of the snapshot, so every
+        process reaches the same versions as the workers that ingested them
+        as they came; past SNAPSHOT_COMPACT_SHARE the snapshot is rewritten
+        to cover them.
+        """
+        with load_step("read master"):
+            master, master_fp = _read_csv(master_csv, MASTER_TEXT_COLUMNS, MASTER_SORT, appendable=True)
+        composition, composition_fp = None, {"sha256": ""}
+        if os.path.exists(composition_csv):
+            with load_step("read composition"):
+                composition, composition_fp = _read_csv(composition_csv, COMPOSITION_TEXT_COLUMNS,
+                                                        COMPOSITION_SORT)
+        benchmark, benchmark_fp = None, {"sha256": ""}
+        if os.path.exists(benchmark_csv):
+            with load_step("read benchmark"):
+                benchmark, benchmark_fp = _read_csv(benchmark_csv, BENCHMARK_TEXT_COLUMNS, BENCHMARK_SORT)
+        with load_step("share categories"):
+            _share_categories([master, composition, benchmark])
+        # While master is only appended to, its version stays that of the
+        # file as first loaded (the "origin"), plus the rows ingested since
+        versions = master_fp.get("versions", {})
+        origin = versions.get("origin", master_fp["sha256"])
+        version = hashlib.sha256("".join(
+            [origin, composition_fp["sha256"], benchmark_fp["sha256"]]
+        ).encode()).hexdigest()[:16]
+        store = cls(master, composition, benchmark, version)
+        if versions.get("ingested"):
+            store = store._copy(ingested=versions["ingested"])
+        paths = (master_csv, composition_csv, benchmark_csv)
+        store.source = {"paths": paths, "stat": data_files_stat(paths), "origin": origin,
+                        "offset": master_fp["size"], "tail_sha256": master_fp.get("tail_sha256")}
+        if os.path.getsize(master_csv) == master_fp["size"]:
+            return store
+
+        from dexa import ingest
+        with load_step("ingest appended"):
+            updated = ingest.apply_appended(store)
+        if updated is None:
+            # Not an append after all - parse the whole file
+            os.remove(snapshot_path(master_csv))
+            return cls.from_csv(master_csv, composition_csv, benchmark_csv)
+        if updated.source["offset"] - master_fp["size"] > SNAPSHOT_COMPACT_SHARE * master_fp["size"]:
+            with load_step("compact snapshot"):
+                _compact_snapshot(updated)
+        return updated
+
+    def _copy(self, **changes):
+        """Shallow copy with `changes` passed to _assemble (e.g. other versions)."""
+        store = DataStore.__new__(DataStore)
+        args = dict(tables=self._tables, search=self.search, percentiles=self.percentiles,
+                    version=self._base_version, delta=self._delta, ingested=self._ingested)
+        args.update(changes)
+        store._assemble(**args)
+        store.source = self.source
+        return store
+
+    # Tables are sorted by patient, then Scan Date.
+    # Pages get shallow copies: the column data is shared, but adding,
+    # dropping or reordering columns on a view never leaks into the store.
+    # Callers must treat the values themselves as read-only.
+    @property
+    def master(self):
+        return self._whole().master.copy(deep=False)
+
+    @property
+    def composition(self):
+        return self._whole().composition.copy(deep=False)
+
+    @property
+    def benchmark(self):
+        return self._whole().benchmark.copy(deep=False)
+
+    # Regional data as a dense (scans, body parts, metrics) array, and the
+    # per-scan tables row-aligned with cube.scans: left/right symmetry, the
+    # reported values the composition indices were derived with, and the
+    # demographics the NHANES benchmark used
+    @property
+    def cube(self):
+        return self._whole().cube
+
+    @property
+    def symmetry(self):
+        return self._whole().symmetry
+
+    @property
+    def reported(self):
+        return self._whole().reported
+
+    @property
+    def demographics(self):
+        return self._whole().demographics
+
+    # One row per patient for the overview cards (dexa.summary)
+    @property
+    def summary(self):
+        return self._whole().summary
+
+    # Per-patient rows, sorted by Scan Date - O(1) slices via the patient index
+    def patient_master(self, name):
+        return self._holder(name).master_rows(name)
+
+    def patient_composition(self, name):
+        return self._holder(name).scan_rows("composition", name)
+
+    def patient_benchmark(self, name):
+        return self._holder(name).scan_rows("benchmark", name)
+
+    def patient_symmetry(self, name):
+        return self._holder(name).scan_rows("symmetry", name)
+
+    def patient_cube(self, name):
+        """RegionalCube of one patient's scans (empty for an unknown patient)."""
+        cube = self._holder(name).cube
+        return cube.subset(cube.patient_slice(name))
+
+    def patient_version(self, name):
+        """Version of one patient's data (changes when scans are ingested for them)."""
+        return self._patient_versions.get(name, self._base_version)
+
+    def patient_summary(self, name):
+        """The patient's dexa.summary row: latest/previous Total and composition, records."""
+        return self._holder(name).summary.loc[name]
+
+    def patient_trends(self, name, method="ols"):
+        """The patient's dexa.trends row (from the cohort table, computed once per version)."""
+        return get_trends(self, method).loc[name]
+
+    def cohort_percentiles(self):
+        """dexa.percentiles.CohortPercentiles over the whole population."""
+        return self.percentiles
+
+    def cohort_scans(self, names=None):
+        """
+        One row per scan: Unique ID, Patient Name, Sex, Age Group, the
+        composition indices and TotalBodyFat_g (dexa.sketches input) - of
+        every patient, or only of `names`.
+        """
+        if names is None:
+            return _cohort_rows(self._whole(), slice(None))
+        blocks = [_cohort_rows(self._holder(name), self._holder(name).cube.patient_slice(name)) for name in names]
+        return concat(blocks) if blocks else _cohort_rows(self._tables, slice(0, 0))
+
+    def latest_scans(self, names=None):
+        """
+        (cube, composition rows) of each patient's latest scan, or only of
+        `names` (unknown names are skipped) - dexa.similarity input.
+        """
+        if names is None:
+            tables = self._whole()
+            return gather([(tables, latest_positions(tables.cube.scans))])
+        pieces = []
+        for name in names:
+            holder = self._holder(name)
+            stop = holder.cube.patient_slice(name).stop
+            pieces.append((holder, [stop - 1] if stop else []))
+        return gather(pieces or [(self._tables, [])])
+
+    def patient_scans(self, names):
+        """
+        (cube, composition rows) of every scan of `names`, patient after
+        patient - for re-deriving per-patient tables (dexa.trends.advance).
+        """
+        pieces = []
+        for name in names:
+            holder = self._holder(name)
+            scans = holder.cube.patient_slice(name)
+            pieces.append((holder, np.arange(scans.start, scans.stop)))
+        return gather(pieces or [(self._tables, [])])
+
+    def similar_patients(self, name, k=DEFAULT_K):
+        """The k patients whose latest scan is nearest `name`'s (dexa.similarity)."""
+        return get_index(self).nearest(name, k)
+
+    def patient_names(self):
+        """Sorted unique patient names across the master data."""
+        names = list(self._tables.master_index.keys())
+        return sorted(names + self._delta_patients) if self._delta_patients else names
+
+    def first_patient(self):
+        """Alphabetically first patient, without listing them all."""
+        first = next(iter(self._tables.master_index.keys()), None)
+        if self._delta_patients and (first is None or self._delta_patients[0] < first):
+            return self._delta_patients[0]
+        return first
+
+    def search_patients(self, query, limit=20):
+        """Top `limit` (patient, matched key) pairs for a name/ID prefix."""
+        return self.search.search(query, limit)
+
+    # Schema checks for new scans (dexa.ingest)
+    def master_schema(self):
+        """Master column -> "date", "text" or "number", in column order."""
+        return {col: ("date" if col == "Scan Date" else
+                      "text" if isinstance(dtype, pd.CategoricalDtype) else "number")
+                for col, dtype in self._tables.master.dtypes.items()}
+
+    def body_parts(self):
+        return list(self._tables.cube.parts)
+
+    def loaded_scans(self, scan_ids):
+        """The scan IDs among `scan_ids` that are already in the data."""
+        loaded = self._tables.cube.scan_index
+        return [scan_id for scan_id in scan_ids if scan_id in loaded or scan_id in self._delta_scans]
+
+
+def _cohort_rows(tables, scans):
+    return pd.concat([
+        tables.composition.iloc[scans],
+        tables.demographics[['Sex', 'Age Group']].iloc[scans],
+        tables.benchmark[['TotalBodyFat_g']].iloc[scans],
+    ], axis=1)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Return the process-wide DataStore, loading it on first use.
+
+    The store is immutable and may be replaced by a newer one at any time
+    (dexa.reload). Call this once per request and keep using the returned
+    object so the whole request sees a single data version.
+    """
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                set_store(load_store())
+    return _store
+
+
+def is_ready():
+    """Whether the store is loaded, i.e. get_store() returns without loading."""
+    return _store is not None
+
+
+def load_store():
+    """A freshly loaded store for the configured BACKEND."""
+    load_timings.clear()
+    if BACKEND == "sqlite":
+        from dexa.sqlite_store import SqliteStore
+        return SqliteStore.open(SQLITE_PATH)
+    if BACKEND != "memory":
+        raise ValueError(f"Unknown DEXA_BACKEND {BACKEND!r} (expected 'memory' or 'sqlite')")
+    return DataStore.from_csv()
+
+
+def watched_files():
+    """The files whose changes mean load_store() would return new data."""
+    return (SQLITE_PATH,) if BACKEND == "sqlite" else DATA_FILES
+
+
+def set_store(store):
+    """
+    Publish `store` as the process-wide store. A single reference
+    assignment, so readers never lock; requests already holding the old
+    store finish on it.
+    """
+    global _store
+    store.generation = (_store.generation if _store is not None else 0) + 1
+    _store = store
+
+
+def data_files_stat(paths=DATA_FILES):
+    """(size, mtime_ns) per data file, None for missing ones - cheap change check."""
+    stats = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            stats.append(None)
+        else:
+            stats.append((st.st_size, st.st_mtime_ns))
+    return tuple(stats)
@@ -0,0 +1,159 @@
+"""
+Per-patient summary table behind the overview cards.
+
+The overview cards only need a handful of facts per patient: the latest
+and previous Total row and composition row, the best lean mass and lowest
+body fat (and when), the weight range and the last scan date. They are
+computed here for every patient in one pass over the cube and the
+composition table (both sorted by patient, then date), with group
+boundaries and reduceat instead of a filter and idxmax/idxmin per request.
+Opening the overview is then one row lookup.
+
+Columns are (group, name) pairs:
+
+    latest_total / previous_total      Total part, every cube metric
+    latest_composition / previous_...  every composition index
+    records                            Last Scan Date, Scans, Best Lean (g),
+                                       Best Lean Date, Lowest Body Fat (%),
+                                       Lowest Body Fat Date, Highest Body
+                                       Fat (%), Min / Max Weight (kg)
+
+so row["latest_total"]["Lean (g)"] reads like the Total row it replaces.
+"Latest" follows the page it replaces: the first Total scan on the latest
+scan date; "previous" is the scan before the last (the latest itself for a
+single scan). Patients without a Total row get NaN / NaT there.
+"""
+import numpy as np
+import pandas as pd
+
+from dexa.composition import INDEX_COLUMNS
+
+TOTAL_PART = "Total"
+RECORD_COLUMNS = ["Last Scan Date", "Scans", "Best Lean (g)", "Best Lean Date",
+                  "Lowest Body Fat (%)", "Lowest Body Fat Date", "Highest Body Fat (%)",
+                  "Min Weight (kg)", "Max Weight (kg)"]
+
+
+def _group_starts(keys):
+    """Start position of each run of equal values in `keys` (grouped, e.g. sorted)."""
+    if isinstance(getattr(keys, "dtype", None), pd.CategoricalDtype):
+        keys = keys.cat.codes  # compare integers, not strings
+    keys = np.asarray(keys)
+    if not len(keys):
+        return np.array([], dtype=np.intp)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _take(values, positions):
+    """values[positions] with NaN (NaT for dates) where positions is -1."""
+    missing = positions < 0
+    is_date = np.issubdtype(values.dtype, np.datetime64)
+    out = (values[np.where(missing, 0, positions)] if len(values)
+           else np.empty(len(positions), dtype=values.dtype))
+    out = out.copy() if is_date else out.astype(np.float64)
+    out[missing] = np.datetime64("NaT") if is_date else np.nan
+    return out
+
+
+def _first_extreme(values, starts, n_groups, group, largest):
+    """
+    Per group: the extreme (max or min, NaN skipped) of `values` and the
+    position of its first occurrence (-1 for an empty or all-NaN group).
+    `starts` are the group start positions in `values`, `group` the group
+    number of each value.
+    """
+    extreme = np.full(n_groups, np.nan)
+    first = np.full(n_groups, -1)
+    if not len(values):
+        return extreme, first
+    fill = -np.inf if largest else np.inf
+    filled = np.where(np.isnan(values), fill, values)
+    reduce = np.maximum if largest else np.minimum
+    present = np.unique(group)
+    best = reduce.reduceat(filled, starts)
+    hit = filled == best[np.searchsorted(present, group)]
+    firsts = np.minimum.reduceat(np.where(hit, np.arange(len(values)), len(values)), starts)
+    found = np.isfinite(best)
+    extreme[present[found]] = best[found]
+    first[present[found]] = firsts[found]
+    return extreme, first
+
+
+def compute_summary(cube, composition):
+    """
+    One row per patient in `cube` (row-aligned `composition`, see
+    dexa.composition.compute_indices), indexed by patient name.
+    """
+    scans = cube.scans
+    n = len(scans)
+    starts = _group_starts(scans["Patient Name"])
+    patients = scans["Patient Name"].iloc[starts].astype(str).to_numpy()
+    n_groups = len(starts)
+    stops = np.r_[starts[1:], n]
+    group = np.repeat(np.arange(n_groups), stops - starts)
+    dates = scans["Scan Date"].to_numpy(dtype="datetime64[ns]")
+
+    # Total rows: scans with any Total measurement, in (patient, date) order
+    total = cube.values[:, cube.part_index[TOTAL_PART], :] if TOTAL_PART in cube.part_index \
+        else np.full((n, len(cube.metrics)), np.nan, dtype=np.float32)
+    t_pos = np.flatnonzero(~np.isnan(total).all(axis=1))
+    t_group = group[t_pos]
+    t_starts = _group_starts(t_group)
+    t_last = np.r_[t_starts[1:], len(t_pos)] - 1
+    # First Total scan on each patient's latest Total date
+    t_dates = dates[t_pos]
+    run_start = np.r_[True, (t_group[1:] != t_group[:-1]) | (t_dates[1:] != t_dates[:-1])] \
+        if len(t_pos) else np.array([], dtype=bool)
+    run_first = np.maximum.accumulate(np.where(run_start, np.arange(len(t_pos)), 0))
+    t_present = t_group[t_starts]
+    latest_t = np.full(n_groups, -1)
+    previous_t = np.full(n_groups, -1)
+    latest_t[t_present] = t_pos[run_first[t_last]]
+    previous_t[t_present] = t_pos[np.where(t_last > t_starts, t_last - 1, t_last)]
+
+    # Composition rows: every scan
+    latest_c = stops - 1
+    previous_c = np.where(stops - starts > 1, stops - 2, stops - 1)
+
+    columns = {}
+    total = total.astype(np.float64)
+    for k, metric in enumerate(cube.metrics):
+        columns[("latest_total", metric)] = _take(total[:, k], latest_t)
+        columns[("previous_total", metric)] = _take(total[:, k], previous_t)
+    index_values = {c: composition[c].to_numpy(dtype=np.float64) for c in INDEX_COLUMNS if c in composition}
+    for column, values in index_values.items():
+        columns[("latest_composition", column)] = values[latest_c]
+        columns[("previous_composition", column)] = values[previous_c]
+
+    lean = total[t_pos, cube.metric_index["Lean (g)"]]
+    weight = total[t_pos, cube.metric_index["Total Mass (kg)"]]
+    best_lean, best_lean_at = _first_extreme(lean, t_starts, n_groups, t_group, largest=True)
+    heaviest, _ = _first_extreme(weight, t_starts, n_groups, t_group, largest=True)
+    lightest, _ = _first_extreme(weight, t_starts, n_groups, t_group, largest=False)
+    body_fat = index_values.get("Total Body Fat (%)", np.full(n, np.nan))
+    lowest_fat, lowest_fat_at = _first_extreme(body_fat, starts, n_groups, group, largest=False)
+    highest_fat, _ = _first_extreme(body_fat, starts, n_groups, group, largest=True)
+
+    columns[("records", "Last Scan Date")] = _take(dates, latest_t)
+    columns[("records", "Scans")] = (stops - starts).astype(np.float64)
+    columns[("records", "Best Lean (g)")] = best_lean
+    columns[("records", "Best Lean Date")] = _take(t_dates, best_lean_at)
+    columns[("records", "Lowest Body Fat (%)")] = lowest_fat
+    columns[("records", "Lowest Body Fat Date")] = _take(dates, lowest_fat_at)
+    columns[("records", "Highest Body Fat (%)")] = highest_fat
+    columns[("records", "Min Weight (kg)")] = lightest
+    columns[("records", "Max Weight (kg)")] = heaviest
+
+    summary = pd.DataFrame(columns, index=pd.Index(patients, name="Patient Name"))
+    summary.columns = pd.MultiIndex.from_tuples(summary.columns)
+    return summary
+
+
+def update_summary(summary, fresh):
+    """
+    `summary` with the rows of `fresh` (compute_summary over some patients'
+    complete scans, e.g. the ones new scans were just ingested for)
+    replacing or adding theirs. Other rows are reused as they are.
+    """
+    kept = summary.drop(index=fresh.index, errors="ignore")
+    return pd.concat([kept, fresh]).sort_index(kind="stable")
@@ -0,0 +1,53 @@
+"""
+Left/right symmetry for every scan in one vectorized pass over the cube.
+
+For each left/right pair of body parts present in the data (Left Arm /
+Right Arm, Left Leg / Right Leg, ...) and each of lean, fat and BMC mass:
+
+    score = (right - left) / mean(left, right)
+
+0 is perfect symmetry, negative means the left side is bigger, positive
+means the right side is bigger.
+"""
+import numpy as np
+
+# Metric -> column label infix; lean keeps the plain "<Region> Symmetry" name
+SYMMETRY_METRICS = {'Lean (g)': '', 'Fat (g)': 'Fat ', 'BMC (g)': 'BMC '}
+
+
+def left_right_pairs(parts):
+    """(region, left part, right part) for every 'Left X' with a 'Right X'."""
+    return [(part[len("Left "):], part, "Right " + part[len("Left "):])
+            for part in parts
+            if part.startswith("Left ") and "Right " + part[len("Left "):] in parts]
+
+
+def symmetry_column(region, metric):
+    return f"{region} {SYMMETRY_METRICS[metric]}Symmetry"
+
+
+def compute_symmetry(cube):
+    """
+    One row per scan (aligned with cube.scans) with a symmetry score column
+    per left/right pair and metric, e.g. 'Arm Symmetry' (lean),
+    'Arm Fat Symmetry', 'Leg BMC Symmetry'.
+    """
+    pairs = left_right_pairs(cube.parts)
+    metrics = [m for m in SYMMETRY_METRICS if m in cube.metric_index]
+    symmetry_df = cube.scans.copy()
+    if not pairs or not metrics:
+        return symmetry_df
+
+    left = [cube.part_index[l] for _, l, _ in pairs]
+    right = [cube.part_index[r] for _, _, r in pairs]
+    ks = [cube.metric_index[m] for m in metrics]
+    # (scans, pairs, metrics) for both sides at once
+    left_values = cube.values[:, left][:, :, ks].astype(np.float64)
+    right_values = cube.values[:, right][:, :, ks].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (right_values - left_values) / ((left_values + right_values) / 2)
+
+    for p, (region, _, _) in enumerate(pairs):
+        for m, metric in enumerate(metrics):
+            symmetry_df[symmetry_column(region, metric)] = scores[:, p, m]
+    return symmetry_df
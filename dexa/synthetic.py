@@ -0,0 +1,250 @@
+"""
+Seedable synthetic DEXA data for scale and load testing.
+
+Writes N patients x M scans in exactly the layout of the three Data/ files:
+
+    master_dexa_data.csv             8 rows per scan (one per body part)
+    composition_indices.csv          1 row per scan
+    fat_mass_benchmark_results.csv   1 row per scan (Total), with BOM
+
+Point the app at the output with DEXA_DATA_DIR.
+
+Each patient gets a sex, age, ethnicity, height and a starting BMI and body
+fat %. Their scans follow a weight-loss programme: tissue mass falls
+exponentially towards a patient-specific target, mostly as fat, plus
+scan-to-scan noise, at irregular intervals of a few months. Every scan is
+split into body parts with patient-specific regional shares (head fat
+follows the scanner's narrow band instead), and SubTotal / Total are the
+sums of the parts. Bone mineral content stays roughly
+constant; like the real export, Trunk and Total BMC are left blank.
+
+The composition and benchmark files are derived from the generated rows by
+the app's own engines (dexa.composition, dexa.benchmarking), plus the
+scanner-only readings (Android/Gynoid ratio, visceral / subcutaneous fat
+area, BMR), so all three files agree with each other.
+
+Usage: python -m dexa.synthetic --patients 10000 --scans 6 [--seed 0] [--output Data/synthetic]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dexa.benchmarking import (DEMOGRAPHIC_COLUMNS, REFERENCE_COLUMNS, age_group,
+                               compute_benchmarks, interpretation, patient_message)
+from dexa.composition import (HEIGHT_COLUMN, INCH_M, INDEX_COLUMNS, POUND_KG, SCAN_COLUMNS,
+                              WEIGHT_COLUMN, compute_indices)
+from dexa.cube import BODY_PARTS, METRICS, RegionalCube
+
+# Column order of the three files
+MASTER_COLUMNS = [
+    "Unique ID", "Patient Name", "Scan Date", "Body Part", "% Fat", "Tissues (g)",
+    "Tissue Area (cm²)", "Fat (g)", "Lean (g)", "BMC (g)", "BMC Area (cm²)", "Total Mass (kg)",
+    "Patient ID", "Ethnicity", "Sex", "Height", "Weight", "Age", "Total Body Weight (kg)",
+    "BMI (kg/m²)", "Basal Metabolic Rate (kcal/day)", "Total Body Fat (%)",
+]
+COMPOSITION_COLUMNS = SCAN_COLUMNS + ["Measure", "Result"] + INDEX_COLUMNS
+BENCHMARK_COLUMNS = [
+    "Unique ID", "Patient Name", "Scan Date", "Body Part", "% Fat", "Tissues (g)",
+    "Tissue Area (cm²)", "TotalBodyFat_g", "Lean (g)", "BMC (g)", "BMC Area (cm²)",
+    "Total Mass (kg)", "Patient ID", "Ethnicity", "Sex", "Height", "Weight", "Age Group",
+    "Total Body Weight (kg)", "BMI (kg/m²)", "Basal Metabolic Rate (kcal/day)",
+    "TotalBodyFat_percent", *REFERENCE_COLUMNS, "FatMass_vs_Median_g",
+    "FatMass_vs_Median_percent", "Category", "Interpretation", "Patient_Message",
+]
+DATE_FORMAT = "%m-%d-%Y"
+
+# The six regions; SubTotal and Total are sums of them
+REGIONS = BODY_PARTS[:6]
+# Mean share of whole-body fat / lean mass per region (from the bundled data)
+FAT_SHARES = [0.037, 0.060, 0.061, 0.506, 0.165, 0.171]
+LEAN_SHARES = [0.071, 0.050, 0.053, 0.509, 0.156, 0.161]
+# How tightly a patient's own shares follow the means (Dirichlet concentration)
+SHARE_CONCENTRATION = 1000
+SCAN_SHARE_CONCENTRATION = 5000
+# Bone: head share of the whole-body BMC, and the SubTotal split between
+# arms, legs and the trunk (which the scanner does not report separately)
+HEAD_BONE_SHARE = 0.213
+# The scanner estimates head fat % from the body's, in a narrow band around 22%
+HEAD_FAT_PERCENT = 22.1
+HEAD_FAT_SLOPE = 0.12
+SUBTOTAL_BONE_SHARES = {"Left Arm": 0.088, "Right Arm": 0.088, "Left Leg": 0.226,
+                        "Right Leg": 0.233, "Trunk": 0.365}
+
+ETHNICITIES = ["White", "Black", "Other Hispanic", "Other"]
+ETHNICITY_WEIGHTS = [0.82, 0.08, 0.06, 0.04]
+MALE_SHARE = 0.25
+LAST_SCAN = "2025-08-31"
+
+
+def _regional(total, mean_shares, patient, rng):
+    """(scans, regions) split of `total` with per-patient and per-scan share noise."""
+    patient_shares = rng.gamma(np.asarray(mean_shares) * SHARE_CONCENTRATION,
+                               size=(patient.max() + 1, len(mean_shares)))
+    patient_shares /= patient_shares.sum(axis=1, keepdims=True)
+    shares = rng.gamma(patient_shares[patient] * SCAN_SHARE_CONCENTRATION)
+    shares /= shares.sum(axis=1, keepdims=True)
+    return total[:, None] * shares
+
+
+def generate(n_patients, scans_per_patient, seed=0, last_scan=LAST_SCAN):
+    """(master, composition, benchmark) DataFrames in the CSV layouts (dates typed)."""
+    rng = np.random.default_rng(seed)
+    n_scans = n_patients * scans_per_patient
+    patient = np.repeat(np.arange(n_patients), scans_per_patient)
+
+    # ---- Patients
+    male = rng.random(n_patients) < MALE_SHARE
+    ethnicity = rng.choice(ETHNICITIES, n_patients, p=ETHNICITY_WEIGHTS)
+    height_in = np.round(np.where(male, rng.normal(69.5, 2.9, n_patients),
+                                  rng.normal(64.3, 2.7, n_patients)) * 2) / 2
+    height_m2 = (height_in * INCH_M) ** 2
+    bmi = np.clip(rng.normal(37, 7, n_patients), 19, 65)
+    tissue0 = bmi * height_m2 / 1.01 * 1000           # g, DEXA mass excludes bone
+    age0 = rng.uniform(20, 76, n_patients)
+    fat_pct0 = np.clip(1.2 * bmi + 0.23 * age0 - 10.8 * male - 5.4 + rng.normal(0, 3, n_patients), 8, 60)
+    # Programme: share of tissue eventually lost, time constant, share as fat
+    loss_share = np.clip(rng.normal(0.25, 0.12, n_patients), -0.1, 0.5)
+    loss_days = rng.uniform(150, 500, n_patients)
+    fat_share_of_loss = np.clip(rng.normal(0.8, 0.1, n_patients), 0.4, 1.0)
+    bone = tissue0 * np.clip(rng.normal(0.027, 0.005, n_patients), 0.016, 0.045)
+
+    # ---- Scan dates: gamma-distributed gaps, last scan within two years of last_scan
+    gaps = rng.gamma(4, rng.uniform(90, 220, n_patients)[patient] / 4)
+    gaps = np.maximum(gaps, 14).reshape(n_patients, scans_per_patient)
+    gaps[:, 0] = 0
+    days = gaps.cumsum(axis=1)
+    last = pd.Timestamp(last_scan) - pd.to_timedelta(rng.uniform(0, 730, n_patients).astype(int), "D")
+    first = last - pd.to_timedelta(days[:, -1].astype(int), "D")
+    days = days.astype(int).ravel()
+    scan_date = first.values[patient] + pd.to_timedelta(days, "D").values
+    age = age0[patient] + days / 365.25
+
+    # ---- Whole-body fat and lean per scan
+    lost = loss_share[patient] * tissue0[patient] * (1 - np.exp(-days / loss_days[patient]))
+    lost += rng.normal(0, 0.006, n_scans) * tissue0[patient]
+    fat0 = tissue0 * fat_pct0 / 100
+    fat = np.maximum(fat0[patient] - lost * fat_share_of_loss[patient], 0.06 * tissue0[patient])
+    lean = (tissue0 - fat0)[patient] - lost * (1 - fat_share_of_loss[patient])
+
+    # ---- Regions (parts sum exactly to the totals) and bone
+    region_fat = _regional(fat, FAT_SHARES, patient, rng)
+    region_lean = _regional(lean, LEAN_SHARES, patient, rng)
+    head_pct = (HEAD_FAT_PERCENT + HEAD_FAT_SLOPE * (fat / (fat + lean) * 100 - 40)
+                + rng.normal(0, 0.4, n_scans)) / 100
+    region_fat[:, 0] = region_lean[:, 0] * head_pct / (1 - head_pct)
+    scan_bone = bone[patient] * (1 + rng.normal(0, 0.005, n_scans))
+    subtotal_bone = scan_bone * (1 - HEAD_BONE_SHARE)
+    bone_shares = rng.gamma(np.array(list(SUBTOTAL_BONE_SHARES.values())) * SCAN_SHARE_CONCENTRATION,
+                            size=(n_scans, len(SUBTOTAL_BONE_SHARES)))
+    bone_shares /= bone_shares.sum(axis=1, keepdims=True)
+    region_bone = np.full((n_scans, len(REGIONS)), np.nan)
+    region_bone[:, 0] = scan_bone * HEAD_BONE_SHARE
+    for k, part in enumerate(SUBTOTAL_BONE_SHARES):
+        if part != "Trunk":
+            region_bone[:, REGIONS.index(part)] = subtotal_bone * bone_shares[:, k]
+
+    # (scans, parts) in BODY_PARTS order: the six regions, SubTotal, Total
+    def with_sums(values):
+        return np.column_stack([values, values[:, 1:].sum(axis=1), values.sum(axis=1)])
+
+    part_fat, part_lean = with_sums(region_fat), with_sums(region_lean)
+    part_bone = np.column_stack([region_bone, subtotal_bone, np.full(n_scans, np.nan)])
+    part_tissue = part_fat + part_lean
+
+    # ---- Names and IDs (sorted by patient like the real export)
+    suffix = rng.integers(0, 36 ** 5, n_patients)
+    names = np.array([f"SYN{seed % 1000:03d}{i:08d}{np.base_repr(s, 36):0>5}"
+                      for i, s in enumerate(suffix)])
+    scan_code = rng.integers(0, 36 ** 6, n_scans)
+    scan_ids = np.array([f"{names[p]}_A{np.base_repr(i, 36):0>6}{np.base_repr(c, 36):0>6}"
+                         for i, (p, c) in enumerate(zip(patient, scan_code))])
+
+    n_parts = len(BODY_PARTS)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        master = pd.DataFrame({
+            "Unique ID": np.repeat(scan_ids, n_parts),
+            "Patient Name": np.repeat(names[patient], n_parts),
+            "Scan Date": np.repeat(scan_date, n_parts),
+            "Body Part": np.tile(BODY_PARTS, n_scans),
+            "% Fat": (part_fat / part_tissue * 100).ravel(),
+            "Tissues (g)": part_tissue.ravel(),
+            "Fat (g)": part_fat.ravel(),
+            "Lean (g)": part_lean.ravel(),
+            "BMC (g)": part_bone.ravel(),
+            "Total Mass (kg)": (part_tissue / 1000).ravel(),
+        }).reindex(columns=MASTER_COLUMNS)
+
+    # ---- Composition: scanner readings + the app's own index engine
+    # Rows are already in (scan, BODY_PARTS) order, so the cube is a reshape;
+    # kept in float64 so the derived files agree with master to the digit
+    cube = RegionalCube.from_master(master.iloc[::n_parts], METRICS)
+    cube = RegionalCube(master[METRICS].to_numpy(np.float64).reshape(n_scans, n_parts, len(METRICS)),
+                        cube.scans, BODY_PARTS, METRICS)
+    fat_kg, trunk_share = fat / 1000, region_fat[:, 3] / fat
+    # Scale weight includes bone, clothing etc.: ~1% above the DEXA mass
+    scale_kg = (fat + lean) / 1000 * 1.01 * (1 + rng.normal(0, 0.004, n_scans))
+    reported = pd.DataFrame({
+        HEIGHT_COLUMN: height_in[patient],
+        WEIGHT_COLUMN: scale_kg / POUND_KG,
+        "Basal Metabolic Rate (kcal/day)": 370 + 21.6 * lean / 1000,   # Katch-McArdle
+        "Android/Gynoid Fat Ratio": np.clip(np.where(male[patient], 1.15, 0.95)
+                                            + (trunk_share - 0.5) + rng.normal(0, 0.1, n_scans), 0.3, 2),
+        "Visceral Fat Area (cm²)": fat_kg * 4.6 * np.where(male[patient], 1.35, 1) * trunk_share / 0.5
+                                   * rng.lognormal(0, 0.25, n_scans),
+        "Subcutaneous Fat Area (cm²)": fat_kg * 12 * rng.lognormal(0, 0.15, n_scans),
+    })
+    composition = compute_indices(cube, reported).reindex(columns=COMPOSITION_COLUMNS)
+
+    # ---- Benchmarks: NHANES comparison of each scan's Total row
+    demographics = pd.DataFrame({
+        "Sex": np.where(male, "Male", "Female")[patient],
+        "Age Group": age_group(age).astype(object).to_numpy(),
+        "Ethnicity": ethnicity[patient],
+    })
+    benchmark = compute_benchmarks(cube, demographics)
+    totals = master[master["Body Part"] == "Total"].reset_index(drop=True)
+    for column in ["Body Part", "% Fat", "Tissues (g)", "Lean (g)", "Total Mass (kg)"]:
+        benchmark[column] = totals[column]
+    for column in DEMOGRAPHIC_COLUMNS + ["Category"]:
+        benchmark[column] = benchmark[column].astype(object)
+    benchmark["Interpretation"] = [interpretation(c) for c in benchmark["Category"]]
+    benchmark["Patient_Message"] = [patient_message(row) for row in benchmark.to_dict("records")]
+    # Groups NHANES has no row for count as n = 0; the real export leaves
+    # TotalBodyFat_percent blank
+    benchmark["NHANES_N"] = benchmark["NHANES_N"].fillna(0).astype(int)
+    benchmark["TotalBodyFat_percent"] = np.nan
+    benchmark = benchmark.reindex(columns=BENCHMARK_COLUMNS)
+    return master, composition, benchmark
+
+
+def write(master, composition, benchmark, folder):
+    """Write the three files into `folder` as the app expects them."""
+    os.makedirs(folder, exist_ok=True)
+    master.to_csv(os.path.join(folder, "master_dexa_data.csv"), index=False,
+                  date_format=DATE_FORMAT, float_format="%.10g")
+    composition.to_csv(os.path.join(folder, "composition_indices.csv"), index=False,
+                       date_format=DATE_FORMAT)
+    benchmark.to_csv(os.path.join(folder, "fat_mass_benchmark_results.csv"), index=False,
+                     date_format=DATE_FORMAT, encoding="utf-8-sig")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic DEXA data files.")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--scans", type=int, default=6, help="scans per patient")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join("Data", "synthetic"))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    master, composition, benchmark = generate(args.patients, args.scans, args.seed)
+    write(master, composition, benchmark, args.output)
+    print(f"Wrote {args.patients:,} patients x {args.scans} scans ({len(master):,} master rows) "
+          f"to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
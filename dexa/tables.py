@@ -0,0 +1,242 @@
+"""
+The store's data as one unit: master rows, the cube, the per-scan tables
+derived from it (row-aligned with cube.scans) and the per-patient summary.
+
+A DataStore keeps one StoreTables over the bulk of the data and, after
+ingests (dexa.ingest), a small StoreTables per patient with new scans
+(the delta). A patient's delta tables shadow their rows in the bulk ones,
+so an ingest derives and stores only the touched patients' tables and
+copies nothing else. merge() splices the delta into the bulk tables -
+copying every untouched row once - when it outgrows MERGE_SHARE of them,
+or when a whole table is asked for.
+
+Delta tables keep their categorical columns on their own small
+dictionaries, so an ingest never touches the shared ones (one label per
+scan ID). merge() appends the delta's new labels to the shared
+dictionaries - the bulk tables' codes stay valid on them - and splices
+the delta in as codes.
+"""
+import os
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+from dexa.cube import RegionalCube
+from dexa.index import PatientIndex
+from dexa.summary import update_summary
+
+# Delta scans, as a share of the bulk scans, that trigger a merge on ingest
+MERGE_SHARE = float(os.environ.get("DEXA_MERGE_SHARE", "0.05"))
+
+# Tables row-aligned with cube.scans
+SCAN_TABLES = ("symmetry", "reported", "composition", "demographics", "benchmark")
+
+
+class StoreTables:
+    """
+    master        - master rows sorted by patient, date and body part
+    cube          - RegionalCube of those rows (its patient index covers
+                    every table below)
+    symmetry, reported, composition, demographics, benchmark
+                  - one row per scan, row-aligned with cube.scans
+    summary       - one row per patient (dexa.summary)
+    master_index  - PatientIndex over master
+    """
+
+    def __init__(self, master, cube, symmetry, reported, composition, demographics, benchmark,
+                 summary, master_index=None):
+        self.master = master
+        self.cube = cube
+        self.symmetry = symmetry
+        self.reported = reported
+        self.composition = composition
+        self.demographics = demographics
+        self.benchmark = benchmark
+        self.summary = summary
+        self.master_index = master_index if master_index is not None else PatientIndex(master)
+
+    def master_rows(self, name):
+        return self.master_index.rows(self.master, name)
+
+    def scan_rows(self, table, name):
+        """`name`'s rows of one of SCAN_TABLES."""
+        return getattr(self, table).iloc[self.cube.patient_slice(name)]
+
+    def shared_dtypes(self):
+        """Column -> dtype of master's categorical columns (the shared dictionaries)."""
+        return {col: dtype for col, dtype in self.master.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+
+    def patient(self, name):
+        """
+        StoreTables of just `name`'s rows, with categorical columns as plain
+        labels - nothing in it refers to the shared dictionaries.
+        """
+        scans = self.cube.patient_slice(name)
+        cube = RegionalCube(self.cube.values[scans], _plain(self.cube.scans.iloc[scans]),
+                            self.cube.parts, self.cube.metrics)
+        return StoreTables(
+            _plain(self.master_rows(name)), cube,
+            summary=self.summary.loc[[name]] if name in self.master_index else self.summary.iloc[:0],
+            **{table: _plain(self.scan_rows(table, name)) for table in SCAN_TABLES},
+        )
+
+
+def gather(pieces):
+    """
+    (cube, composition rows) of the scans at `positions` of each
+    (StoreTables, positions) in `pieces`, in that order.
+    """
+    pieces = [(tables, np.asarray(positions, dtype=np.intp)) for tables, positions in pieces]
+    pieces = [(tables, positions) for tables, positions in pieces if len(positions)] or pieces[:1]
+    if len(pieces) == 1:
+        tables, positions = pieces[0]
+        return tables.cube.subset(positions), tables.composition.iloc[positions].reset_index(drop=True)
+    cube = pieces[0][0].cube
+    values = np.concatenate([tables.cube.values[positions] for tables, positions in pieces])
+    scans = concat([tables.cube.scans.iloc[positions] for tables, positions in pieces])
+    composition = concat([tables.composition.iloc[positions] for tables, positions in pieces])
+    return RegionalCube(values, scans, cube.parts, cube.metrics), composition
+
+
+def decoded(frame):
+    """
+    `frame` with its categorical columns as plain labels - O(rows), however
+    large their dictionaries (.astype(object) would decode those whole).
+    """
+    columns = {}
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            codes = frame[col].cat.codes.to_numpy()
+            labels = np.full(len(codes), np.nan, dtype=object)
+            known = codes >= 0
+            labels[known] = np.asarray(frame[col].cat.categories, dtype=object)[codes[known]]
+            columns[col] = labels
+    return frame.assign(**columns) if columns else frame
+
+
+def _plain(frame):
+    return decoded(frame).reset_index(drop=True)
+
+
+def local(frame, categorical=()):
+    """
+    `frame` with its categorical columns (plus `categorical`) on their own
+    dictionaries of just the labels present, rows renumbered from 0.
+    """
+    columns = [col for col in frame.columns
+               if isinstance(frame[col].dtype, pd.CategoricalDtype) or col in categorical]
+    return decoded(frame).astype({col: "category" for col in columns}).reset_index(drop=True)
+
+
+def concat(frames):
+    """pd.concat of row blocks, categorical columns kept categorical (on local dictionaries)."""
+    return local(pd.concat([decoded(frame) for frame in frames], ignore_index=True),
+                 [col for col in frames[0].columns if isinstance(frames[0][col].dtype, pd.CategoricalDtype)])
+
+
+def extended_dtype(dtype, values):
+    """`dtype` with any new labels among `values` (plain labels) appended (old codes unchanged)."""
+    labels = pd.Index(pd.Series(values).dropna().astype(str).unique())
+    extra = labels[dtype.categories.get_indexer(labels) < 0]
+    if extra.empty:
+        return dtype
+    return pd.CategoricalDtype(dtype.categories.append(extra.sort_values()))
+
+
+def recode(column, dtype):
+    """`column` on `dtype`, an extension of its own dictionary: the codes are reused."""
+    if column.dtype.categories is dtype.categories:
+        return column
+    return pd.Series(pd.Categorical.from_codes(column.cat.codes.to_numpy(), dtype=dtype),
+                     index=column.index, name=column.name)
+
+
+def splice_array(values, edits):
+    """
+    `values` with row ranges replaced: edits are (start, stop, block) in row
+    order, where start == stop inserts `block` before row `start`.
+    """
+    pieces, position = [], 0
+    for start, stop, block in edits:
+        pieces.extend([values[position:start], block])
+        position = stop
+    pieces.append(values[position:])
+    return np.concatenate(pieces)
+
+
+def splice(table, edits, extended=None):
+    """
+    splice_array for a DataFrame, column by column. Categorical columns are
+    spliced as codes on the column's dictionary extended by the blocks' new
+    labels, so the untouched rows are copied without decoding or rehashing;
+    the blocks' labels are coded in one lookup. `extended` maps a column to
+    (old dtype, extended dtype) when that extension was already worked out
+    (for the shared dictionaries).
+    """
+    extended = extended or {}
+    columns = {}
+    for col in table.columns:
+        column = table[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            blocks = [decoded(block[[col]])[col].to_numpy(dtype=object) for _, _, block in edits]
+            labels = np.concatenate(blocks) if blocks else np.zeros(0, dtype=object)
+            old, dtype = extended.get(col, (None, None))
+            if old is None or not (column.dtype.categories is old.categories or column.dtype == old):
+                dtype = extended_dtype(column.dtype, labels)
+            codes = dtype.categories.get_indexer(labels)
+            bounds = np.cumsum([0] + [len(block) for block in blocks])
+            codes = splice_array(recode(column, dtype).cat.codes.to_numpy(),
+                                 [(a, b, codes[bounds[i]:bounds[i + 1]]) for i, (a, b, _) in enumerate(edits)])
+            columns[col] = pd.Categorical.from_codes(codes, dtype=dtype)
+        else:
+            columns[col] = splice_array(column.to_numpy(),
+                                        [(a, b, block[col].to_numpy()) for a, b, block in edits])
+    return pd.DataFrame(columns, columns=table.columns)
+
+
+def merge(tables, delta):
+    """
+    `tables` with the per-patient `delta` tables spliced in: replacing the
+    patient's rows, or (a new patient) inserted before the next patient
+    in name order. The delta's new labels are appended to the shared
+    dictionaries; the patient indexes are offset, not rebuilt.
+    """
+    extended = {}
+    for col, dtype in tables.shared_dtypes().items():
+        labels = np.concatenate([decoded(block.master[[col]])[col].to_numpy(dtype=object)
+                                 for block in delta.values()])
+        extended[col] = (dtype, extended_dtype(dtype, labels))
+    names = list(tables.master_index.keys())
+    row_edits, scan_edits = [], []
+    for name in sorted(delta):
+        block = delta[name]
+        if name in tables.master_index:
+            start, stop = tables.master_index.range(name)
+            scans = tables.cube.patient_slice(name)
+            scan_start, scan_stop = scans.start, scans.stop
+        else:
+            following = bisect_right(names, name)
+            if following < len(names):
+                start = stop = tables.master_index.range(names[following])[0]
+                scan_start = scan_stop = tables.cube.patient_slice(names[following]).start
+            else:
+                start = stop = len(tables.master)
+                scan_start = scan_stop = len(tables.cube.scans)
+        row_edits.append((start, stop, block.master))
+        scan_edits.append((scan_start, scan_stop, block))
+
+    cube = tables.cube
+    scans = splice(cube.scans, [(a, b, block.cube.scans) for a, b, block in scan_edits], extended)
+    values = splice_array(cube.values, [(a, b, block.cube.values) for a, b, block in scan_edits])
+    scan_index = cube.patient_index.spliced({name: len(block.cube.scans) for name, block in delta.items()})
+    scan_tables = {table: splice(getattr(tables, table),
+                                 [(a, b, getattr(block, table)) for a, b, block in scan_edits], extended)
+                   for table in SCAN_TABLES}
+    return StoreTables(
+        splice(tables.master, row_edits, extended),
+        RegionalCube(values, scans, cube.parts, cube.metrics, patient_index=scan_index),
+        summary=update_summary(tables.summary, pd.concat([block.summary for block in delta.values()])),
+        master_index=tables.master_index.spliced({name: len(block.master) for name, block in delta.items()}),
+        **scan_tables,
+    )
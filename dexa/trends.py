@@ -0,0 +1,222 @@
+"""
+Per-patient trend lines for the key composition metrics.
+
+For every patient at once, fits value = intercept + slope * months since
+their first scan to each of
+
+    Total Body Fat (%), Lean (g), Total Mass (kg), Visceral Fat Area (cm²)
+
+(Total part of the cube, or the composition indices row-aligned with it).
+The cube and composition table are sorted by patient, so the fit is a few
+weighted bincounts over group numbers - no loop per patient:
+
+    ols        least squares (default)
+    theil-sen  median of the pairwise slopes; a single odd scan barely
+               moves it. Pairs are formed on a (patients, scans) padded
+               matrix, in chunks to bound memory.
+
+Each metric gets Slope / Month, Intercept, R² (of that line, NaN when the
+values do not vary), Points (scans with a value), Months (first to last)
+and Projection (the line PROJECTION_MONTHS after the last scan). Fewer
+than two distinct scan dates leave the slope and everything from it NaN.
+
+get_trends(store) computes the table once per data version and method and
+keeps it, so cohort queries (fastest_improvers) and page lookups after the
+first are free until the data changes. After an ingest, advance() re-fits
+just the patients with new scans into the previous version's tables.
+"""
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+MONTH_DAYS = 365.25 / 12
+PROJECTION_MONTHS = 6
+TOTAL_PART = "Total"
+# Metric -> where it comes from
+TREND_METRICS = {
+    "Total Body Fat (%)": "composition",
+    "Lean (g)": "total",
+    "Total Mass (kg)": "total",
+    "Visceral Fat Area (cm²)": "composition",
+}
+# +1: an increase is an improvement, -1: a decrease is (weight has neither)
+IMPROVING = {"Total Body Fat (%)": -1, "Lean (g)": 1, "Visceral Fat Area (cm²)": -1}
+METHODS = ("ols", "theil-sen")
+STATS = ["Slope / Month", "Intercept", "R²", "Points", "Months", "Projection"]
+# Bound on the pairwise slope array per Theil-Sen chunk (elements)
+PAIR_CHUNK = 4_000_000
+# Tables kept by get_trends (one per data version and method)
+CACHE_ENTRIES = 4
+
+
+def _ols(x, y, group, n_groups, count):
+    """Least-squares slope and intercept per group (NaN without spread in x)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.bincount(group, x, n_groups) / count
+        mean_y = np.bincount(group, y, n_groups) / count
+        dx = x - mean_x[group]
+        sxx = np.bincount(group, dx * dx, n_groups)
+        sxy = np.bincount(group, dx * (y - mean_y[group]), n_groups)
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    return slope, mean_y - slope * mean_x
+
+
+def _padded(values, group, n_groups, count):
+    """(n_groups, max count) matrix of each group's values, NaN padded."""
+    width = int(count.max()) if n_groups else 0
+    starts = np.r_[0, np.cumsum(count)[:-1]].astype(np.intp)
+    column = np.arange(len(values)) - starts[group]
+    matrix = np.full((n_groups, width), np.nan)
+    matrix[group, column] = values
+    return matrix
+
+
+def _theil_sen(x, y, group, n_groups, count):
+    """Median pairwise slope per group, intercept = median(y - slope * x)."""
+    xs, ys = _padded(x, group, n_groups, count), _padded(y, group, n_groups, count)
+    slope = np.full(n_groups, np.nan)
+    width = xs.shape[1]
+    if width < 2:
+        return slope, np.full(n_groups, np.nan)
+    upper = np.triu(np.ones((width, width), dtype=bool), k=1)
+    step = max(PAIR_CHUNK // (width * width), 1)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN groups
+        for start in range(0, n_groups, step):
+            cx, cy = xs[start:start + step], ys[start:start + step]
+            dx = cx[:, None, :] - cx[:, :, None]
+            pairs = (cy[:, None, :] - cy[:, :, None]) / np.where(dx != 0, dx, np.nan)
+            slope[start:start + step] = np.nanmedian(np.where(upper, pairs, np.nan).reshape(len(cx), -1), axis=1)
+        intercept = np.nanmedian(ys - slope[:, None] * xs, axis=1)
+    return slope, np.where(np.isnan(slope), np.nan, intercept)
+
+
+FITS = {"ols": _ols, "theil-sen": _theil_sen}
+
+
+def _metric_values(cube, composition, metric):
+    if TREND_METRICS[metric] == "composition":
+        return composition[metric].to_numpy(dtype=np.float64)
+    if TOTAL_PART not in cube.part_index:
+        return np.full(len(cube.scans), np.nan)
+    return cube.values[:, cube.part_index[TOTAL_PART], cube.metric_index[metric]].astype(np.float64)
+
+
+def compute_trends(cube, composition, method="ols", horizon=PROJECTION_MONTHS):
+    """
+    One row per patient in `cube` (row-aligned `composition`, see
+    dexa.composition.compute_indices), indexed by patient name, with
+    (metric, stat) columns.
+    """
+    if method not in FITS:
+        raise ValueError(f"Unknown trend method {method!r} (expected one of {', '.join(METHODS)})")
+    names = cube.scans["Patient Name"]
+    codes = names.cat.codes.to_numpy() if isinstance(names.dtype, pd.CategoricalDtype) else names.to_numpy()
+    n = len(codes)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n else np.array([], dtype=np.intp)
+    patients = names.iloc[starts].astype(str).to_numpy()
+    n_groups = len(starts)
+    scan_group = np.repeat(np.arange(n_groups), np.diff(np.r_[starts, n]))
+    dates = cube.scans["Scan Date"].to_numpy(dtype="datetime64[ns]")
+    # Months since each patient's first scan (small x keeps the sums well conditioned)
+    months = (dates - dates[starts][scan_group]) / np.timedelta64(1, "D") / MONTH_DAYS
+
+    columns = {}
+    for metric in TREND_METRICS:
+        values = _metric_values(cube, composition, metric)
+        ok = ~np.isnan(values)
+        x, y, group = months[ok], values[ok], scan_group[ok]
+        points = np.bincount(group, minlength=n_groups)
+        count = points.astype(np.float64)
+        slope, intercept = FITS[method](x, y, group, n_groups, count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_y = np.bincount(group, y, n_groups) / count
+            residual = y - (intercept[group] + slope[group] * x)
+            ss_res = np.bincount(group, residual * residual, n_groups)
+            ss_tot = np.bincount(group, (y - mean_y[group]) ** 2, n_groups)
+            r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+        # x is sorted within each group: its first and last points span it
+        ends = np.cumsum(points)
+        has = points > 0
+        first_x = np.full(n_groups, np.nan)
+        last_x = np.full(n_groups, np.nan)
+        first_x[has] = x[(ends - points)[has]]
+        last_x[has] = x[ends[has] - 1]
+        columns[(metric, "Slope / Month")] = slope
+        columns[(metric, "Intercept")] = intercept
+        columns[(metric, "R²")] = np.where(np.isnan(slope), np.nan, r2)
+        columns[(metric, "Points")] = count
+        columns[(metric, "Months")] = last_x - first_x
+        columns[(metric, "Projection")] = intercept + slope * (last_x + horizon)
+
+    trends = pd.DataFrame(columns, index=pd.Index(patients, name="Patient Name"))
+    trends.columns = pd.MultiIndex.from_tuples(trends.columns)
+    return trends
+
+
+def fastest_improvers(trends, metric, n=10, min_points=3, min_r2=0.0, direction=None):
+    """
+    The `n` patients whose `metric` improves fastest per month - falling
+    body fat or visceral fat, rising lean mass (`direction` +1 / -1
+    overrides, and is required for weight). Only fits with at least
+    `min_points` scans and an R² of at least `min_r2` qualify.
+    """
+    direction = direction if direction is not None else IMPROVING.get(metric)
+    if direction not in (1, -1):
+        raise ValueError(f"No improving direction for {metric!r}; pass direction=1 or -1")
+    table = trends[metric]
+    rate = table["Slope / Month"] * direction
+    keep = (table["Points"] >= min_points) & (table["R²"].fillna(0) >= min_r2) & rate.notna()
+    best = rate[keep].nlargest(n).index
+    return table.loc[best].assign(**{"Improvement / Month": rate[best]})
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_trends(store, method="ols"):
+    """The trends table for `store`'s data, computed once per version and method."""
+    key = (store.version, method)
+    with _cache_lock:
+        trends = _cache.get(key)
+    if trends is None:
+        trends = compute_trends(store.cube, store.composition, method)
+        with _cache_lock:
+            _cache[key] = trends
+            while len(_cache) > CACHE_ENTRIES:
+                del _cache[next(iter(_cache))]
+    return trends
+
+
+def _with_rows(trends, fresh):
+    """`trends` with the rows of `fresh` replacing or adding theirs (others copied as they are)."""
+    positions = trends.index.get_indexer(fresh.index)
+    known = positions >= 0
+    values = trends.to_numpy(copy=True)
+    values[positions[known]] = fresh.to_numpy()[known]
+    updated = pd.DataFrame(values, index=trends.index, columns=trends.columns)
+    if known.all():
+        return updated
+    return pd.concat([updated, fresh[~known]]).sort_index(kind="stable")
+
+
+def advance(store, updated, patients):
+    """
+    After an ingest: each trends table cached for `store` becomes the one
+    for `updated` with only `patients` re-fitted (from their complete
+    scans) and swapped in. Methods that were never computed stay that way.
+    """
+    with _cache_lock:
+        previous = {method: trends for (version, method), trends in _cache.items() if version == store.version}
+    if not previous:
+        return
+    cube, composition = updated.patient_scans(sorted(patients))
+    for method, trends in previous.items():
+        table = _with_rows(trends, compute_trends(cube, composition, method))
+        with _cache_lock:
+            _cache[(updated.version, method)] = table
+            while len(_cache) > CACHE_ENTRIES:
+                del _cache[next(iter(_cache))]
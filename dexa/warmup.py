@@ -0,0 +1,82 @@
+"""
+When the data is loaded relative to the server starting (DEXA_WARMUP).
+
+Importing the app loads no data: page layouts are built per visit, and the
+store is loaded by the first get_store() call. This module decides who
+makes that call:
+
+    background (default)  a daemon thread loads the store right after
+                          import, while the server binds and starts
+                          serving. Requests that need data before it is
+                          done wait for the same load.
+    lazy                  nobody until the first request that needs data
+                          (the cohort sketch file is then only refreshed
+                          by ingest or `python -m dexa.sketches`)
+    eager                 the import itself, as before (slowest start,
+                          but the first request never waits)
+
+After the store, background and eager warm-up also load the cohort
+sketches (dexa.sketches) and write their file if it is out of date.
+
+GET /ready answers 503 until the store is loaded and 200 after, so a load
+balancer or health check can hold traffic until a worker is warm.
+"""
+import os
+import threading
+import time
+import warnings
+
+from dexa import sketches
+from dexa import store as data_store
+
+WARMUP = os.environ.get("DEXA_WARMUP", "background")
+
+_thread = None
+_error = None
+
+
+def _load():
+    global _error
+    started = time.perf_counter()
+    try:
+        store = data_store.get_store()
+    except Exception as e:  # /ready keeps answering 503; requests retry the load
+        _error = e
+        warnings.warn(f"Data warm-up failed: {e}")
+        return
+    print(f"Data loaded: version {store.version} in {time.perf_counter() - started:.2f}s")
+    # Bring the cohort sketch file up to date here, off the request path
+    try:
+        sketches.get_sketches(store, write=True)
+    except Exception as e:
+        warnings.warn(f"Cohort sketch warm-up failed: {e}")
+
+
+def start_warmup(mode=WARMUP):
+    """Load the store per `mode` (see module docstring); returns the thread, if any."""
+    global _thread
+    if mode == "eager":
+        _load()
+    elif mode == "background":
+        if _thread is None:
+            _thread = threading.Thread(target=_load, name="dexa-warmup", daemon=True)
+            _thread.start()
+    elif mode != "lazy":
+        raise ValueError(f"Unknown DEXA_WARMUP {mode!r} (expected 'background', 'lazy' or 'eager')")
+    return _thread
+
+
+def readiness():
+    """(body, status) for the /ready route."""
+    if data_store.is_ready():
+        return {"status": "ready", "version": data_store.get_store().version}, 200
+    body = {"status": "loading" if _thread is not None and _thread.is_alive() else "not loaded"}
+    if _error is not None:
+        body["error"] = str(_error)
+    return body, 503
+
+
+def register_readiness(server, path="/ready"):
+    """Add the readiness route to the Flask `server`."""
+    server.add_url_rule(path, "dexa_ready", readiness)
+    return server
@@ -1,69 +1,24 @@
-from dash import dcc, html, Input, Output, callback, register_page, dash_table
-import pandas as pd
+from dash import dcc, html, Input, Output, Patch, callback, register_page, dash_table
 import plotly.graph_objects as go
-import os
 
-register_page(__name__, path="/symmetry", order=4)
-
-# GitHub raw URL for master CSV
-MASTER_CSV_URL = "Data/master_dexa_data.csv"     
-
-# Load data
-try:
-    df = pd.read_csv(MASTER_CSV_URL)
-    df["Scan Date"] = pd.to_datetime(df["Scan Date"], format="%d-%m-%Y", errors="coerce")
-    df.dropna(subset=["Scan Date"], inplace=True)
-except Exception as e:
-    raise Exception(f"Error loading data from GitHub: {e}")
-
-def calculate_symmetry_score(left, right):
-    """
-    Calculate symmetry score between -1 and 1
-    -1: left side much bigger
-    0: perfect symmetry
-    1: right side much bigger
-    """
-    avg = (left + right) / 2
-    diff = (right - left) / avg
-    return diff
-
-def calculate_symmetry(df):
-    symmetry_data = []
-    for unique_id, group in df.groupby("Unique ID"):
-        row = {"Unique ID": unique_id, 
-               "Scan Date": group["Scan Date"].iloc[0], 
-               "Patient Name": group["Patient Name"].iloc[0]}
-        body_parts = group.set_index("Body Part")
-
-        if "Left Arm" in body_parts.index and "Right Arm" in body_parts.index:
-            row["Arm Symmetry"] = calculate_symmetry_score(
-                body_parts.loc["Left Arm", "Lean (g)"],
-                body_parts.loc["Right Arm", "Lean (g)"]
-            )
-
-        if "Left Ribs" in body_parts.index and "Right Ribs" in body_parts.index:
-            row["Ribs Symmetry"] = calculate_symmetry_score(
-                body_parts.loc["Left Ribs", "Lean (g)"],
-                body_parts.loc["Right Ribs", "Lean (g)"]
-            )
+from dexa.figure_cache import cached_outputs
+from dexa.picker import patient_picker, register_patient_search
+from dexa.store import get_store
 
-        if "Left Leg" in body_parts.index and "Right Leg" in body_parts.index:
-            row["Leg Symmetry"] = calculate_symmetry_score(
-                body_parts.loc["Left Leg", "Lean (g)"],
-                body_parts.loc["Right Leg", "Lean (g)"]
-            )
-
-        symmetry_data.append(row)
+register_page(__name__, path="/symmetry", order=4)
 
-    symmetry_df = pd.DataFrame(symmetry_data)
-    return symmetry_df
+# Lean symmetry scores shown on this page (fat and BMC scores are in the table)
+SYMMETRY_TYPES = ["Arm Symmetry", "Ribs Symmetry", "Leg Symmetry"]
+TABLE_COLUMNS = ["Scan Date", "Arm Symmetry", "Ribs Symmetry", "Leg Symmetry",
+                 "Arm Fat Symmetry", "Leg Fat Symmetry", "Arm BMC Symmetry", "Leg BMC Symmetry"]
 
-def create_symmetry_plot(df, symmetry_type):
+def create_symmetry_plot(symmetry_type):
+    # Styled, empty figure; patient data is patched in by symmetry_patch
     fig = go.Figure()
 
     fig.add_trace(go.Scatter(
-        x=df["Scan Date"],
-        y=df[symmetry_type],
+        x=[],
+        y=[],
         mode='lines+markers',
         name=symmetry_type,
         line=dict(width=2),
@@ -166,57 +121,61 @@ def create_symmetry_plot(df, symmetry_type):
     
     return fig
 
-# Create the symmetry dataframe
-symmetry_df = calculate_symmetry(df)
-
-print("Symmetry DF columns:", symmetry_df.columns.tolist())
-
-# Page layout
-layout = html.Div([
-    html.H2("Symmetry Analysis", style={'textAlign': 'center'}),
-
-    # Patient selection dropdown
-    html.Div([
-        html.Label("Select Patient:"),
-        dcc.Dropdown(
-            id='symmetry-patient-dropdown',
-            options=[{'label': name, 'value': name} 
-                    for name in sorted(symmetry_df["Patient Name"].unique())],
-            value=symmetry_df["Patient Name"].unique()[0],
-            clearable=False
-        )
-    ], style={'width': '30%', 'margin': '20px auto'}),
-
-    # Graphs container
-    html.Div([
-        dcc.Graph(id='arm-symmetry-graph', style={'marginBottom': '20px'}),
-        dcc.Graph(id='ribs-symmetry-graph', style={'marginBottom': '20px'}),
-        dcc.Graph(id='leg-symmetry-graph', style={'marginBottom': '20px'})
-    ], style={'padding': '20px'}),
+def symmetry_patch(df, symmetry_type):
+    patch = Patch()
+    # Pairs that were never scanned (e.g. ribs) have no column - plot nothing
+    if symmetry_type in df:
+        patch['data'][0]['x'] = df["Scan Date"].dt.strftime('%Y-%m-%d').tolist()
+        patch['data'][0]['y'] = df[symmetry_type].tolist()
+    else:
+        patch['data'][0]['x'] = []
+        patch['data'][0]['y'] = []
+    return patch
+
+# Figures are built once; the layout reuses them
+SYMMETRY_SKELETONS = {symmetry_type: create_symmetry_plot(symmetry_type) for symmetry_type in SYMMETRY_TYPES}
+
+# Page layout (built per visit, so importing the page loads no data)
+def layout():
+    return html.Div([
+        html.H2("Symmetry Analysis", style={'textAlign': 'center'}),
+
+        # Patient selection dropdown
+        html.Div([
+            html.Label("Select Patient:"),
+            patient_picker(
+                'symmetry-patient-dropdown',
+                clearable=False
+            )
+        ], style={'width': '30%', 'margin': '20px auto'}),
+
+        # Graphs container
+        html.Div([
+            dcc.Graph(id='arm-symmetry-graph', figure=SYMMETRY_SKELETONS['Arm Symmetry'], style={'marginBottom': '20px'}),
+            dcc.Graph(id='ribs-symmetry-graph', figure=SYMMETRY_SKELETONS['Ribs Symmetry'], style={'marginBottom': '20px'}),
+            dcc.Graph(id='leg-symmetry-graph', figure=SYMMETRY_SKELETONS['Leg Symmetry'], style={'marginBottom': '20px'})
+        ], style={'padding': '20px'}),
+
+        # Data table
+        html.Div([
+            html.H3("Symmetry Data", style={'textAlign': 'center'}),
+            dash_table.DataTable(
+                id='symmetry-table',
+                columns=[{"name": col, "id": col} for col in TABLE_COLUMNS],
+                style_table={'overflowX': 'auto'},
+                style_cell={
+                    'textAlign': 'center',
+                    'padding': '10px'
+                },
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold'
+                }
+            )
+        ], style={'margin': '20px'})
+    ])
 
-    # Data table
-    html.Div([
-        html.H3("Symmetry Data", style={'textAlign': 'center'}),
-        dash_table.DataTable(
-            id='symmetry-table',
-            columns=[
-                {"name": "Scan Date", "id": "Scan Date"},
-                {"name": "Arm Symmetry", "id": "Arm Symmetry"},
-                {"name": "Ribs Symmetry", "id": "Ribs Symmetry"},
-                {"name": "Leg Symmetry", "id": "Leg Symmetry"}
-            ],
-            style_table={'overflowX': 'auto'},
-            style_cell={
-                'textAlign': 'center',
-                'padding': '10px'
-            },
-            style_header={
-                'backgroundColor': 'rgb(230, 230, 230)',
-                'fontWeight': 'bold'
-            }
-        )
-    ], style={'margin': '20px'})
-])
+register_patient_search('symmetry-patient-dropdown')
 
 @callback(
     [Output('arm-symmetry-graph', 'figure'),
@@ -225,18 +184,19 @@ layout = html.Div([
      Output('symmetry-table', 'data')],
     Input('symmetry-patient-dropdown', 'value')
 )
+@cached_outputs("symmetry")
 def update_symmetry_graphs(selected_patient):
-    filtered_df = symmetry_df[symmetry_df["Patient Name"] == selected_patient].sort_values("Scan Date")
+    # Symmetry for every scan is computed once per data version by the store
+    # (dexa.symmetry); one store per call so a hot reload can't mix versions
+    filtered_df = get_store().patient_symmetry(selected_patient)
     
-    # Create figures for each symmetry type
-    arm_fig = create_symmetry_plot(filtered_df, "Arm Symmetry")
-    ribs_fig = create_symmetry_plot(filtered_df, "Ribs Symmetry")
-    leg_fig = create_symmetry_plot(filtered_df, "Leg Symmetry")
+    # Patch each symmetry type's trace into the figure already on the page
+    arm_fig, ribs_fig, leg_fig = [symmetry_patch(filtered_df, symmetry_type)
+                                  for symmetry_type in SYMMETRY_TYPES]
     
     # Prepare table data
-    table_data = filtered_df.copy()
+    table_data = filtered_df.reindex(columns=TABLE_COLUMNS)
     table_data["Scan Date"] = table_data["Scan Date"].dt.strftime('%Y-%m-%d')
-    table_data = table_data[["Scan Date", "Arm Symmetry", "Ribs Symmetry", "Leg Symmetry"]].round(3)
-    table_data = table_data.to_dict('records')
+    table_data = table_data.round(3).to_dict('records')
     
     return arm_fig, ribs_fig, leg_fig, table_data
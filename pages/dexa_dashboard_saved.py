@@ -1,19 +1,15 @@
-from dash import html, dcc, register_page, Input, Output, callback
+from dash import html, dcc, register_page, Input, Output, Patch, callback
 import pandas as pd
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 
-register_page(__name__, path="/dexa-dashboard", name="Population Benchmarks", order=3)
-
-# Load data
-CSV_PATH = "Data/fat_mass_benchmark_results.csv"
-df = pd.read_csv(CSV_PATH)
-
-# Parse dates
-df["Scan Date"] = pd.to_datetime(df["Scan Date"], format="%m-%d-%Y")
+from dexa.benchmarking import CATEGORIES, CATEGORY_NONE, interpretation, no_reference_message
+from dexa.figure_cache import cached_outputs
+from dexa.picker import patient_picker, register_patient_search
+from dexa.sketches import FAT_MASS_METRIC, get_sketches, shards_stat
+from dexa.store import get_store
+from dexa.trends import PROJECTION_MONTHS
 
-# Only keep Total body data
-df = df[df["Body Part"].str.lower() == "total"].sort_values("Scan Date")
+register_page(__name__, path="/dexa-dashboard", name="Population Benchmarks", order=3)
 
 # Category color mapping
 CATEGORY_COLORS = {
@@ -25,157 +21,231 @@ CATEGORY_COLORS = {
     '⚪ No Comparison': '#95a5a6'
 }
 
-# Layout
-layout = html.Div([
-    # Header
-    html.Div([
-        html.H1("Population Benchmarks", style={
-            'textAlign': 'center',
-            'marginBottom': '10px',
-            'color': '#2c3e50',
-            'fontWeight': '600'
-        }),
-        html.P("Compare patient body composition to national NHANES reference data", style={
-            'textAlign': 'center',
-            'color': '#7f8c8d',
-            'marginBottom': '0'
-        })
-    ], style={
-        'backgroundColor': 'white',
-        'padding': '25px',
-        'marginBottom': '20px',
-        'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
-    }),
+# Benchmark graph styling is sent once with the layout; the callback only
+# patches trace data and the title into it
+BENCHMARK_TITLE = "Fat Mass Trajectory vs Population Benchmark"
 
-    # Patient selector
-    html.Div([
-        html.Label("Select Patient", style={
-            'fontWeight': '600',
-            'color': '#2c3e50',
-            'fontSize': '15px',
-            'marginBottom': '10px',
-            'display': 'block'
-        }),
-        dcc.Dropdown(
-            id='patient-selector-benchmark',
-            options=[{'label': p, 'value': p} for p in sorted(df["Patient Name"].unique())],
-            value=sorted(df["Patient Name"].unique())[0] if not df.empty else None,
-            clearable=False,
-            style={'fontSize': '16px'}
-        )
-    ], style={
-        'width': '400px',
-        'margin': '0 auto 25px auto',
-        'backgroundColor': 'white',
-        'padding': '20px',
-        'borderRadius': '8px',
-        'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
-    }),
+def build_benchmark_figure():
+    fig = go.Figure()
+
+    # Patient's actual fat mass
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines+markers',
+        name='Actual Fat Mass',
+        line=dict(color='#e74c3c', width=4),
+        marker=dict(size=10, line=dict(width=2, color='white')),
+        hovertemplate='<b>%{x|%b %d, %Y}</b><br>Fat Mass: %{y:.1f} kg<extra></extra>'
+    ))
+
+    # NHANES median reference
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines+markers',
+        name='Population Median',
+        line=dict(color='#3498db', width=3, dash='dash'),
+        marker=dict(size=8),
+        hovertemplate='<b>%{x|%b %d, %Y}</b><br>Median: %{y:.1f} kg<extra></extra>'
+    ))
+
+    # Shaded region for "within expected" range (±15%)
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        fill='toself',
+        fillcolor='rgba(39, 174, 96, 0.1)',
+        line=dict(width=0),
+        showlegend=True,
+        name='Expected Range (±15%)',
+        hoverinfo='skip'
+    ))
+
+    fig.update_layout(
+        title={
+            'text': BENCHMARK_TITLE,
+            'font': {'size': 20, 'color': '#2c3e50'}
+        },
+        xaxis_title="Scan Date",
+        yaxis_title="Fat Mass (kg)",
+        template="plotly_white",
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        hovermode='x unified',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        yaxis=dict(gridcolor='#ecf0f1')
+    )
+    return fig
 
-    # Main content area
-    html.Div([
-        # Left side - Current status cards
+def benchmark_patch(title, dates=(), actual=(), median=(), band_x=(), band_y=()):
+    patch = Patch()
+    patch['layout']['title']['text'] = title
+    for trace, (x, y) in enumerate([(dates, actual), (dates, median), (band_x, band_y)]):
+        patch['data'][trace]['x'] = list(x)
+        patch['data'][trace]['y'] = list(y)
+    return patch
+
+benchmark_skeleton = build_benchmark_figure()
+
+# Layout (built per visit, so importing the page loads no data)
+def layout():
+    return html.Div([
+        # Header
         html.Div([
-            # Current status card
-            html.Div([
-                html.H3("📊 Current Status", style={
-                    'marginBottom': '20px',
-                    'color': '#2c3e50',
-                    'fontSize': '20px',
-                    'borderBottom': '2px solid #ecf0f1',
-                    'paddingBottom': '10px'
-                }),
-                html.Div(id='current-status-card-benchmark')
-            ], style={
-                'backgroundColor': 'white',
-                'padding': '20px',
-                'borderRadius': '8px',
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
+            html.H1("Population Benchmarks", style={
+                'textAlign': 'center',
+                'marginBottom': '10px',
+                'color': '#2c3e50',
+                'fontWeight': '600'
             }),
+            html.P("Compare patient body composition to national NHANES reference data", style={
+                'textAlign': 'center',
+                'color': '#7f8c8d',
+                'marginBottom': '0'
+            })
+        ], style={
+            'backgroundColor': 'white',
+            'padding': '25px',
+            'marginBottom': '20px',
+            'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'
+        }),
 
-            # Progress tracker
-            html.Div([
-                html.H3("📈 Progress Tracking", style={
-                    'marginBottom': '20px',
-                    'color': '#2c3e50',
-                    'fontSize': '20px',
-                    'borderBottom': '2px solid #ecf0f1',
-                    'paddingBottom': '10px'
-                }),
-                html.Div(id='progress-card-benchmark')
-            ], style={
-                'backgroundColor': 'white',
-                'padding': '20px',
-                'borderRadius': '8px',
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
+        # Patient selector
+        html.Div([
+            html.Label("Select Patient", style={
+                'fontWeight': '600',
+                'color': '#2c3e50',
+                'fontSize': '15px',
+                'marginBottom': '10px',
+                'display': 'block'
             }),
-
-            # Reference info
-            html.Div([
-                html.H3("ℹ️ About NHANES", style={
-                    'marginBottom': '15px',
-                    'color': '#2c3e50',
-                    'fontSize': '18px'
-                }),
-                html.P([
-                    "Reference data from ",
-                    html.Strong("NHANES 2003-2004"),
-                    " study of U.S. population body composition."
-                ], style={'fontSize': '13px', 'color': '#7f8c8d', 'marginBottom': '10px'}),
-                html.P(
-                    "Medians calculated by age group, sex, and ethnicity.",
-                    style={'fontSize': '13px', 'color': '#7f8c8d', 'marginBottom': '0'}
-                )
-            ], style={
-                'backgroundColor': '#ecf0f1',
-                'padding': '15px',
-                'borderRadius': '8px',
-                'borderLeft': '4px solid #3498db'
-            })
+            patient_picker(
+                'patient-selector-benchmark',
+                clearable=False,
+                style={'fontSize': '16px'}
+            )
         ], style={
-            'width': '30%',
-            'float': 'left',
-            'padding': '0 15px 0 0'
+            'width': '400px',
+            'margin': '0 auto 25px auto',
+            'backgroundColor': 'white',
+            'padding': '20px',
+            'borderRadius': '8px',
+            'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
         }),
 
-        # Right side - Main graph
+        # Main content area
         html.Div([
+            # Left side - Current status cards
             html.Div([
-                dcc.Graph(id='fat-mass-benchmark-graph', style={'height': '600px'})
+                # Current status card
+                html.Div([
+                    html.H3("📊 Current Status", style={
+                        'marginBottom': '20px',
+                        'color': '#2c3e50',
+                        'fontSize': '20px',
+                        'borderBottom': '2px solid #ecf0f1',
+                        'paddingBottom': '10px'
+                    }),
+                    html.Div(id='current-status-card-benchmark')
+                ], style={
+                    'backgroundColor': 'white',
+                    'padding': '20px',
+                    'borderRadius': '8px',
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                    'marginBottom': '20px'
+                }),
+
+                # Progress tracker
+                html.Div([
+                    html.H3("📈 Progress Tracking", style={
+                        'marginBottom': '20px',
+                        'color': '#2c3e50',
+                        'fontSize': '20px',
+                        'borderBottom': '2px solid #ecf0f1',
+                        'paddingBottom': '10px'
+                    }),
+                    html.Div(id='progress-card-benchmark')
+                ], style={
+                    'backgroundColor': 'white',
+                    'padding': '20px',
+                    'borderRadius': '8px',
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                    'marginBottom': '20px'
+                }),
+
+                # Reference info
+                html.Div([
+                    html.H3("ℹ️ About NHANES", style={
+                        'marginBottom': '15px',
+                        'color': '#2c3e50',
+                        'fontSize': '18px'
+                    }),
+                    html.P([
+                        "Reference data from ",
+                        html.Strong("NHANES 2003-2004"),
+                        " study of U.S. population body composition."
+                    ], style={'fontSize': '13px', 'color': '#7f8c8d', 'marginBottom': '10px'}),
+                    html.P(
+                        "Medians calculated by age group, sex, and ethnicity.",
+                        style={'fontSize': '13px', 'color': '#7f8c8d', 'marginBottom': '0'}
+                    )
+                ], style={
+                    'backgroundColor': '#ecf0f1',
+                    'padding': '15px',
+                    'borderRadius': '8px',
+                    'borderLeft': '4px solid #3498db'
+                })
             ], style={
-                'backgroundColor': 'white',
-                'padding': '20px',
-                'borderRadius': '8px',
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
+                'width': '30%',
+                'float': 'left',
+                'padding': '0 15px 0 0'
             }),
 
-            # Interpretation banner
-            html.Div(
-                id='interpretation-banner-benchmark',
-                style={
+            # Right side - Main graph
+            html.Div([
+                html.Div([
+                    dcc.Graph(id='fat-mass-benchmark-graph', figure=benchmark_skeleton, style={'height': '600px'})
+                ], style={
                     'backgroundColor': 'white',
                     'padding': '20px',
                     'borderRadius': '8px',
                     'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                    'textAlign': 'center'
-                }
-            )
-        ], style={
-            'width': '68%',
-            'float': 'right',
-            'padding': '0'
-        })
-    ], style={'overflow': 'hidden'})
-], style={
-    'backgroundColor': '#f5f7fa',
-    'padding': '20px',
-    'minHeight': '100vh'
-})
+                    'marginBottom': '20px'
+                }),
+
+                # Interpretation banner
+                html.Div(
+                    id='interpretation-banner-benchmark',
+                    style={
+                        'backgroundColor': 'white',
+                        'padding': '20px',
+                        'borderRadius': '8px',
+                        'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                        'textAlign': 'center'
+                    }
+                )
+            ], style={
+                'width': '68%',
+                'float': 'right',
+                'padding': '0'
+            })
+        ], style={'overflow': 'hidden'})
+    ], style={
+        'backgroundColor': '#f5f7fa',
+        'padding': '20px',
+        'minHeight': '100vh'
+    })
 
 # Callback
+register_patient_search('patient-selector-benchmark')
+
 @callback(
     [Output('current-status-card-benchmark', 'children'),
      Output('progress-card-benchmark', 'children'),
@@ -183,13 +253,11 @@ layout = html.Div([
      Output('interpretation-banner-benchmark', 'children')],
     Input('patient-selector-benchmark', 'value')
 )
+# The clinic median comes from every patient's scans (and other shards' sketches)
+@cached_outputs("benchmarks", key=lambda: [shards_stat()], cohort=True)
 def update_benchmark_chart(patient_name):
     if not patient_name:
-        empty_fig = go.Figure()
-        empty_fig.update_layout(
-            title="Select a patient to view benchmark data",
-            template="plotly_white"
-        )
+        empty_fig = benchmark_patch("Select a patient to view benchmark data")
         return (
             [html.P("Select a patient", style={'color': '#7f8c8d'})],
             [html.P("Select a patient", style={'color': '#7f8c8d'})],
@@ -197,14 +265,13 @@ def update_benchmark_chart(patient_name):
             html.P("Select a patient to begin", style={'color': '#7f8c8d'})
         )
 
-    patient_df = df[df["Patient Name"] == patient_name].sort_values("Scan Date")
+    # Shared benchmark table (dexa.benchmarking) with a per-patient row
+    # index; one store per call so a hot reload can't mix data versions
+    store = get_store()
+    patient_df = store.patient_benchmark(patient_name)
 
     if patient_df.empty:
-        empty_fig = go.Figure()
-        empty_fig.update_layout(
-            title="No data available for this patient",
-            template="plotly_white"
-        )
+        empty_fig = benchmark_patch("No data available for this patient")
         return (
             [html.P("No data available", style={'color': '#7f8c8d'})],
             [html.P("No data available", style={'color': '#7f8c8d'})],
@@ -219,6 +286,9 @@ def update_benchmark_chart(patient_name):
     # ========== CURRENT STATUS CARD ==========
     category = latest.get("Category", "")
     category_color = CATEGORY_COLORS.get(category, '#95a5a6')
+    clinic = get_sketches(store)
+    clinic_median = clinic.median(FAT_MASS_METRIC, latest['Sex'], latest['Age Group'])
+    clinic_scans = clinic.scans(FAT_MASS_METRIC, latest['Sex'], latest['Age Group'])
     
     current_status = [
         # Category badge
@@ -253,7 +323,8 @@ def update_benchmark_chart(patient_name):
         html.Div([
             html.Div("Population Median", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '5px'}),
             html.Div([
-                html.Span(f"{latest['NHANES_Median_FatMass_g']/1000:.1f}", style={
+                html.Span("—" if pd.isna(latest['NHANES_Median_FatMass_g'])
+                          else f"{latest['NHANES_Median_FatMass_g']/1000:.1f}", style={
                     'fontSize': '28px',
                     'fontWeight': 'bold',
                     'color': '#3498db'
@@ -262,11 +333,28 @@ def update_benchmark_chart(patient_name):
             ])
         ], style={'marginBottom': '20px'}),
         
+        # Our own clinic's median for the same sex and age group, from the
+        # streaming cohort sketches (dexa.sketches)
+        html.Div([
+            html.Div(f"Clinic Median ({latest['Sex']}, {latest['Age Group']})",
+                     style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '5px'}),
+            html.Div([
+                html.Span(f"{clinic_median/1000:.1f}" if pd.notna(clinic_median) else "—", style={
+                    'fontSize': '24px',
+                    'fontWeight': 'bold',
+                    'color': '#8e44ad'
+                }),
+                html.Span(f" kg · {clinic_scans:,} scans" if pd.notna(clinic_median) else "",
+                          style={'fontSize': '14px', 'color': '#7f8c8d'})
+            ])
+        ], style={'marginBottom': '20px'}),
+        
         # Difference
         html.Div([
             html.Div("Difference from Median", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '5px'}),
             html.Div(
-                f"{latest['FatMass_vs_Median_percent']:+.1f}%",
+                "—" if pd.isna(latest['FatMass_vs_Median_percent'])
+                else f"{latest['FatMass_vs_Median_percent']:+.1f}%",
                 style={
                     'fontSize': '24px',
                     'fontWeight': 'bold',
@@ -289,6 +377,9 @@ def update_benchmark_chart(patient_name):
         fat_change_g = latest['TotalBodyFat_g'] - first['TotalBodyFat_g']
         fat_change_pct = (fat_change_g / first['TotalBodyFat_g']) * 100
         
+        # Fitted over every scan (dexa.trends), not just the first and last
+        fat_trend = store.patient_trends(patient_name)['Total Body Fat (%)']
+        
         # Determine trend
         if abs(fat_change_pct) < 2:
             trend_icon = "➡️"
@@ -325,6 +416,20 @@ def update_benchmark_chart(patient_name):
                 )
             ], style={'marginBottom': '15px'}),
             
+            html.Div([
+                html.Div("Body Fat Trend", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '5px'}),
+                html.Div(
+                    f"{fat_trend['Slope / Month']:+.2f}% per month (R² {fat_trend['R²']:.2f})"
+                    if pd.notna(fat_trend['Slope / Month']) else "Not enough scan dates",
+                    style={'fontSize': '14px', 'color': '#2c3e50'}
+                ),
+                html.Div(
+                    f"Projected {fat_trend['Projection']:.1f}% in {PROJECTION_MONTHS} months"
+                    if pd.notna(fat_trend['Projection']) else "",
+                    style={'fontSize': '12px', 'color': '#95a5a6'}
+                )
+            ], style={'marginBottom': '15px'}),
+            
             html.Div([
                 html.Div("Total Scans", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '5px'}),
                 html.Div(f"{len(patient_df)} scans", style={'fontSize': '16px', 'fontWeight': '600', 'color': '#2c3e50'})
@@ -343,69 +448,23 @@ def update_benchmark_chart(patient_name):
         ]
 
     # ========== MAIN GRAPH ==========
-    fig = go.Figure()
-
-    # Patient's actual fat mass
-    fig.add_trace(go.Scatter(
-        x=patient_df["Scan Date"],
-        y=patient_df["TotalBodyFat_g"]/1000,  # Convert to kg
-        mode='lines+markers',
-        name='Actual Fat Mass',
-        line=dict(color='#e74c3c', width=4),
-        marker=dict(size=10, line=dict(width=2, color='white')),
-        hovertemplate='<b>%{x|%b %d, %Y}</b><br>Fat Mass: %{y:.1f} kg<extra></extra>'
-    ))
-
-    # NHANES median reference
-    fig.add_trace(go.Scatter(
-        x=patient_df["Scan Date"],
-        y=patient_df["NHANES_Median_FatMass_g"]/1000,  # Convert to kg
-        mode='lines+markers',
-        name='Population Median',
-        line=dict(color='#3498db', width=3, dash='dash'),
-        marker=dict(size=8),
-        hovertemplate='<b>%{x|%b %d, %Y}</b><br>Median: %{y:.1f} kg<extra></extra>'
-    ))
-
-    # Add shaded region for "within expected" range (±15%)
-    median_values = patient_df["NHANES_Median_FatMass_g"]/1000
+    dates = patient_df["Scan Date"].dt.strftime('%Y-%m-%d').tolist()
+    median_values = patient_df["NHANES_Median_FatMass_g"]/1000  # Convert to kg
     upper_bound = median_values * 1.15
     lower_bound = median_values * 0.85
 
-    fig.add_trace(go.Scatter(
-        x=patient_df["Scan Date"].tolist() + patient_df["Scan Date"].tolist()[::-1],
-        y=upper_bound.tolist() + lower_bound.tolist()[::-1],
-        fill='toself',
-        fillcolor='rgba(39, 174, 96, 0.1)',
-        line=dict(width=0),
-        showlegend=True,
-        name='Expected Range (±15%)',
-        hoverinfo='skip'
-    ))
-
-    fig.update_layout(
-        title={
-            'text': f"Fat Mass Trajectory vs Population Benchmark",
-            'font': {'size': 20, 'color': '#2c3e50'}
-        },
-        xaxis_title="Scan Date",
-        yaxis_title="Fat Mass (kg)",
-        template="plotly_white",
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        hovermode='x unified',
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
-        yaxis=dict(gridcolor='#ecf0f1')
+    fig = benchmark_patch(
+        BENCHMARK_TITLE,
+        dates=dates,
+        actual=(patient_df["TotalBodyFat_g"]/1000).tolist(),
+        median=median_values.tolist(),
+        band_x=dates + dates[::-1],
+        band_y=upper_bound.tolist() + lower_bound.tolist()[::-1]
     )
 
     # ========== INTERPRETATION BANNER ==========
-    interpretation = latest.get("Interpretation", "No interpretation available")
+    interpretation_text = (no_reference_message(latest['Sex'], latest['Age Group'], latest['Ethnicity'])
+                           if category == CATEGORIES[CATEGORY_NONE] else interpretation(category))
     
     interpretation_banner = html.Div([
         html.Div(
@@ -418,7 +477,7 @@ def update_benchmark_chart(patient_name):
             }
         ),
         html.Div(
-            interpretation,
+            interpretation_text,
             style={
                 'fontSize': '16px',
                 'color': '#2c3e50',
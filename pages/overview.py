@@ -1,9 +1,15 @@
-from dash import dcc, html, Input, Output, callback, register_page
-import plotly.express as px
+from dash import dcc, html, Input, Output, Patch, callback, register_page
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+import numpy as np
 import pandas as pd
 import warnings
+from datetime import date
+
+from dexa.figure_cache import cached_outputs
+from dexa.picker import patient_picker, register_patient_search
+from dexa.store import get_store
+from dexa.trends import PROJECTION_MONTHS
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
@@ -11,19 +17,6 @@ warnings.filterwarnings('ignore')
 # Register as home page
 register_page(__name__, path="/", order=1)
 
-# CSV paths
-MASTER_CSV_URL = "Data/master_dexa_data.csv" 
-COMPOSITION_CSV_URL = "Data/composition_indices.csv"
-
-def load_data():
-    master_df = pd.read_csv(MASTER_CSV_URL)
-    master_df["Scan Date"] = pd.to_datetime(master_df["Scan Date"], format="%m-%d-%Y")
-    
-    composition_df = pd.read_csv(COMPOSITION_CSV_URL)
-    composition_df["Scan Date"] = pd.to_datetime(composition_df["Scan Date"], format="%m-%d-%Y")
-    
-    return master_df.sort_values('Scan Date'), composition_df.sort_values('Scan Date')
-
 def get_trend_symbol(current, previous):
     return "↑" if current > previous else "↓" if current < previous else "→"
 
@@ -35,127 +28,294 @@ def get_trend_color(current, previous, lower_is_better=False):
         return '#e74c3c' if not lower_is_better else '#27ae60'
     return '#95a5a6'  # gray for no change
 
-master_df, composition_df = load_data()
+def format_value(value, spec, unit=""):
+    """value per the format spec, or "—" when missing (ingested scans carry no reported indices)"""
+    return "—" if pd.isna(value) else f"{value:{spec}}{unit}"
 
-# Layout with improved visual hierarchy
-layout = html.Div([
-    # Header with patient selector
-    html.Div([
-        html.H1("DEXA Patient Story", style={
-            'textAlign': 'center', 
-            'marginBottom': '10px',
-            'color': '#2c3e50',
-            'fontWeight': '600'
-        }),
-        html.Div([
-            dcc.Dropdown(
-                id='patient-selector',
-                options=[{'label': name, 'value': name} 
-                        for name in sorted(master_df["Patient Name"].unique())],
-                value=sorted(master_df["Patient Name"].unique())[0],
-                clearable=False,
-                style={'fontSize': '16px'}
-            )
-        ], style={'width': '400px', 'margin': '0 auto 30px auto'})
-    ], style={'backgroundColor': 'white', 'padding': '20px', 'marginBottom': '20px', 
-              'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'}),
+def format_change(current, previous, unit, scale=1):
+    """Arrow and size of the change since the previous scan, or "—" if either is missing"""
+    if pd.isna(current) or pd.isna(previous):
+        return "—"
+    return f"{get_trend_symbol(current, previous)} {abs(current - previous)/scale:.1f}{unit}"
+
+# Trend card rows: metric -> (label, unit, scale, decimals, lower_is_better)
+TREND_ROWS = {
+    'Total Body Fat (%)': ("Body Fat", "%", 1, 1, True),
+    'Lean (g)': ("Lean Mass", " kg", 1000, 1, False),
+    'Total Mass (kg)': ("Weight", " kg", 1, 1, None),
+    'Visceral Fat Area (cm²)': ("Visceral Fat", " cm²", 1, 0, True),
+}
+
+def trend_lines(trends):
+    """One line per metric: slope per month, and where the line is headed"""
+    if trends.xs('Slope / Month', level=1).isna().all():
+        return [html.Div("Needs scans on two or more dates", style={'fontSize': '13px', 'color': '#95a5a6'})]
+    lines = []
+    for metric, (label, unit, scale, decimals, lower_is_better) in TREND_ROWS.items():
+        slope = trends[metric]['Slope / Month'] / scale
+        if pd.isna(slope):
+            continue
+        projection = trends[metric]['Projection'] / scale
+        color = '#2c3e50' if lower_is_better is None else get_trend_color(slope, 0, lower_is_better=lower_is_better)
+        lines.append(html.Div([
+            html.Span(f"{label} ", style={'color': '#7f8c8d'}),
+            html.Span(f"{slope:+.{decimals + 1}f}{unit}/mo", style={'fontWeight': 'bold', 'color': color}),
+            html.Span(f" → {projection:.{decimals}f}{unit} in {PROJECTION_MONTHS} mo", style={'color': '#95a5a6'})
+        ], style={'fontSize': '13px'}))
+    return lines
+
+# ========== FIGURE SKELETONS ==========
+# Styling and layout are built once and shipped with the page; patient
+# changes only patch in the x/y arrays (and the body fat y-range)
+def add_cohort_band(fig):
+    """p90, p10 (filled up to p90) and median of the patient's sex/age cohort, after the patient trace"""
+    fig.add_trace(go.Scatter(x=[], y=[], name="Cohort p90", mode='lines', line=dict(width=0),
+                             showlegend=False))
+    fig.add_trace(go.Scatter(x=[], y=[], name="Cohort p10", mode='lines', line=dict(width=0),
+                             fill='tonexty', fillcolor='rgba(127, 140, 141, 0.15)'))
+    fig.add_trace(go.Scatter(x=[], y=[], name="Cohort median", mode='lines',
+                             line=dict(color='#7f8c8d', width=2, dash='dash')))
+
+def patch_cohort_band(fig, dates, bands):
+    """Fill add_cohort_band's traces with one (p10, p50, p90) row per date"""
+    for trace, column in ((1, 2), (2, 0), (3, 1)):
+        fig['data'][trace]['x'] = dates
+        fig['data'][trace]['y'] = bands[:, column].tolist()
+
+def build_composition_figure():
+    comp_fig = go.Figure()
+    
+    # Show only Body Fat % with proper dynamic scale
+    comp_fig.add_trace(go.Scatter(
+        x=[], 
+        y=[],
+        name="Body Fat %",
+        line=dict(color='#e74c3c', width=4),
+        mode='lines+markers',
+        marker=dict(size=8),
+        fill='tozeroy',
+        fillcolor='rgba(231, 76, 60, 0.1)'
+    ))
+    add_cohort_band(comp_fig)
+    
+    comp_fig.update_layout(
+        title={
+            'text': "Body Fat Percentage Over Time",
+            'font': {'size': 20, 'color': '#2c3e50', 'family': 'Arial, sans-serif'}
+        },
+        yaxis=dict(
+            range=[0, 100],  # Replaced by the patient's dynamic range
+            title="Body Fat (%)",
+            gridcolor='#ecf0f1',
+            showgrid=True
+        ),
+        xaxis=dict(
+            title="",
+            gridcolor='#ecf0f1'
+        ),
+        template="plotly_white",
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        hovermode='x unified'
+    )
+    return comp_fig
+
+def build_weight_lean_figure():
+    weight_lean_fig = make_subplots(specs=[[{"secondary_y": True}]])
+    
+    weight_lean_fig.add_trace(
+        go.Scatter(
+            x=[], 
+            y=[],
+            name="Weight",
+            line=dict(color='#2c3e50', width=3),
+            mode='lines+markers',
+            marker=dict(size=6)
+        ),
+        secondary_y=False
+    )
+    
+    weight_lean_fig.add_trace(
+        go.Scatter(
+            x=[], 
+            y=[],
+            name="Lean Mass",
+            line=dict(color='#3498db', width=3),
+            mode='lines+markers',
+            marker=dict(size=6)
+        ),
+        secondary_y=True
+    )
+    
+    weight_lean_fig.update_layout(
+        title={
+            'text': "Weight & Lean Mass Progression",
+            'font': {'size': 18, 'color': '#2c3e50'}
+        },
+        template="plotly_white",
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        hovermode='x unified',
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    
+    weight_lean_fig.update_yaxes(title_text="Weight (kg)", secondary_y=False, gridcolor='#ecf0f1')
+    weight_lean_fig.update_yaxes(title_text="Lean Mass (kg)", secondary_y=True, gridcolor='#ecf0f1')
+    return weight_lean_fig
+
+def build_visceral_figure():
+    visceral_fig = go.Figure()
     
-    # Key Metrics Banner (Big Numbers)
-    html.Div(id='key-metrics-banner', style={
-        'display': 'grid', 
-        'gridTemplateColumns': 'repeat(4, 1fr)', 
-        'gap': '15px', 
-        'marginBottom': '25px'
-    }),
+    visceral_fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        name="Visceral Fat",
+        line=dict(color='#c0392b', width=3),
+        mode='lines+markers',
+        marker=dict(size=7),
+        fill='tozeroy',
+        fillcolor='rgba(192, 57, 43, 0.1)'
+    ))
+    add_cohort_band(visceral_fig)
     
-    # Main Story Section - 2 columns
-    html.Div([
-        # Left: Timeline & Composition
+    visceral_fig.update_layout(
+        title={
+            'text': "⚠️ Visceral Fat Area Trend (Health Risk Indicator)",
+            'font': {'size': 18, 'color': '#2c3e50'}
+        },
+        yaxis=dict(title="Visceral Fat (cm²)", gridcolor='#ecf0f1'),
+        xaxis=dict(title="", gridcolor='#ecf0f1'),
+        template="plotly_white",
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        hovermode='x unified'
+    )
+    return visceral_fig
+
+composition_skeleton = build_composition_figure()
+weight_lean_skeleton = build_weight_lean_figure()
+visceral_skeleton = build_visceral_figure()
+
+# Layout with improved visual hierarchy (built per visit: the picker's
+# default patient needs the data, which loads after the server is up)
+def layout():
+    return html.Div([
+        # Header with patient selector
         html.Div([
-            # Body Composition Over Time (Primary Story)
-            html.Div([
-                dcc.Graph(id='body-composition-timeline', style={'height': '400px'})
-            ], style={
-                'backgroundColor': 'white', 
-                'padding': '20px', 
-                'borderRadius': '8px', 
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
+            html.H1("DEXA Patient Story", style={
+                'textAlign': 'center', 
+                'marginBottom': '10px',
+                'color': '#2c3e50',
+                'fontWeight': '600'
             }),
-            
-            # Weight & Lean Mass Trends
             html.Div([
-                dcc.Graph(id='weight-lean-trends', style={'height': '350px'})
-            ], style={
-                'backgroundColor': 'white', 
-                'padding': '20px', 
-                'borderRadius': '8px', 
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
-            })
-        ], style={'width': '65%', 'display': 'inline-block', 'verticalAlign': 'top'}),
-        
-        # Right: Current Status & Insights
+                patient_picker(
+                    'patient-selector',
+                    clearable=False,
+                    style={'fontSize': '16px'}
+                )
+            ], style={'width': '400px', 'margin': '0 auto 30px auto'})
+        ], style={'backgroundColor': 'white', 'padding': '20px', 'marginBottom': '20px', 
+                  'boxShadow': '0 2px 8px rgba(0,0,0,0.1)'}),
+    
+        # Key Metrics Banner (Big Numbers)
+        html.Div(id='key-metrics-banner', style={
+            'display': 'grid', 
+            'gridTemplateColumns': 'repeat(4, 1fr)', 
+            'gap': '15px', 
+            'marginBottom': '25px'
+        }),
+    
+        # Main Story Section - 2 columns
         html.Div([
-            # Current Snapshot Card
+            # Left: Timeline & Composition
             html.Div([
-                html.H3("📊 Current Status", style={
-                    'marginBottom': '15px', 
-                    'color': '#2c3e50',
-                    'fontSize': '20px'
+                # Body Composition Over Time (Primary Story)
+                html.Div([
+                    dcc.Graph(id='body-composition-timeline', figure=composition_skeleton, style={'height': '400px'})
+                ], style={
+                    'backgroundColor': 'white', 
+                    'padding': '20px', 
+                    'borderRadius': '8px', 
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                    'marginBottom': '20px'
                 }),
-                html.Div(id='current-status-card')
-            ], style={
-                'backgroundColor': 'white', 
-                'padding': '20px', 
-                'borderRadius': '8px', 
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
-            }),
             
-            # Progress & Records
+                # Weight & Lean Mass Trends
+                html.Div([
+                    dcc.Graph(id='weight-lean-trends', figure=weight_lean_skeleton, style={'height': '350px'})
+                ], style={
+                    'backgroundColor': 'white', 
+                    'padding': '20px', 
+                    'borderRadius': '8px', 
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
+                })
+            ], style={'width': '65%', 'display': 'inline-block', 'verticalAlign': 'top'}),
+        
+            # Right: Current Status & Insights
             html.Div([
-                html.H3("🏆 Progress & Records", style={
-                    'marginBottom': '15px', 
-                    'color': '#2c3e50',
-                    'fontSize': '20px'
+                # Current Snapshot Card
+                html.Div([
+                    html.H3("📊 Current Status", style={
+                        'marginBottom': '15px', 
+                        'color': '#2c3e50',
+                        'fontSize': '20px'
+                    }),
+                    html.Div(id='current-status-card')
+                ], style={
+                    'backgroundColor': 'white', 
+                    'padding': '20px', 
+                    'borderRadius': '8px', 
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                    'marginBottom': '20px'
                 }),
-                html.Div(id='progress-records-card')
-            ], style={
-                'backgroundColor': 'white', 
-                'padding': '20px', 
-                'borderRadius': '8px', 
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-                'marginBottom': '20px'
-            }),
             
-            # Key Ratios
-            html.Div([
-                html.H3("📐 Key Ratios", style={
-                    'marginBottom': '15px', 
-                    'color': '#2c3e50',
-                    'fontSize': '20px'
+                # Progress & Records
+                html.Div([
+                    html.H3("🏆 Progress & Records", style={
+                        'marginBottom': '15px', 
+                        'color': '#2c3e50',
+                        'fontSize': '20px'
+                    }),
+                    html.Div(id='progress-records-card')
+                ], style={
+                    'backgroundColor': 'white', 
+                    'padding': '20px', 
+                    'borderRadius': '8px', 
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+                    'marginBottom': '20px'
                 }),
-                html.Div(id='ratios-card')
-            ], style={
-                'backgroundColor': 'white', 
-                'padding': '20px', 
-                'borderRadius': '8px', 
-                'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
-            })
-        ], style={'width': '33%', 'display': 'inline-block', 'verticalAlign': 'top', 'marginLeft': '2%'})
-    ]),
+            
+                # Key Ratios
+                html.Div([
+                    html.H3("📐 Key Ratios", style={
+                        'marginBottom': '15px', 
+                        'color': '#2c3e50',
+                        'fontSize': '20px'
+                    }),
+                    html.Div(id='ratios-card')
+                ], style={
+                    'backgroundColor': 'white', 
+                    'padding': '20px', 
+                    'borderRadius': '8px', 
+                    'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'
+                })
+            ], style={'width': '33%', 'display': 'inline-block', 'verticalAlign': 'top', 'marginLeft': '2%'})
+        ]),
     
-    # Bottom: Visceral Fat (Important Health Metric)
-    html.Div([
-        dcc.Graph(id='visceral-fat-graph', style={'height': '300px'})
-    ], style={
-        'backgroundColor': 'white', 
-        'padding': '20px', 
-        'borderRadius': '8px', 
-        'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
-        'marginTop': '25px'
-    })
-], style={'backgroundColor': '#f5f7fa', 'padding': '20px', 'minHeight': '100vh'})
+        # Bottom: Visceral Fat (Important Health Metric)
+        html.Div([
+            dcc.Graph(id='visceral-fat-graph', figure=visceral_skeleton, style={'height': '300px'})
+        ], style={
+            'backgroundColor': 'white', 
+            'padding': '20px', 
+            'borderRadius': '8px', 
+            'boxShadow': '0 2px 4px rgba(0,0,0,0.1)',
+            'marginTop': '25px'
+        })
+    ], style={'backgroundColor': '#f5f7fa', 'padding': '20px', 'minHeight': '100vh'})
+
+register_patient_search('patient-selector')
 
 @callback(
     [Output('key-metrics-banner', 'children'),
@@ -167,18 +327,38 @@ layout = html.Div([
      Output('visceral-fat-graph', 'figure')],
     Input('patient-selector', 'value')
 )
+# "days ago" changes daily; the cohort percentiles and bands with anyone's scans
+@cached_outputs("overview", key=lambda: [date.today().isoformat()], cohort=True)
 def update_page_content(selected_patient):
-    patient_master_df = master_df[master_df['Patient Name'] == selected_patient]
-    patient_composition_df = composition_df[composition_df['Patient Name'] == selected_patient]
-    
+    # Shared data with a per-patient row index; one store per call so a hot
+    # reload mid-request can't mix data versions
+    store = get_store()
+    patient_master_df = store.patient_master(selected_patient)
+    patient_composition_df = store.patient_composition(selected_patient)
     total_df = patient_master_df[patient_master_df['Body Part'] == 'Total'].sort_values('Scan Date')
-    latest_date = total_df['Scan Date'].max()
-    latest_row = total_df[total_df['Scan Date'] == latest_date].iloc[0]
-    latest_comp = patient_composition_df.iloc[-1]
+    
+    # Card values come precomputed, one row per patient (dexa.summary)
+    summary = store.patient_summary(selected_patient)
+    latest_row = summary['latest_total']
+    latest_comp = summary['latest_composition']
+    records = summary['records']
+    latest_date = records['Last Scan Date']
     
     # Previous values for comparison
-    prev_row = total_df.iloc[-2] if len(total_df) > 1 else latest_row
-    prev_comp = patient_composition_df.iloc[-2] if len(patient_composition_df) > 1 else latest_comp
+    prev_row = summary['previous_total']
+    prev_comp = summary['previous_composition']
+    
+    # Fitted trend per metric across all scans (dexa.trends)
+    trends = store.patient_trends(selected_patient)
+    
+    # Cohort (same sex and age group at each scan) percentiles and bands
+    # from the precomputed reference arrays (dexa.percentiles)
+    cohorts = store.cohort_percentiles()
+    demographics = store.patient_benchmark(selected_patient)
+    sex, age_group = demographics['Sex'].iloc[-1], demographics['Age Group'].iloc[-1]
+    bf_percentile = cohorts.percentile('Total Body Fat (%)', latest_comp['Total Body Fat (%)'], sex, age_group)
+    bf_bands = cohorts.bands_for('Total Body Fat (%)', demographics['Sex'], demographics['Age Group'])
+    visceral_bands = cohorts.bands_for('Visceral Fat Area (cm²)', demographics['Sex'], demographics['Age Group'])
     
     # ========== KEY METRICS BANNER (Big Numbers) ==========
     key_metrics = [
@@ -190,7 +370,7 @@ def update_page_content(selected_patient):
                 html.Span(" kg", style={'fontSize': '18px', 'color': '#7f8c8d'})
             ]),
             html.Div(
-                f"{get_trend_symbol(latest_row['Total Mass (kg)'], prev_row['Total Mass (kg)'])} {abs(latest_row['Total Mass (kg)'] - prev_row['Total Mass (kg)']):.1f} kg", 
+                format_change(latest_row['Total Mass (kg)'], prev_row['Total Mass (kg)'], " kg"), 
                 style={'fontSize': '14px', 'color': get_trend_color(latest_row['Total Mass (kg)'], prev_row['Total Mass (kg)'], lower_is_better=False), 'marginTop': '5px'}
             )
         ], style={'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '8px', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)', 'textAlign': 'center'}),
@@ -203,8 +383,12 @@ def update_page_content(selected_patient):
                 html.Span(" %", style={'fontSize': '18px', 'color': '#7f8c8d'})
             ]),
             html.Div(
-                f"{get_trend_symbol(latest_comp['Total Body Fat (%)'], prev_comp['Total Body Fat (%)'])} {abs(latest_comp['Total Body Fat (%)'] - prev_comp['Total Body Fat (%)']):.1f}%", 
+                format_change(latest_comp['Total Body Fat (%)'], prev_comp['Total Body Fat (%)'], "%"), 
                 style={'fontSize': '14px', 'color': get_trend_color(latest_comp['Total Body Fat (%)'], prev_comp['Total Body Fat (%)'], lower_is_better=True), 'marginTop': '5px'}
+            ),
+            html.Div(
+                f"Percentile {bf_percentile:.0f} among {sex} {age_group}" if pd.notna(bf_percentile) else "No cohort comparison",
+                style={'fontSize': '12px', 'color': '#95a5a6', 'marginTop': '3px'}
             )
         ], style={'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '8px', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)', 'textAlign': 'center'}),
         
@@ -216,7 +400,7 @@ def update_page_content(selected_patient):
                 html.Span(" kg", style={'fontSize': '18px', 'color': '#7f8c8d'})
             ]),
             html.Div(
-                f"{get_trend_symbol(latest_row['Lean (g)'], prev_row['Lean (g)'])} {abs(latest_row['Lean (g)'] - prev_row['Lean (g)'])/1000:.1f} kg", 
+                format_change(latest_row['Lean (g)'], prev_row['Lean (g)'], " kg", scale=1000), 
                 style={'fontSize': '14px', 'color': get_trend_color(latest_row['Lean (g)'], prev_row['Lean (g)'], lower_is_better=False), 'marginTop': '5px'}
             )
         ], style={'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '8px', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)', 'textAlign': 'center'}),
@@ -225,11 +409,11 @@ def update_page_content(selected_patient):
         html.Div([
             html.Div("BMI", style={'fontSize': '14px', 'color': '#7f8c8d', 'marginBottom': '5px'}),
             html.Div([
-                html.Span(f"{latest_comp['BMI (kg/m²)']:.1f}", style={'fontSize': '36px', 'fontWeight': 'bold', 'color': '#2c3e50'}),
+                html.Span(format_value(latest_comp['BMI (kg/m²)'], ".1f"), style={'fontSize': '36px', 'fontWeight': 'bold', 'color': '#2c3e50'}),
                 html.Span(" kg/m²", style={'fontSize': '18px', 'color': '#7f8c8d'})
             ]),
             html.Div(
-                f"{get_trend_symbol(latest_comp['BMI (kg/m²)'], prev_comp['BMI (kg/m²)'])} {abs(latest_comp['BMI (kg/m²)'] - prev_comp['BMI (kg/m²)']):.1f}", 
+                format_change(latest_comp['BMI (kg/m²)'], prev_comp['BMI (kg/m²)'], ""), 
                 style={'fontSize': '14px', 'color': get_trend_color(latest_comp['BMI (kg/m²)'], prev_comp['BMI (kg/m²)'], lower_is_better=False), 'marginTop': '5px'}
             )
         ], style={'backgroundColor': 'white', 'padding': '20px', 'borderRadius': '8px', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)', 'textAlign': 'center'})
@@ -237,6 +421,10 @@ def update_page_content(selected_patient):
     
     # ========== CURRENT STATUS CARD ==========
     days_since = (pd.Timestamp.now() - latest_date).days
+    # Total BMC is often left blank; the bone share (dexa.composition) covers the whole body
+    bone_g = latest_row['BMC (g)']
+    if pd.isna(bone_g):
+        bone_g = latest_comp['Total Bone Mass (%)'] / 100 * latest_row['Tissues (g)']
     current_status = [
         html.Div([
             html.Span("Last Scan: ", style={'fontWeight': 'bold', 'color': '#2c3e50'}),
@@ -251,13 +439,14 @@ def update_page_content(selected_patient):
         
         html.Div([
             html.Div("Bone Mass", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_row['BMC (g)']/1000:.2f} kg ({latest_comp['Total Bone Mass (%)']:.1f}%)", 
+            html.Div(f"{format_value(bone_g / 1000, '.2f', ' kg')} "
+                     f"({format_value(latest_comp['Total Bone Mass (%)'], '.1f', '%')})", 
                     style={'fontSize': '20px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ], style={'marginBottom': '12px'}),
         
         html.Div([
             html.Div("Basal Metabolic Rate", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_comp['Basal Metabolic Rate (kcal/day)']:.0f} kcal/day", 
+            html.Div(format_value(latest_comp['Basal Metabolic Rate (kcal/day)'], ".0f", " kcal/day"), 
                     style={'fontSize': '20px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ])
     ]
@@ -266,25 +455,30 @@ def update_page_content(selected_patient):
     progress_records = [
         html.Div([
             html.Div("💪 Best Lean Mass", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '3px'}),
-            html.Div(f"{total_df['Lean (g)'].max()/1000:.1f} kg", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#27ae60'}),
-            html.Div(f"{total_df.loc[total_df['Lean (g)'].idxmax(), 'Scan Date'].strftime('%b %Y')}", 
+            html.Div(f"{records['Best Lean (g)']/1000:.1f} kg", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#27ae60'}),
+            html.Div(f"{records['Best Lean Date'].strftime('%b %Y')}", 
                     style={'fontSize': '12px', 'color': '#95a5a6'})
         ], style={'marginBottom': '15px'}),
         
         html.Div([
             html.Div("🎯 Lowest Body Fat", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '3px'}),
-            html.Div(f"{patient_composition_df['Total Body Fat (%)'].min():.1f}%", 
+            html.Div(f"{records['Lowest Body Fat (%)']:.1f}%", 
                     style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#27ae60'}),
-            html.Div(f"{patient_composition_df.loc[patient_composition_df['Total Body Fat (%)'].idxmin(), 'Scan Date'].strftime('%b %Y')}", 
+            html.Div(f"{records['Lowest Body Fat Date'].strftime('%b %Y')}", 
                     style={'fontSize': '12px', 'color': '#95a5a6'})
         ], style={'marginBottom': '15px'}),
         
         html.Div([
             html.Div("⚖️ Weight Range", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '3px'}),
-            html.Div(f"{total_df['Total Mass (kg)'].min():.1f} - {total_df['Total Mass (kg)'].max():.1f} kg", 
+            html.Div(f"{records['Min Weight (kg)']:.1f} - {records['Max Weight (kg)']:.1f} kg", 
                     style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'}),
-            html.Div(f"Δ {total_df['Total Mass (kg)'].max() - total_df['Total Mass (kg)'].min():.1f} kg range", 
+            html.Div(f"Δ {records['Max Weight (kg)'] - records['Min Weight (kg)']:.1f} kg range", 
                     style={'fontSize': '12px', 'color': '#95a5a6'})
+        ], style={'marginBottom': '15px'}),
+        
+        html.Div([
+            html.Div("📈 Monthly Trend", style={'color': '#7f8c8d', 'fontSize': '13px', 'marginBottom': '3px'}),
+            *trend_lines(trends)
         ])
     ]
     
@@ -292,136 +486,52 @@ def update_page_content(selected_patient):
     ratios = [
         html.Div([
             html.Div("Fat Mass Index", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_comp['Fat Mass Index (FMI)']:.1f}", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
+            html.Div(format_value(latest_comp['Fat Mass Index (FMI)'], ".1f"), style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ], style={'marginBottom': '12px'}),
         
         html.Div([
             html.Div("Lean Mass Index", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_comp['Lean Mass Index (kg/m²)']:.1f}", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
+            html.Div(format_value(latest_comp['Lean Mass Index (kg/m²)'], ".1f"), style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ], style={'marginBottom': '12px'}),
         
         html.Div([
             html.Div("Android/Gynoid Ratio", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_comp['Android/Gynoid Fat Ratio']:.2f}", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
+            html.Div(format_value(latest_comp['Android/Gynoid Fat Ratio'], ".2f"), style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ], style={'marginBottom': '12px'}),
         
         html.Div([
             html.Div("Trunk/Leg Ratio", style={'color': '#7f8c8d', 'fontSize': '13px'}),
-            html.Div(f"{latest_comp['Trunk/Legs Fat Ratio']:.2f}", style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
+            html.Div(format_value(latest_comp['Trunk/Legs Fat Ratio'], ".2f"), style={'fontSize': '18px', 'fontWeight': 'bold', 'color': '#2c3e50'})
         ])
     ]
     
-    # ========== BODY COMPOSITION TIMELINE (Main Story Graph) ==========
-    comp_fig = go.Figure()
-    
+    # ========== FIGURES: patch data + y-range into the static skeletons ==========
     # Calculate dynamic y-axis range based on data
-    bf_min = patient_composition_df['Total Body Fat (%)'].min()
-    bf_max = patient_composition_df['Total Body Fat (%)'].max()
+    bf_min = np.nanmin([records['Lowest Body Fat (%)'], *bf_bands[:, 0]])
+    bf_max = np.nanmax([records['Highest Body Fat (%)'], *bf_bands[:, 2]])
     
     # Add 5% padding to the range for visual comfort
     y_range_min = max(0, bf_min - 5)  # Don't go below 0
     y_range_max = min(100, bf_max + 5)  # Don't go above 100
     
-    # Show only Body Fat % with proper dynamic scale
-    comp_fig.add_trace(go.Scatter(
-        x=patient_composition_df['Scan Date'], 
-        y=patient_composition_df['Total Body Fat (%)'],
-        name="Body Fat %",
-        line=dict(color='#e74c3c', width=4),
-        mode='lines+markers',
-        marker=dict(size=8),
-        fill='tozeroy',
-        fillcolor='rgba(231, 76, 60, 0.1)'
-    ))
+    comp_dates = patient_composition_df['Scan Date'].dt.strftime('%Y-%m-%d').tolist()
+    total_dates = total_df['Scan Date'].dt.strftime('%Y-%m-%d').tolist()
     
-    comp_fig.update_layout(
-        title={
-            'text': "Body Fat Percentage Over Time",
-            'font': {'size': 20, 'color': '#2c3e50', 'family': 'Arial, sans-serif'}
-        },
-        yaxis=dict(
-            range=[y_range_min, y_range_max],  # Dynamic range based on data
-            title="Body Fat (%)",
-            gridcolor='#ecf0f1',
-            showgrid=True
-        ),
-        xaxis=dict(
-            title="",
-            gridcolor='#ecf0f1'
-        ),
-        template="plotly_white",
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        hovermode='x unified'
-    )
+    comp_fig = Patch()
+    comp_fig['data'][0]['x'] = comp_dates
+    comp_fig['data'][0]['y'] = patient_composition_df['Total Body Fat (%)'].tolist()
+    comp_fig['layout']['yaxis']['range'] = [y_range_min, y_range_max]
+    patch_cohort_band(comp_fig, comp_dates, bf_bands)
     
-    # ========== WEIGHT & LEAN MASS TRENDS ==========
-    weight_lean_fig = make_subplots(specs=[[{"secondary_y": True}]])
+    weight_lean_fig = Patch()
+    weight_lean_fig['data'][0]['x'] = total_dates
+    weight_lean_fig['data'][0]['y'] = total_df['Total Mass (kg)'].tolist()
+    weight_lean_fig['data'][1]['x'] = total_dates
+    weight_lean_fig['data'][1]['y'] = (total_df['Lean (g)']/1000).tolist()
     
-    weight_lean_fig.add_trace(
-        go.Scatter(
-            x=total_df['Scan Date'], 
-            y=total_df['Total Mass (kg)'],
-            name="Weight",
-            line=dict(color='#2c3e50', width=3),
-            mode='lines+markers',
-            marker=dict(size=6)
-        ),
-        secondary_y=False
-    )
-    
-    weight_lean_fig.add_trace(
-        go.Scatter(
-            x=total_df['Scan Date'], 
-            y=total_df['Lean (g)']/1000,
-            name="Lean Mass",
-            line=dict(color='#3498db', width=3),
-            mode='lines+markers',
-            marker=dict(size=6)
-        ),
-        secondary_y=True
-    )
-    
-    weight_lean_fig.update_layout(
-        title={
-            'text': "Weight & Lean Mass Progression",
-            'font': {'size': 18, 'color': '#2c3e50'}
-        },
-        template="plotly_white",
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        hovermode='x unified',
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-    
-    weight_lean_fig.update_yaxes(title_text="Weight (kg)", secondary_y=False, gridcolor='#ecf0f1')
-    weight_lean_fig.update_yaxes(title_text="Lean Mass (kg)", secondary_y=True, gridcolor='#ecf0f1')
-    
-    # ========== VISCERAL FAT GRAPH ==========
-    visceral_fig = go.Figure()
-    
-    visceral_fig.add_trace(go.Scatter(
-        x=patient_composition_df['Scan Date'],
-        y=patient_composition_df['Visceral Fat Area (cm²)'],
-        name="Visceral Fat",
-        line=dict(color='#c0392b', width=3),
-        mode='lines+markers',
-        marker=dict(size=7),
-        fill='tozeroy',
-        fillcolor='rgba(192, 57, 43, 0.1)'
-    ))
-    
-    visceral_fig.update_layout(
-        title={
-            'text': "⚠️ Visceral Fat Area Trend (Health Risk Indicator)",
-            'font': {'size': 18, 'color': '#2c3e50'}
-        },
-        yaxis=dict(title="Visceral Fat (cm²)", gridcolor='#ecf0f1'),
-        xaxis=dict(title="", gridcolor='#ecf0f1'),
-        template="plotly_white",
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        hovermode='x unified'
-    )
+    visceral_fig = Patch()
+    visceral_fig['data'][0]['x'] = comp_dates
+    visceral_fig['data'][0]['y'] = patient_composition_df['Visceral Fat Area (cm²)'].tolist()
+    patch_cohort_band(visceral_fig, comp_dates, visceral_bands)
     
-    return key_metrics, current_status, progress_records, ratios, comp_fig, weight_lean_fig, visceral_fig
\ No newline at end of file
+    return key_metrics, current_status, progress_records, ratios, comp_fig, weight_lean_fig, visceral_fig
@@ -0,0 +1,66 @@
+from dash import dcc, html, Input, Output, callback, register_page, dash_table
+
+from dexa.picker import patient_picker, register_patient_search
+from dexa.similarity import DEFAULT_K, DISPLAY_COLUMNS
+from dexa.store import get_store
+
+register_page(__name__, path="/similar-patients", name="Similar Patients", order=5)
+
+K_OPTIONS = [5, 10, 20, 50]
+TABLE_COLUMNS = ["Patient Name", "Distance", "Latest Scan"] + DISPLAY_COLUMNS
+
+# Page layout (built per visit, so importing the page loads no data)
+def layout():
+    return html.Div([
+        html.H2("Similar Patients", style={'textAlign': 'center'}),
+        html.P("Patients whose latest scan is closest to the selected patient's: regional fat, "
+               "lean and bone mass plus the composition indices, each scaled to the population's "
+               "standard deviation. Distance 0 means an identical scan.",
+               style={'textAlign': 'center', 'color': '#666'}),
+
+        html.Div([
+            html.Div([
+                html.Label("Select Patient:"),
+                patient_picker('similar-patient-dropdown', clearable=False)
+            ], style={'width': '45%', 'display': 'inline-block', 'marginRight': '5%'}),
+            html.Div([
+                html.Label("Matches:"),
+                dcc.Dropdown(
+                    id='similar-k-dropdown',
+                    options=[{'label': str(k), 'value': k} for k in K_OPTIONS],
+                    value=DEFAULT_K,
+                    clearable=False
+                )
+            ], style={'width': '20%', 'display': 'inline-block'})
+        ], style={'width': '60%', 'margin': '20px auto'}),
+
+        html.Div([
+            dash_table.DataTable(
+                id='similar-patients-table',
+                columns=[{"name": col, "id": col} for col in TABLE_COLUMNS],
+                style_table={'overflowX': 'auto'},
+                style_cell={
+                    'textAlign': 'center',
+                    'padding': '10px'
+                },
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold'
+                }
+            )
+        ], style={'margin': '20px'})
+    ])
+
+register_patient_search('similar-patient-dropdown')
+
+@callback(
+    Output('similar-patients-table', 'data'),
+    [Input('similar-patient-dropdown', 'value'),
+     Input('similar-k-dropdown', 'value')]
+)
+def update_similar_patients(selected_patient, k):
+    # Not cached per patient: the matches change whenever anyone's data
+    # does. The index (dexa.similarity) is built once per data version.
+    matches = get_store().similar_patients(selected_patient, k or DEFAULT_K)
+    matches["Latest Scan"] = matches["Latest Scan"].dt.strftime('%Y-%m-%d')
+    return matches.round(2).to_dict('records')